@@ -0,0 +1,89 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from .metrics import CIRCUIT_STATE, CIRCUIT_REJECTED
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails calls to an external dependency fast while it is down.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls are
+    rejected with CircuitOpenError. Once `reset_seconds` have passed it goes
+    half-open and lets a single probe call through: success closes it, failure
+    opens it again. Only `failure_types` count as failures, so a bad request or a
+    cache miss never trips it.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float, failure_types: tuple):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failure_types = failure_types
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            print(f"⚡ Circuit {self.name}: {self.state} -> {state}")
+            self.state = state
+            CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at < self.reset_seconds:
+                return False
+            # A probe that never reported back (e.g. a cancelled stream) is replaced
+            if self.probe_started is not None and now - self.probe_started < self.reset_seconds:
+                return False
+            self._set_state(HALF_OPEN)
+            self.probe_started = now
+            return True
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return  # the common case, without taking the lock
+        with self._lock:
+            self.failures = 0
+            self.probe_started = None
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started = None
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    @contextmanager
+    def guard(self):
+        """Wraps one call: rejects it while open and records how it went"""
+        if not self.allow():
+            CIRCUIT_REJECTED.labels(self.name).inc()
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            yield
+        except self.failure_types:
+            self.record_failure()
+            raise
+        except Exception:
+            # Any other error (bad request, wrong type, ...) means it did answer
+            self.record_success()
+            raise
+        self.record_success()
@@ -0,0 +1,44 @@
+import hashlib
+
+from fastapi import Request, Response
+
+from .services.cache_service import get_collection_version
+
+# Browsers keep the copy but revalidate it on every use
+CACHE_CONTROL = "private, no-cache"
+
+
+def collection_etag(request: Request, user_id, collection: str) -> str | None:
+    """
+    Strong ETag for one user's view of a collection. Must be computed before the
+    query runs, so a write landing in between leaves the response with the older
+    version and the next request refetches. None when Redis is unavailable.
+    """
+    version = get_collection_version(user_id, collection)
+    if version is None:
+        return None
+    # Filters (e.g. ?tag=) produce different bodies for the same version
+    variant = hashlib.md5(request.url.query.encode()).hexdigest()[:8]
+    return f'"{collection}-{version}-{variant}"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses weak comparison
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def not_modified(request: Request, etag: str | None) -> Response | None:
+    """A 304 when the client already holds this version, otherwise None."""
+    if_none_match = request.headers.get("if-none-match")
+    if etag and if_none_match and _matches(if_none_match, etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    return None
+
+
+def etag_headers(etag: str | None) -> dict:
+    if not etag:
+        return {}
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
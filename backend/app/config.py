@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Literal, Optional
 
 class Settings(BaseSettings):
     # REQUIRED FIELDS
@@ -17,8 +18,170 @@ class Settings(BaseSettings):
     # Default is localhost, but can override this in .env for Production
     FRONTEND_URL: str = "http://localhost:3000"
 
+    # VECTOR SEARCH
+    # "full" ranks on the float32 column directly. "halfvec" / "bit" search a quantized
+    # expression index for candidates, then re-rank them against the full-precision vectors.
+    EMBEDDING_STORAGE: Literal["full", "halfvec", "bit"] = "full"
+    EMBEDDING_RERANK_FACTOR: int = 4
+    # Lower bound for hnsw.ef_search (raised to the candidate count when that is higher)
+    EMBEDDING_EF_SEARCH: int = 100
+
+    # DATABASE ENGINE
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_TIMEOUT_MS: int = 15000
+    # Transaction poolers (PgBouncer, Supabase port 6543) reject startup "options",
+    # so the statement timeout is applied per transaction instead.
+    DB_PGBOUNCER_MODE: bool = False
+    # None = echo SQL only in development
+    DB_ECHO: Optional[bool] = None
+
+    # READ REPLICA (optional)
+    # Listing and vector search run on the replica, except for users who wrote
+    # within the last READ_YOUR_WRITES_SECONDS (they stay on the primary).
+    DATABASE_REPLICA_URL: Optional[str] = None
+    READ_YOUR_WRITES_SECONDS: int = 5
+
+    # AUTH CACHE
+    # Authenticated user principals are cached per token subject: briefly in each
+    # worker, a little longer in Redis. Login / refresh / profile changes evict them.
+    AUTH_CACHE_SECONDS: int = 60
+    AUTH_LOCAL_CACHE_SECONDS: int = 10
+
+    # PASSWORD HASHING
+    # bcrypt cost factor; stored hashes with a different cost are upgraded at login
+    BCRYPT_ROUNDS: int = 12
+    # bcrypt runs in this many threads off the event loop; sign-ins beyond
+    # PASSWORD_HASH_MAX_PENDING in flight per worker get a 503
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 32
+    # A refresh token presented again this soon after its rotation (two tabs refreshing
+    # at once) gets the token it was rotated to instead of revoking the family
+    REFRESH_TOKEN_REUSE_GRACE_SECONDS: int = 10
+
+    # RATE LIMITING
+    # Counters live in Redis (defaults to REDIS_URL) so every worker enforces the same limits.
+    RATE_LIMIT_STORAGE_URI: Optional[str] = None
+    # LLM routes charge one unit per this many request-body bytes (~1k tokens)
+    RATE_LIMIT_LLM_COST_BYTES: int = 4000
+
+    # LLM
+    # "groq", or "stub" for a deterministic offline fake (load tests, benchmarks)
+    LLM_PROVIDER: Literal["groq", "stub"] = "groq"
+    LLM_STUB_LATENCY_MS: int = 300
+    LLM_STUB_TOKENS_PER_SECOND: float = 200
+    LLM_STUB_ERROR_RATE: float = 0.0
+    LLM_STUB_RESPONSE_TOKENS: int = 120
+    # How long a worker waits for another worker's identical in-flight request
+    LLM_COALESCE_WAIT_SECONDS: int = 30
+    # Governor: per-model concurrency caps and token-per-minute budgets (JSON in env).
+    # Provider rate-limit headers tighten these at runtime. They are enforced per worker
+    # process: with N workers the effective totals are N times these values.
+    LLM_MAX_CONCURRENCY: dict[str, int] = {"llama-3.3-70b-versatile": 4, "llama-3.1-8b-instant": 8}
+    LLM_TOKENS_PER_MINUTE: dict[str, int] = {"llama-3.3-70b-versatile": 12000, "llama-3.1-8b-instant": 6000}
+    LLM_DEFAULT_CONCURRENCY: int = 4
+    LLM_DEFAULT_TOKENS_PER_MINUTE: int = 6000
+    # Slots per model that background work (tagging) can never take
+    LLM_INTERACTIVE_RESERVE: int = 1
+    # Routing: routes allowed on the fast model, each with the largest input (in
+    # estimated tokens) it may send there. Everything else uses the smart model.
+    LLM_FAST_ROUTES: dict[str, int] = {"tags": 8000, "tags_batch": 8000, "title": 8000, "document": 600, "explain": 400}
+    # Batched tagging: snippets per request, and each snippet's share of the prompt
+    LLM_TAG_BATCH_SIZE: int = 10
+    LLM_TAG_SNIPPET_TOKENS: int = 300
+
+    # DELTA SYNC (GET /notes/changes)
+    # Changes are re-sent from this far before the cursor, covering transactions that
+    # were still in flight (and app-server clock skew) when the cursor was issued
+    SYNC_OVERLAP_SECONDS: int = 30
+    # Cursors older than this get a full reload (reset), since tombstones are pruned
+    SYNC_TOMBSTONE_RETENTION_DAYS: int = 30
+
+    # STALE-WHILE-REVALIDATE (search: and chat: caches)
+    # Entries are fresh for *_FRESH_SECONDS, then served stale for up to *_STALE_SECONDS
+    # while a single request refreshes them
+    SEARCH_CACHE_FRESH_SECONDS: int = 300
+    SEARCH_CACHE_STALE_SECONDS: int = 300
+    CHAT_CACHE_FRESH_SECONDS: int = 3600
+    CHAT_CACHE_STALE_SECONDS: int = 1800
+    # Identical chat messages wait this long for the first one's answer (it streams
+    # from the LLM, so much longer than CACHE_FILL_WAIT_SECONDS)
+    CHAT_FILL_WAIT_SECONDS: float = 30.0
+    # XFetch early recomputation: higher refreshes earlier (1.0 is the paper's default)
+    CACHE_XFETCH_BETA: float = 1.0
+    # Lease on a refresh / fill; also how long other requests wait for a fill
+    CACHE_REFRESH_LOCK_SECONDS: int = 10
+    CACHE_FILL_WAIT_SECONDS: float = 2.0
+
+    # DEPENDENCY TIMEOUTS & CIRCUIT BREAKERS
+    # A breaker opens after *_BREAKER_FAILURES consecutive connection errors / timeouts,
+    # fails calls fast, then lets one probe through every *_BREAKER_RESET_SECONDS
+    REDIS_SOCKET_TIMEOUT_SECONDS: float = 0.5
+    REDIS_CONNECT_TIMEOUT_SECONDS: float = 1.0
+    REDIS_BREAKER_FAILURES: int = 5
+    REDIS_BREAKER_RESET_SECONDS: float = 10
+    # Read timeout also bounds the gap between streamed chunks
+    GROQ_TIMEOUT_SECONDS: float = 30
+    GROQ_CONNECT_TIMEOUT_SECONDS: float = 3
+    GROQ_MAX_RETRIES: int = 1
+    LLM_BREAKER_FAILURES: int = 5
+    LLM_BREAKER_RESET_SECONDS: float = 30
+
+    # CACHED VALUE ENCODING
+    # Payloads at least this large are zlib-compressed (when that makes them smaller)
+    CACHE_COMPRESS_MIN_BYTES: int = 1024
+    CACHE_COMPRESS_LEVEL: int = 6
+    # Per-note entries that search results (stored as id lists) are hydrated from
+    NOTE_CACHE_SECONDS: int = 3600
+
+    # L1 CACHE (in-process, in front of Redis; 0 entries disables it)
+    L1_CACHE_PREFIXES: list[str] = ["explain", "fix", "search", "note"]
+    L1_CACHE_MAX_ENTRIES: int = 5000
+    L1_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    L1_CACHE_MAX_ITEM_BYTES: int = 512 * 1024
+    # Upper bound on staleness when an invalidation broadcast is missed
+    L1_CACHE_TTL_SECONDS: int = 30
+
+    # SERVER-SENT EVENTS (GET /events/stream)
+    # Comment frames keep proxies from closing idle streams
+    EVENTS_HEARTBEAT_SECONDS: int = 15
+    # Reconnect delay suggested to EventSource clients
+    EVENTS_RETRY_MS: int = 3000
+    # Lifetime of the single-use ?ticket= from POST /events/ticket
+    EVENTS_TICKET_SECONDS: int = 30
+    # Frames buffered per stream; a client further behind misses events and
+    # catches up through GET /notes/changes
+    EVENTS_QUEUE_SIZE: int = 100
+
+    # PROFILING (opt-in; the middleware is not installed unless enabled)
+    PROFILING_ENABLED: bool = False
+    # Only these accounts may trigger profiles (X-Profile header) or download them
+    PROFILING_ADMIN_EMAILS: list[str] = []
+    # Route templates (e.g. "/notes/search/") sampled automatically at PROFILING_SAMPLE_RATE
+    PROFILING_ROUTES: list[str] = []
+    PROFILING_SAMPLE_RATE: float = 0.01
+    PROFILING_INTERVAL_MS: float = 1.0
+    PROFILING_DIR: str = "/tmp/kodasync-profiles"
+    PROFILING_MAX_FILES: int = 200
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
+    def engine_options(self) -> dict:
+        """Keyword arguments for create_engine(), derived from the DB_* settings."""
+        echo = self.DB_ECHO if self.DB_ECHO is not None else self.ENVIRONMENT == "development"
+        options = {
+            "echo": echo,
+            "pool_size": self.DB_POOL_SIZE,
+            "max_overflow": self.DB_MAX_OVERFLOW,
+            "pool_recycle": self.DB_POOL_RECYCLE_SECONDS,
+            "pool_pre_ping": self.DB_POOL_PRE_PING,
+        }
+        if self.DB_STATEMENT_TIMEOUT_MS and not self.DB_PGBOUNCER_MODE:
+            options["connect_args"] = {"options": f"-c statement_timeout={self.DB_STATEMENT_TIMEOUT_MS}"}
+        return options
+
 settings = Settings()
 
 # Security Check
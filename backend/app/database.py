@@ -1,14 +1,137 @@
+import time
 from sqlmodel import SQLModel, create_engine, Session, text
+from sqlalchemy import event
 from .config import settings  # <--- IMPORT SETTINGS HERE
+from .services.cache_service import mark_recent_write, has_recent_write, bump_collection_versions
+
+def build_engine(url: str):
+    """Creates an engine with the pool / timeout / echo behaviour from settings."""
+    db_engine = create_engine(url, **settings.engine_options())
+
+    if settings.DB_PGBOUNCER_MODE and settings.DB_STATEMENT_TIMEOUT_MS:
+        # SET LOCAL only lives for the current transaction, so it is safe behind a
+        # transaction pooler that hands the server connection to someone else afterwards.
+        @event.listens_for(db_engine, "begin")
+        def set_statement_timeout(conn):
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(settings.DB_STATEMENT_TIMEOUT_MS)}")
+
+    return db_engine
 
 # 1. Create the engine using the URL from config (Pydantic loads the .env)
-engine = create_engine(settings.DATABASE_URL, echo=True)
+engine = build_engine(settings.DATABASE_URL)
+
+# Optional replica for the heavy read paths. Without one, reads use the primary.
+read_engine = build_engine(settings.DATABASE_REPLICA_URL) if settings.DATABASE_REPLICA_URL else engine
+
+# Quantized ANN indexes (pgvector >= 0.7), name -> definition. The expressions must
+# match vector_service.candidate_distance() exactly or the planner will ignore them.
+# Built by app/scripts/build_embedding_index.py, not at startup.
+EMBEDDING_INDEXES = {
+    "halfvec": ("ix_note_embedding_halfvec",
+                "ON note USING hnsw ((embedding::halfvec(384)) halfvec_cosine_ops)"),
+    "bit": ("ix_note_embedding_bit",
+            "ON note USING hnsw ((binary_quantize(embedding)::bit(384)) bit_hamming_ops)"),
+}
+
+# An HNSW scan yields about ef_search neighbours from the whole table and the owner
+# filter runs on those, so on a shared table a user whose notes are not among them
+# gets few or no results. pgvector >= 0.8 can keep scanning until the filtered LIMIT
+# is met (iterative scan); older versions only get the wider ef_search.
+_iterative_scan_support: dict[str, bool] = {}
+
+def supports_iterative_scan(conn) -> bool:
+    url = str(conn.engine.url)
+    if url not in _iterative_scan_support:
+        version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        major_minor = tuple(int(part) for part in (version or "0.0").split(".")[:2])
+        _iterative_scan_support[url] = major_minor >= (0, 8)
+    return _iterative_scan_support[url]
+
+def tune_hnsw_search(conn, candidates: int, exact_order: bool = True):
+    """
+    Scan settings for the current transaction (SET LOCAL, so pooled connections are
+    unaffected). `candidates` is how many filtered rows the query asks the index for.
+    exact_order=False allows slightly out-of-order results, for candidates that are
+    re-ranked afterwards.
+    """
+    ef_search = min(1000, max(settings.EMBEDDING_EF_SEARCH, candidates))
+    conn.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+    if supports_iterative_scan(conn):
+        mode = "strict_order" if exact_order else "relaxed_order"
+        conn.execute(text(f"SET LOCAL hnsw.iterative_scan = {mode}"))
 
 # 2. Helper for getting a session
 def get_session():
     with Session(engine) as session:
         yield session
 
+# --- Read-your-writes tracking ---
+# Local expiry times save a Redis call when the write happened on this worker.
+_recent_writes: dict[str, float] = {}
+
+def mark_user_write(user_id):
+    if read_engine is engine:
+        return
+    _recent_writes[str(user_id)] = time.monotonic() + settings.READ_YOUR_WRITES_SECONDS
+    mark_recent_write(user_id, settings.READ_YOUR_WRITES_SECONDS)
+
+def wrote_recently(user_id) -> bool:
+    expires = _recent_writes.get(str(user_id))
+    if expires and expires > time.monotonic():
+        return True
+    return has_recent_write(user_id)
+
+def get_read_session_for(user_id):
+    """
+    Session for read-only endpoints: the replica, unless this user wrote within the
+    read-your-writes window and the replica might not have caught up yet.
+    """
+    target = engine
+    if read_engine is not engine and not wrote_recently(user_id):
+        target = read_engine
+    with Session(target) as session:
+        yield session
+
+# --- Write tracking ---
+# Any committed row carrying an owner_id / user_id counts as a write by that user:
+# it opens the read-your-writes window and bumps the user's collection versions
+# (ETags) for the lists the row appears in. Versions change only after the commit,
+# so a response can never pair a new version with old data.
+COLLECTIONS_BY_TABLE = {
+    # Note deletes cascade to note_tags in Postgres, so notes also bump tags
+    "note": ("notes", "tags"),
+    "note_tags": ("tags",),
+    "project": ("projects",),
+    "chat_sessions": ("sessions",),
+}
+
+def record_user_write(user_id, collections=()):
+    mark_user_write(user_id)
+    if collections:
+        bump_collection_versions(user_id, collections)
+
+@event.listens_for(Session, "after_flush")
+def collect_written_users(session, flush_context):
+    written = session.info.setdefault("written_users", {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        user_id = getattr(obj, "owner_id", None) or getattr(obj, "user_id", None)
+        if user_id:
+            collections = COLLECTIONS_BY_TABLE.get(getattr(obj, "__tablename__", None), ())
+            written.setdefault(user_id, set()).update(collections)
+
+def track_bulk_write(session: Session, user_id, collections):
+    """Bulk UPDATE / DELETE statements bypass the flush: record them by hand, before the commit"""
+    session.info.setdefault("written_users", {}).setdefault(user_id, set()).update(collections)
+
+@event.listens_for(Session, "after_commit")
+def flag_written_users(session):
+    for user_id, collections in session.info.pop("written_users", {}).items():
+        record_user_write(user_id, collections)
+
+@event.listens_for(Session, "after_rollback")
+def forget_written_users(session):
+    session.info.pop("written_users", None)
+
 # 3. Initialization Function
 def init_db():
     # A. Enable Vector Extension (Critical for AI Search)
@@ -17,4 +140,38 @@ def init_db():
         session.commit()
     
     # B. Create Tables
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        # Columns added after the tables first shipped (create_all never alters).
+        # Checked first so a normal start takes no table lock; IF NOT EXISTS covers
+        # workers racing through the first start. Only metadata changes happen here:
+        # backfills, constraints and indexes that scan the table are in
+        # app/scripts/migrate_note_updated_at.py
+        columns = set(session.exec(text(
+            "SELECT table_name || '.' || column_name FROM information_schema.columns "
+            "WHERE table_name IN ('project', 'note')"
+        )).all())
+        if "project.ai_model_preference" not in columns:
+            session.exec(text("ALTER TABLE project ADD COLUMN IF NOT EXISTS ai_model_preference VARCHAR"))
+        if "note.updated_at" not in columns:
+            # NULL for existing rows until the migration script backfills them
+            session.exec(text("ALTER TABLE note ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP"))
+            session.exec(text("ALTER TABLE note ALTER COLUMN updated_at SET DEFAULT (now() AT TIME ZONE 'utc')"))
+        session.commit()
+
+    # Tag rows for notes tagged before note_tags existed are filled by
+    # app/scripts/backfill_note_tags.py, run once per deployment
+
+    # C. Quantized candidate index for the configured storage mode. Building it scans
+    # every embedding, so it is only checked here; without it searches still work,
+    # on a sequential scan
+    index = EMBEDDING_INDEXES.get(settings.EMBEDDING_STORAGE)
+    if index:
+        with Session(engine) as session:
+            valid = session.exec(text(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name"
+            ).bindparams(name=index[0])).first()
+        if not valid or not valid[0]:
+            print(f"⚠️ Index {index[0]} for EMBEDDING_STORAGE={settings.EMBEDDING_STORAGE} is missing: "
+                  f"run python -m app.scripts.build_embedding_index")
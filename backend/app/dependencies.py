@@ -0,0 +1,133 @@
+import time
+import uuid
+from datetime import datetime
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import OAuth2PasswordBearer
+from sqlmodel import Session
+
+from .config import settings
+from .database import engine, get_read_session_for
+from .models import User
+from .services.auth_service import get_token_claims, get_token_subject
+from .services.event_service import redeem_stream_ticket
+from .services.cache_service import get_cache, set_simple_cache, delete_cache
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+
+# Only non-secret profile fields are cached (never password_hash / refresh_token)
+PRINCIPAL_FIELDS = ("id", "email", "full_name", "avatar_url", "provider", "created_at")
+LOCAL_CACHE_SIZE = 10_000
+
+# sub -> (expires_at, principal fields)
+_local_principals: dict[str, tuple[float, dict]] = {}
+
+
+def _principal_key(user_id) -> str:
+    return f"principal:{user_id}"
+
+
+def _to_principal(user: User) -> dict:
+    data = {field: getattr(user, field) for field in PRINCIPAL_FIELDS}
+    data["id"] = str(data["id"])
+    data["created_at"] = data["created_at"].isoformat() if data["created_at"] else None
+    return data
+
+
+def _from_principal(data: dict) -> User:
+    # Detached instance: routers only read attributes from current_user
+    return User(
+        id=uuid.UUID(data["id"]),
+        email=data["email"],
+        full_name=data.get("full_name"),
+        avatar_url=data.get("avatar_url"),
+        provider=data.get("provider") or "local",
+        created_at=datetime.fromisoformat(data["created_at"]) if data.get("created_at") else None,
+    )
+
+
+def _remember_locally(user_id: str, data: dict):
+    if len(_local_principals) >= LOCAL_CACHE_SIZE:
+        _local_principals.pop(next(iter(_local_principals)), None)
+    _local_principals[user_id] = (time.monotonic() + settings.AUTH_LOCAL_CACHE_SECONDS, data)
+
+
+def invalidate_principal(user_id):
+    """
+    Evicts a cached user. Call after changing anything on the users row.
+    Other workers' local copies expire within AUTH_LOCAL_CACHE_SECONDS.
+    """
+    _local_principals.pop(str(user_id), None)
+    delete_cache(_principal_key(user_id))
+
+
+def load_principal(user_id: str):
+    """
+    Looks a user up through the local cache, then Redis, then Postgres.
+    """
+    cached = _local_principals.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return _from_principal(cached[1])
+
+    data = get_cache(_principal_key(user_id))
+    if not data:
+        try:
+            u_uuid = uuid.UUID(user_id)
+        except ValueError:
+            return None
+        with Session(engine) as session:
+            user = session.get(User, u_uuid)
+            if not user:
+                return None
+            data = _to_principal(user)
+        set_simple_cache(_principal_key(user_id), data, expire=settings.AUTH_CACHE_SECONDS)
+
+    _remember_locally(user_id, data)
+    return _from_principal(data)
+
+
+# --- The single auth dependency used by every router ---
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    credentials_exception = HTTPException(
+        status_code=401,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    user_id = get_token_subject(token)
+    if user_id is None:
+        raise credentials_exception
+    user = load_principal(user_id)
+    if user is None:
+        raise credentials_exception
+    return user
+
+
+def get_stream_user(request: Request, ticket: str | None = None) -> tuple[User, float]:
+    """
+    Auth for EventSource streams, which cannot set headers: a single-use ?ticket=
+    from POST /events/ticket, or a Bearer header for clients that can send one.
+    Returns the user and when their access expires (the stream ends then).
+    """
+    if ticket:
+        claims = redeem_stream_ticket(ticket)
+    else:
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        claims = get_token_claims(token) if scheme.lower() == "bearer" else None
+    user = load_principal(claims[0]) if claims else None
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return user, claims[1]
+
+
+def is_profiling_admin(user: User | None) -> bool:
+    return bool(user) and user.email in settings.PROFILING_ADMIN_EMAILS
+
+
+def require_profiling_admin(current_user: User = Depends(get_current_user)):
+    if not is_profiling_admin(current_user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+
+def get_read_session(current_user: User = Depends(get_current_user)):
+    yield from get_read_session_for(current_user.id)
@@ -1,14 +1,43 @@
+import math
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from fastapi import Request
+from .config import settings
+from .services.auth_service import get_token_subject
 
 def get_identifier(request: Request):
     # 1. Try to limit by User ID (if logged in)
-    # We look for the 'user' object attached by our Auth middleware
-    if hasattr(request.state, "user"):
-        return str(request.state.user.id)
+    # The JWT subject is read straight from the header, before the handler runs
+    auth_header = request.headers.get("authorization", "")
+    if auth_header.lower().startswith("bearer "):
+        user_id = get_token_subject(auth_header[7:])
+        if user_id:
+            return f"user:{user_id}"
     
     # 2. Fallback to IP address (for login/signup pages)
     return get_remote_address(request)
 
-limiter = Limiter(key_func=get_identifier)
\ No newline at end of file
+def llm_cost(limit: int):
+    """
+    Cost of an LLM-backed request on a route allowing `limit` hits, scaled by body
+    size as a proxy for prompt tokens: small snippets cost 1, a 20KB paste ~5.
+    Capped at `limit`, so a large body spends the whole window instead of being
+    rejected forever; a body of unknown size (chunked, bad header) is charged the cap.
+    """
+    def cost(request: Request) -> int:
+        try:
+            size = int(request.headers["content-length"])
+        except (KeyError, ValueError):
+            return limit
+        return min(limit, max(1, math.ceil(size / settings.RATE_LIMIT_LLM_COST_BYTES)))
+    return cost
+
+# Sliding-window counters in Redis: each hit is one atomic Lua script (limits' RedisStorage).
+# If Redis is unreachable, each worker falls back to in-memory counting.
+limiter = Limiter(
+    key_func=get_identifier,
+    strategy="sliding-window-counter",
+    storage_uri=settings.RATE_LIMIT_STORAGE_URI or settings.REDIS_URL,
+    key_prefix="rl",
+    in_memory_fallback_enabled=True,
+)
@@ -1,11 +1,15 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from .routers import auth, notes, chat, projects 
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from .routers import auth, notes, chat, projects, admin, events
 from .database import init_db
+from .services.cache_service import start_l1_invalidation
 from .limiter import limiter
 from slowapi.errors import RateLimitExceeded
 from .config import settings
+from .metrics import PrometheusMiddleware
+from .profiling import ProfilingMiddleware
 
 app = FastAPI(title="KodaSync API", version="1.0.0")
 
@@ -44,15 +48,30 @@ app.add_middleware(
     allow_headers=["*"], 
 )
 
+# Opt-in sampling profiler; when disabled it is not in the stack at all
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Outermost, so the histogram covers CORS and error handling too
+app.add_middleware(PrometheusMiddleware)
+
 @app.on_event("startup")
 def on_startup():
     init_db()
+    start_l1_invalidation()
 
 # 4. Register Routes
 app.include_router(auth.router)
 app.include_router(notes.router)
 app.include_router(chat.router)    
 app.include_router(projects.router) 
+app.include_router(admin.router)
+app.include_router(events.router)
+
+# --- PROMETHEUS SCRAPE ENDPOINT ---
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 # --- RATE LIMITED ROOT ENDPOINT ---
 @app.get("/")
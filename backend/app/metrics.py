@@ -0,0 +1,149 @@
+import time
+from prometheus_client import Counter, Gauge, Histogram
+
+# --- LLM request coalescing ---
+# scope: leader (made the upstream call), local (joined an in-process call),
+# remote (got another worker's result), fallback (gave up waiting and called upstream)
+LLM_COALESCED = Counter(
+    "kodasync_llm_coalesced_total",
+    "Identical LLM requests resolved by single-flight coalescing",
+    ["scope"],
+)
+
+# --- LLM governor ---
+LLM_QUEUE_DEPTH = Gauge(
+    "kodasync_llm_queue_depth",
+    "LLM requests waiting for a governor slot",
+    ["model", "priority"],
+)
+LLM_QUEUE_WAIT = Histogram(
+    "kodasync_llm_queue_wait_seconds",
+    "Time spent waiting for a governor slot",
+    ["model", "priority"],
+    buckets=(0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+LLM_RATELIMIT_REMAINING = Gauge(
+    "kodasync_llm_ratelimit_remaining_tokens",
+    "Remaining tokens reported by the provider's rate-limit headers",
+    ["model"],
+)
+
+# --- LLM routing ---
+# route: the AI action (tags, title, explain, chat, fix, document, ...)
+LLM_CALL_LATENCY = Histogram(
+    "kodasync_llm_call_seconds",
+    "Upstream LLM call duration (the whole stream for streaming calls)",
+    ["route", "model"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+LLM_TOKENS = Counter(
+    "kodasync_llm_tokens_total",
+    "LLM tokens spent (estimated for streams)",
+    ["route", "model", "kind"],
+)
+LLM_ROUTE_FALLBACK = Counter(
+    "kodasync_llm_route_fallback_total",
+    "Fast-model answers that failed validation and were retried on the smart model",
+    ["route"],
+)
+
+# --- HTTP requests ---
+HTTP_REQUEST_LATENCY = Histogram(
+    "kodasync_http_request_seconds",
+    "Request duration per route template, until the last body byte (so streams included)",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+# --- Request path stages ---
+# stage: embedding, vector_query, redis_get, redis_set, llm_ttft, llm_stream, process_note_ai, password_hash
+STAGE_LATENCY = Histogram(
+    "kodasync_stage_seconds",
+    "Time spent in one stage of the request path",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+# --- Response caches ---
+TRACKED_CACHES = ("search", "chat", "explain", "fix", "note")
+CACHE_REQUESTS = Counter(
+    "kodasync_cache_requests_total",
+    "Lookups in the Redis response caches",
+    ["cache", "result"],
+)
+
+# tier: l1 (in-process) or redis; a Redis lookup only happens after an L1 miss
+CACHE_TIER_REQUESTS = Counter(
+    "kodasync_cache_tier_requests_total",
+    "Lookups per cache tier",
+    ["cache", "tier", "result"],
+)
+
+# event: stale (served past soft expiry), early (probabilistic early refresh),
+# waited (a miss got the value another request computed), wait_timeout (computed it anyway)
+CACHE_REVALIDATIONS = Counter(
+    "kodasync_cache_revalidations_total",
+    "Stale-while-revalidate and stampede protection events in the response caches",
+    ["cache", "event"],
+)
+
+def _cache_name(key: str):
+    cache = key.split(":", 1)[0]
+    return cache if cache in TRACKED_CACHES else None
+
+def record_cache_lookup(key: str, hit: bool):
+    if cache := _cache_name(key):
+        CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+def record_cache_tier(key: str, tier: str, hit: bool):
+    if cache := _cache_name(key):
+        CACHE_TIER_REQUESTS.labels(cache, tier, "hit" if hit else "miss").inc()
+
+def record_cache_revalidation(key: str, event: str):
+    if cache := _cache_name(key):
+        CACHE_REVALIDATIONS.labels(cache, event).inc()
+
+
+class PrometheusMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware buffering) that times each
+    request under its route template, e.g. /notes/{note_id}, not the raw path.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # FastAPI stores the matched route in the scope during routing
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_LATENCY.labels(scope["method"], route_path, status).observe(
+                time.perf_counter() - started
+            )
+
+# --- Circuit breakers ---
+# dependency: redis, groq (or stub); state: 0 closed, 1 half-open, 2 open
+CIRCUIT_STATE = Gauge(
+    "kodasync_circuit_state",
+    "Circuit breaker state per external dependency (0 closed, 1 half-open, 2 open)",
+    ["dependency"],
+)
+CIRCUIT_REJECTED = Counter(
+    "kodasync_circuit_rejected_total",
+    "Calls failed fast because the dependency's circuit was open",
+    ["dependency"],
+)
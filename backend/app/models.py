@@ -3,14 +3,14 @@ from typing import Optional, List
 import uuid
 from datetime import datetime
 from pgvector.sqlalchemy import Vector
-from sqlalchemy import Column
+from sqlalchemy import Column, Index
 
 class User(SQLModel, table=True):
     __tablename__ = "users"
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     email: str = Field(unique=True, index=True)
     password_hash: Optional[str] = None
-    refresh_token: Optional[str] = None 
+    refresh_token: Optional[str] = None  # legacy: refresh tokens now live in Redis (token_store)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     full_name: Optional[str] = None
@@ -28,12 +28,16 @@ class Project(SQLModel, table=True):
     description: Optional[str] = None
     # 🚀 NEW: Pinned field
     is_pinned: bool = Field(default=False) 
+    # "auto" (None), "fast" or "smart": pins the LLM used for this project's AI calls
+    ai_model_preference: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     owner_id: uuid.UUID = Field(foreign_key="users.id")
     owner: User = Relationship(back_populates="projects")
     notes: List["Note"] = Relationship(back_populates="project")
 
 class Note(SQLModel, table=True):
+    # Serves GET /notes/changes (owner's notes changed after a cursor)
+    __table_args__ = (Index("ix_note_owner_updated", "owner_id", "updated_at"),)
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     title: str
     code_snippet: str
@@ -41,12 +45,30 @@ class Note(SQLModel, table=True):
     tags: Optional[str] = None
     is_pinned: bool = Field(default=False)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Refreshed on every ORM update (edits, pins, background tagging)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow})
     embedding: List[float] = Field(sa_column=Column(Vector(384))) 
     owner_id: uuid.UUID = Field(foreign_key="users.id")
     owner: User = Relationship(back_populates="notes")
     project_id: Optional[uuid.UUID] = Field(default=None, foreign_key="project.id")
     project: Optional[Project] = Relationship(back_populates="notes")
 
+class NoteTag(SQLModel, table=True):
+    # Normalized copy of Note.tags, kept in sync by services/tag_service.py
+    __tablename__ = "note_tags"
+    __table_args__ = (Index("ix_note_tags_owner_tag", "owner_id", "tag"),)
+    note_id: uuid.UUID = Field(foreign_key="note.id", primary_key=True, ondelete="CASCADE")
+    tag: str = Field(primary_key=True)
+    owner_id: uuid.UUID = Field(foreign_key="users.id")
+
+class NoteTombstone(SQLModel, table=True):
+    # Deleted note ids, so delta sync can report deletions (services/sync_service.py)
+    __tablename__ = "note_tombstones"
+    __table_args__ = (Index("ix_note_tombstones_owner_deleted", "owner_id", "deleted_at"),)
+    note_id: uuid.UUID = Field(primary_key=True)
+    owner_id: uuid.UUID = Field(foreign_key="users.id", ondelete="CASCADE")
+    deleted_at: datetime = Field(default_factory=datetime.utcnow)
+
 class ChatSession(SQLModel, table=True):
     __tablename__ = "chat_sessions"
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import random
+import re
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+
+from .config import settings
+from .dependencies import is_profiling_admin, load_principal
+from .services.auth_service import get_token_subject
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_SUFFIX = ".speedscope.json"
+PROFILE_ID_PATTERN = re.compile(r"^\d+-[0-9a-f]{8}$")
+
+
+# --- Stored profiles ---
+# Files are named "<id>__<METHOD>_<route slug>.speedscope.json" and open in speedscope.app
+def profile_dir() -> str:
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    return settings.PROFILING_DIR
+
+
+def list_profiles() -> list[dict]:
+    profiles = []
+    for name in sorted(os.listdir(profile_dir()), reverse=True):
+        if not name.endswith(PROFILE_SUFFIX) or "__" not in name:
+            continue
+        profile_id, label = name[: -len(PROFILE_SUFFIX)].split("__", 1)
+        path = os.path.join(settings.PROFILING_DIR, name)
+        profiles.append({"id": profile_id, "request": label, "size": os.path.getsize(path)})
+    return profiles
+
+
+def find_profile(profile_id: str) -> str | None:
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    for name in os.listdir(profile_dir()):
+        if name.startswith(f"{profile_id}__") and name.endswith(PROFILE_SUFFIX):
+            return os.path.join(settings.PROFILING_DIR, name)
+    return None
+
+
+def save_profile(profiler, profile_id: str, method: str, route: str):
+    from pyinstrument.renderers import SpeedscopeRenderer
+
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", route).strip("-") or "root"
+    path = os.path.join(profile_dir(), f"{profile_id}__{method}_{slug}{PROFILE_SUFFIX}")
+    with open(path, "w") as f:
+        f.write(profiler.output(SpeedscopeRenderer()))
+
+    # Keep only the newest PROFILING_MAX_FILES
+    names = sorted(n for n in os.listdir(settings.PROFILING_DIR) if n.endswith(PROFILE_SUFFIX))
+    for name in names[: max(0, len(names) - settings.PROFILING_MAX_FILES)]:
+        os.remove(os.path.join(settings.PROFILING_DIR, name))
+
+
+# --- Middleware ---
+class ProfilingMiddleware:
+    """
+    Captures a statistical (sampling) profile of selected requests: any request
+    from a profiling admin carrying an `X-Profile` header, plus a random
+    PROFILING_SAMPLE_RATE share of the PROFILING_ROUTES. The profile id is
+    returned in the `X-Profile-Id` response header.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.routes = set(settings.PROFILING_ROUTES)
+
+    def _route_path(self, scope) -> str:
+        # Profiling starts before routing, so match the route templates here
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", scope["path"])
+        return scope["path"]
+
+    def _requested_by_admin(self, headers: dict) -> bool:
+        # Blocking: the principal may come from Redis or Postgres
+        scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return False
+        user_id = get_token_subject(token)
+        return bool(user_id) and is_profiling_admin(load_principal(user_id))
+
+    async def _should_profile(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        # Only requests asking for a profile pay for the lookup, off the event loop
+        if PROFILE_HEADER in headers and await run_in_threadpool(self._requested_by_admin, headers):
+            return True
+        return (
+            bool(self.routes)
+            and random.random() < settings.PROFILING_SAMPLE_RATE
+            and self._route_path(scope) in self.routes
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not await self._should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        from pyinstrument import Profiler
+
+        profile_id = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        # async_mode follows this request's task across awaits (including streamed bodies)
+        profiler = Profiler(interval=settings.PROFILING_INTERVAL_MS / 1000, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            try:
+                await asyncio.to_thread(
+                    save_profile, profiler, profile_id, scope["method"], self._route_path(scope)
+                )
+            except Exception as e:
+                print(f"Profiling Error (Save): {e}")
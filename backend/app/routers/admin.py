@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from ..dependencies import require_profiling_admin
+from ..profiling import find_profile, list_profiles
+import os
+
+router = APIRouter(
+    prefix="/admin/profiles",
+    tags=["Admin"],
+    dependencies=[Depends(require_profiling_admin)],
+)
+
+@router.get("/")
+def get_profiles():
+    return list_profiles()
+
+@router.get("/{profile_id}")
+def download_profile(profile_id: str):
+    path = find_profile(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    # Speedscope JSON: open at https://www.speedscope.app
+    return FileResponse(path, media_type="application/json", filename=os.path.basename(path))
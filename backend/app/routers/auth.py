@@ -1,24 +1,26 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
-from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
+from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import RedirectResponse
 from sqlmodel import Session, select
 from pydantic import BaseModel
 import httpx 
 
 from ..database import get_session
+from ..dependencies import get_current_user, invalidate_principal, load_principal
 from ..models import User
 from ..schemas.user import UserCreate, UserRead
 from ..services.auth_service import (
-    get_password_hash, verify_password, 
-    create_access_token, create_refresh_token, decode_token
+    get_password_hash_async, verify_password_async, needs_rehash, PasswordHasherBusy,
+    create_access_token, decode_token
+)
+from ..services.token_store import (
+    issue_refresh_token, rotate_refresh_token, revoke_family, revoke_all, TokenStoreUnavailable
 )
 from ..config import settings
 from ..limiter import limiter
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
-
 class TokenResponse(BaseModel):
     access_token: str
     refresh_token: str
@@ -27,18 +29,28 @@ class TokenResponse(BaseModel):
 class RefreshRequest(BaseModel):
     refresh_token: str
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
-    payload = decode_token(token)
-    if not payload or payload.get("type") != "access":
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    
-    user_id = payload.get("sub")
-    user = session.get(User, user_id)
-    
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    
-    return user
+class LogoutRequest(BaseModel):
+    refresh_token: str
+    all_devices: bool = False
+
+def hasher_busy():
+    return HTTPException(status_code=503, detail="Too many sign-ins in progress, retry shortly",
+                         headers={"Retry-After": "1"})
+
+def token_store_down():
+    return HTTPException(status_code=503, detail="Sign-in is temporarily unavailable",
+                         headers={"Retry-After": "5"})
+
+def issue_tokens(user_id) -> dict:
+    try:
+        refresh = issue_refresh_token(user_id)
+    except TokenStoreUnavailable:
+        raise token_store_down()
+    return {
+        "access_token": create_access_token(data={"sub": str(user_id)}),
+        "refresh_token": refresh,
+        "token_type": "bearer"
+    }
 
 @router.get("/me", response_model=UserRead)
 async def read_users_me(current_user: User = Depends(get_current_user)):
@@ -51,13 +63,19 @@ async def signup(request: Request, user_data: UserCreate, session: Session = Dep
     if len(user_data.password) < 8:
         raise HTTPException(status_code=400, detail="Password must be at least 8 characters long")
 
+    # Hashed before touching the database, so no connection is held while bcrypt runs
+    try:
+        password_hash = await get_password_hash_async(user_data.password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
+
     existing_user = session.exec(select(User).where(User.email == user_data.email)).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    
+
     new_user = User(
         email=user_data.email, 
-        password_hash=get_password_hash(user_data.password),
+        password_hash=password_hash,
         full_name=user_data.full_name,
         provider="local"
     )
@@ -77,21 +95,22 @@ async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends
     if not user.password_hash:
         raise HTTPException(status_code=400, detail="Please log in with GitHub")
 
-    if not verify_password(form_data.password, user.password_hash):
-        raise HTTPException(status_code=400, detail="Incorrect email or password")
-    
-    access_token = create_access_token(data={"sub": str(user.id)})
-    refresh_token = create_refresh_token(data={"sub": str(user.id)})
-
-    user.refresh_token = refresh_token
-    session.add(user)
-    session.commit()
-
-    return {
-        "access_token": access_token, 
-        "refresh_token": refresh_token,
-        "token_type": "bearer"
-    }
+    # Hand the connection back while bcrypt runs: a login burst would otherwise hold
+    # one per queued hash and run the pool dry. `user` stays usable detached.
+    session.close()
+    try:
+        if not await verify_password_async(form_data.password, user.password_hash):
+            raise HTTPException(status_code=400, detail="Incorrect email or password")
+        # BCRYPT_ROUNDS changed since this hash was made: upgrade it while we have the password
+        if needs_rehash(user.password_hash):
+            user.password_hash = await get_password_hash_async(form_data.password)
+            session.add(user)
+            session.commit()
+    except PasswordHasherBusy:
+        raise hasher_busy()
+
+    # The refresh token lives in Redis: a plain login writes nothing to Postgres
+    return issue_tokens(user.id)
 
 @router.post("/refresh", response_model=TokenResponse)
 async def refresh_token(body: RefreshRequest, session: Session = Depends(get_session)):
@@ -100,23 +119,49 @@ async def refresh_token(body: RefreshRequest, session: Session = Depends(get_ses
         raise HTTPException(status_code=401, detail="Invalid token")
 
     user_id = payload.get("sub")
-    user = session.get(User, user_id)
-    if not user or user.refresh_token != body.refresh_token:
-        raise HTTPException(status_code=401, detail="Token revoked")
+    if "jti" not in payload:
+        # Issued before the Redis store: accepted once against users.refresh_token,
+        # then retired in favour of a new family
+        user = session.get(User, user_id)
+        if not user or user.refresh_token != body.refresh_token:
+            raise HTTPException(status_code=401, detail="Token revoked")
+        user.refresh_token = None
+        session.add(user)
+        session.commit()
+        return issue_tokens(user.id)
 
-    new_access = create_access_token(data={"sub": str(user.id)})
-    new_refresh = create_refresh_token(data={"sub": str(user.id)})
+    # Tokens outlive a deleted account in Redis; the cached principal saves a query
+    if load_principal(user_id) is None:
+        raise HTTPException(status_code=401, detail="Token revoked")
 
-    user.refresh_token = new_refresh
-    session.add(user)
-    session.commit()
+    try:
+        new_refresh = rotate_refresh_token(payload)
+    except TokenStoreUnavailable:
+        raise token_store_down()
+    if not new_refresh:
+        raise HTTPException(status_code=401, detail="Token revoked")
 
     return {
-        "access_token": new_access, 
+        "access_token": create_access_token(data={"sub": user_id}),
         "refresh_token": new_refresh,
         "token_type": "bearer"
     }
 
+@router.post("/logout")
+async def logout(body: LogoutRequest):
+    payload = decode_token(body.refresh_token)
+    if not payload or payload.get("type") != "refresh" or "fam" not in payload:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    try:
+        if body.all_devices:
+            revoke_all(payload["sub"])
+        else:
+            revoke_family(payload["sub"], payload["fam"])
+    except TokenStoreUnavailable:
+        raise token_store_down()
+    return {"message": "Logged out"}
+
 @router.get("/github/login")
 async def github_login():
     return RedirectResponse(
@@ -173,12 +218,9 @@ async def github_callback(code: str, session: Session = Depends(get_session)):
         session.commit()
         session.refresh(user)
 
-    access_token_jwt = create_access_token(data={"sub": str(user.id)})
-    refresh_token_jwt = create_refresh_token(data={"sub": str(user.id)})
-    
-    user.refresh_token = refresh_token_jwt
-    session.add(user)
-    session.commit()
+    # Name / avatar may have changed on the GitHub side too
+    invalidate_principal(user.id)
 
-    frontend_url = f"{settings.FRONTEND_URL}/auth/callback?access_token={access_token_jwt}&refresh_token={refresh_token_jwt}"
+    tokens = issue_tokens(user.id)
+    frontend_url = f"{settings.FRONTEND_URL}/auth/callback?access_token={tokens['access_token']}&refresh_token={tokens['refresh_token']}"
     return RedirectResponse(url=frontend_url)
\ No newline at end of file
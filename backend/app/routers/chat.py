@@ -1,15 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse 
 from sqlmodel import Session, select, delete, col
-from ..database import get_session
+from sqlalchemy.orm import defer
+from ..database import get_session, mark_user_write, track_bulk_write
 from ..models import ChatSession, ChatMessage, User, Note, Project
-from ..routers.notes import get_current_user
-from ..services.ai_service import stream_chat_with_notes, generate_chat_title
-from ..services.vector_service import get_vector
-from ..services.cache_service import get_cache, set_simple_cache 
-from ..limiter import limiter
+from ..dependencies import get_current_user, get_read_session
+from ..services.ai_service import stream_chat_with_notes, generate_chat_title, is_error_response
+from ..services.vector_service import get_vector, nearest_notes, tune_vector_search
+from ..services.cache_service import get_swr_cache, set_swr_cache, release_refresh, acquire_fill, wait_for_fill
+from ..config import settings
+from ..limiter import limiter, llm_cost
+from ..metrics import STAGE_LATENCY
+from ..serialization import RawJSONResponse, encode, encode_rows
+from ..conditional import collection_etag, not_modified, etag_headers
 import uuid
 import hashlib 
+import json
+import time
 from pydantic import BaseModel
 from typing import Optional
 
@@ -20,7 +27,11 @@ class ChatRequest(BaseModel):
     project_id: Optional[str] = None 
 
 # --- HELPER: Delete Empty Sessions ---
-def cleanup_empty_sessions(session: Session, user_id: uuid.UUID, exclude_id: Optional[uuid.UUID] = None):
+def cleanup_empty_sessions(session: Session, user_id: uuid.UUID, exclude_id: Optional[uuid.UUID] = None) -> bool:
+    """
+    Returns True when empty sessions were deleted. Part of the caller's transaction:
+    the deletion (and the version bump) happens when the caller commits.
+    """
     try:
         active_session_ids = select(ChatMessage.session_id).distinct()
         statement = delete(ChatSession).where(
@@ -29,10 +40,14 @@ def cleanup_empty_sessions(session: Session, user_id: uuid.UUID, exclude_id: Opt
         )
         if exclude_id:
             statement = statement.where(ChatSession.id != exclude_id)
-        session.exec(statement)
-        session.commit()
+        result = session.exec(statement)
+        if result.rowcount:
+            track_bulk_write(session, user_id, ("sessions",))
+            return True
     except Exception as e:
         print(f"Cleanup warning: {e}")
+        session.rollback()
+    return False
 
 @router.post("/sessions", response_model=ChatSession)
 @limiter.limit("20/minute") 
@@ -55,12 +70,25 @@ async def get_sessions(
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
-    cleanup_empty_sessions(session, current_user.id)
+    # Checked before the cleanup: sessions never become empty again, and creating
+    # one bumps the version, so a matching ETag means there is nothing to clean
+    etag = collection_etag(request, current_user.id, "sessions")
+    if cached := not_modified(request, etag):
+        return cached
+
+    # A miss always runs the cleanup on the primary, so the list is read in the same
+    # transaction (the replica could still list the sessions just deleted)
+    if cleanup_empty_sessions(session, current_user.id):
+        # The commit bumps the version this ETag was computed from: send none, the
+        # next request gets the new one
+        etag = None
     statement = select(ChatSession).where(ChatSession.user_id == current_user.id).order_by(
         ChatSession.is_pinned.desc(),
         ChatSession.created_at.desc()
     )
-    return session.exec(statement).all()
+    payload = encode_rows(session.exec(statement).all(), ChatSession)
+    session.commit()
+    return RawJSONResponse(payload, headers=etag_headers(etag))
 
 @router.get("/sessions/{session_id}/messages")
 @limiter.limit("100/minute")
@@ -68,7 +96,7 @@ async def get_session_messages(
     request: Request,
     session_id: str,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
     try: s_uuid = uuid.UUID(session_id)
     except: raise HTTPException(status_code=400)
@@ -80,13 +108,14 @@ async def get_session_messages(
     return chat_session.messages
 
 @router.post("/{session_id}")
-@limiter.limit("10/minute") 
+@limiter.limit("10/minute", cost=llm_cost(10))
 async def send_message(
     request: Request,
     session_id: str,
     body: ChatRequest,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_session),
+    read_session: Session = Depends(get_read_session)
 ):
     try: s_uuid = uuid.UUID(session_id)
     except: raise HTTPException(status_code=400)
@@ -96,11 +125,21 @@ async def send_message(
         raise HTTPException(status_code=404)
 
     # --- Cache Logic ---
+    # A stale entry is still served to everyone except the one request holding the
+    # refresh token, which answers afresh and rewrites the entry
+    started = time.perf_counter()
     msg_hash = hashlib.md5(body.message.strip().lower().encode()).hexdigest()
     cache_key = f"chat:{current_user.id}:{body.project_id or 'global'}:{msg_hash}"
-    if cached := get_cache(cache_key):
+    cached, refresh_token = get_swr_cache(cache_key)
+    if not cached:
+        # Miss: one request asks the LLM, identical ones wait for its answer
+        refresh_token = acquire_fill(cache_key, settings.CHAT_FILL_WAIT_SECONDS)
+        if not refresh_token:
+            cached = await wait_for_fill(cache_key, settings.CHAT_FILL_WAIT_SECONDS)
+    if cached and not refresh_token:
+        response_text = json.loads(cached).get("response", "")
         async def cached_gen():
-            yield cached.get("response", "")
+            yield response_text
         return StreamingResponse(cached_gen(), media_type="text/plain")
 
     # AI TITLE GENERATION (Async) 
@@ -118,15 +157,21 @@ async def send_message(
     stmt = select(Note).where(Note.owner_id == current_user.id)
     
     project_name = None
+    model_preference = None
     if body.project_id:
         try:
             stmt = stmt.where(Note.project_id == uuid.UUID(body.project_id))
-            proj = session.get(Project, uuid.UUID(body.project_id))
-            if proj: project_name = proj.name
+            proj = read_session.get(Project, uuid.UUID(body.project_id))
+            if proj:
+                project_name = proj.name
+                model_preference = proj.ai_model_preference
         except: pass
 
-    stmt = stmt.order_by(Note.embedding.cosine_distance(query_vector)).limit(3)
-    relevant_notes = session.exec(stmt).all()
+    # Retrieval is the heavy vector scan, so it runs on the replica
+    stmt = nearest_notes(stmt, query_vector, limit=3).options(defer(Note.embedding))
+    with STAGE_LATENCY.labels("vector_query").time():
+        tune_vector_search(read_session, limit=3)
+        relevant_notes = read_session.exec(stmt).all()
     context_str = "\n".join([f"Note: {n.title} ({n.language})\n{n.code_snippet}" for n in relevant_notes])
 
     # Save User Message
@@ -138,18 +183,33 @@ async def send_message(
 
     async def response_generator():
         full_response = ""
-        # ASYNC ITERATION OVER STREAM
-        async for chunk in stream_chat_with_notes(context_str, body.message, history, project_name=project_name):
-            full_response += chunk
-            yield chunk
-
         try:
-            ai_msg = ChatMessage(role="assistant", content=full_response, session_id=s_uuid)
-            session.add(ai_msg)
-            session.commit()
-            set_simple_cache(cache_key, {"response": full_response}, expire=3600)
-        except Exception as e:
-            print(f"Error saving chat history: {e}")
+            # ASYNC ITERATION OVER STREAM
+            async for chunk in stream_chat_with_notes(
+                context_str, body.message, history, project_name=project_name, preference=model_preference
+            ):
+                full_response += chunk
+                yield chunk
+
+            # A failed answer is neither kept in the history nor cached
+            if is_error_response(full_response):
+                return
+            try:
+                ai_msg = ChatMessage(role="assistant", content=full_response, session_id=s_uuid)
+                session.add(ai_msg)
+                session.commit()
+                # Messages have no user_id column, so flag the write explicitly
+                mark_user_write(current_user.id)
+                set_swr_cache(
+                    cache_key, encode({"response": full_response}),
+                    settings.CHAT_CACHE_FRESH_SECONDS, settings.CHAT_CACHE_STALE_SECONDS,
+                    time.perf_counter() - started,
+                )
+            except Exception as e:
+                print(f"Error saving chat history: {e}")
+        finally:
+            if refresh_token:
+                release_refresh(cache_key, refresh_token)
 
     return StreamingResponse(response_generator(), media_type="text/plain")
 
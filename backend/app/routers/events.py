@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from ..config import settings
+from ..dependencies import get_current_user, get_stream_user, oauth2_scheme
+from ..models import User
+from ..services.auth_service import get_token_claims
+from ..services.event_service import issue_stream_ticket, open_user_events, stream_user_events
+
+router = APIRouter(
+    prefix="/events",
+    tags=["Events"],
+)
+
+@router.post("/ticket")
+async def create_stream_ticket(token: str = Depends(oauth2_scheme), current_user: User = Depends(get_current_user)):
+    """
+    Single-use ticket for GET /events/stream?ticket=..., valid for
+    EVENTS_TICKET_SECONDS. Request a new one for every (re)connect.
+    """
+    _, expires_at = get_token_claims(token)
+    ticket = issue_stream_ticket(current_user.id, expires_at)
+    if not ticket:
+        raise HTTPException(status_code=503, detail="Event stream unavailable")
+    return {"ticket": ticket, "expires_in": settings.EVENTS_TICKET_SECONDS}
+
+@router.get("/stream")
+async def stream_events(stream_user: tuple[User, float] = Depends(get_stream_user)):
+    """
+    Server-sent events for the current user's notes (note.processed,
+    note.updated, note.deleted). The stream ends with an `expired` event when
+    the access token behind it expires. After a reconnect, clients should call
+    GET /notes/changes for anything published while they were away.
+    """
+    current_user, expires_at = stream_user
+    try:
+        subscription = await open_user_events(current_user.id)
+    except Exception as e:
+        print(f"Redis Error (Subscribe): {e}")
+        raise HTTPException(status_code=503, detail="Event stream unavailable")
+
+    return StreamingResponse(
+        stream_user_events(subscription, expires_at),
+        media_type="text/event-stream",
+        # No proxy buffering (nginx), or events arrive in batches
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,36 +1,51 @@
 from fastapi import APIRouter, Depends, Request, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse
 import uuid
 import hashlib
-from collections import Counter
+import time
 from typing import Optional, List
 from datetime import datetime
 
 from sqlmodel import Session, select
+from sqlalchemy.orm import defer
 from pydantic import BaseModel
-from fastapi.security import OAuth2PasswordBearer
-from jose import jwt, JWTError
 
 # Internal Modules
-from ..limiter import limiter
-from ..database import get_session, engine
-from ..models import Note, User
+from ..config import settings
+from ..limiter import limiter, llm_cost
+from ..database import get_session, get_read_session_for, engine
+from ..models import Note, NoteTag, Project, User
 from ..schemas.note import NoteCreate, NoteRead, ExplainRequest, FixRequest
-from ..services.auth_service import SECRET_KEY, ALGORITHM
+from ..dependencies import get_current_user, get_read_session
 from ..services.cache_service import (
     get_cache,
-    set_cache,
+    get_cache_raw,
     clear_user_search_cache,
     set_simple_cache,
+    get_swr_cache,
+    set_swr_cache,
+    release_refresh,
+    acquire_fill,
+    wait_for_fill,
 )
 from ..services.ai_service import (
     generate_tags,
     explain_code_snippet,
     perform_ai_action,
+    stream_explanation,
+    stream_ai_action,
+    is_error_response,
 )
-from ..services.vector_service import get_vector
+from ..services.llm_governor import INTERACTIVE
+from ..services.vector_service import get_vector, nearest_notes, tune_vector_search
 from ..services.scraper_service import scrape_url 
-
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+from ..services.tag_service import sync_note_tags, get_tag_counts
+from ..metrics import STAGE_LATENCY
+from ..services.event_service import publish_note_event
+from ..services.note_cache_service import cache_notes, invalidate_note, hydrate_notes, pack_ids, unpack_ids
+from ..services.sync_service import record_tombstone, parse_cursor, get_changes
+from ..serialization import RawJSONResponse, encode, encode_rows, rows_to_dicts
+from ..conditional import collection_etag, not_modified, etag_headers
 
 router = APIRouter(prefix="/notes", tags=["Notes"])
 
@@ -48,51 +63,34 @@ class NoteUpdate(BaseModel):
     project_id: Optional[str] = None
 
 
-# --- Dependency ---
-def get_current_user(
-    token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)
-):
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        user = session.get(User, user_id)
-        if user is None:
-            raise credentials_exception
-        return user
-    except JWTError:
-        raise credentials_exception
-
-
 # --- Background Task (UPDATED TO ASYNC) ---
 async def process_note_ai(
     note_id: uuid.UUID, user_id: uuid.UUID, title: str, code: str, language: str
 ):
-    try:
-        print(f"⚙️ Background: Generating AI tags for note {note_id}...")
-        # 🚀 FIX: Await the async tag generation
-        ai_tags = await generate_tags(code, language)
-        combined_text = f"{title} \n {code}"
-        vector = get_vector(combined_text)
-
-        with Session(engine) as session:
-            note = session.get(Note, note_id)
-            if note:
-                note.tags = ai_tags
-                note.embedding = vector
-                session.add(note)
-                session.commit()
-                print(f"✅ Background: Note {note_id} updated successfully.")
-
-        clear_user_search_cache(user_id)
-    except Exception as e:
-        print(f"🔥 Background Task Failed: {e}")
+    # Prometheus' .time() decorator does not await coroutines, so time the body
+    with STAGE_LATENCY.labels("process_note_ai").time():
+        try:
+            print(f"⚙️ Background: Generating AI tags for note {note_id}...")
+            # 🚀 FIX: Await the async tag generation
+            ai_tags = await generate_tags(code, language)
+            combined_text = f"{title} \n {code}"
+            vector = get_vector(combined_text)
+
+            with Session(engine) as session:
+                note = session.get(Note, note_id)
+                if note:
+                    note.tags = ai_tags
+                    note.embedding = vector
+                    session.add(note)
+                    sync_note_tags(session, note)
+                    session.commit()
+                    print(f"✅ Background: Note {note_id} updated successfully.")
+                    invalidate_note(note_id)
+                    publish_note_event("note.processed", user_id, note_id, tags=ai_tags)
+
+            clear_user_search_cache(user_id)
+        except Exception as e:
+            print(f"🔥 Background Task Failed: {e}")
 
 
 # --- 🚀 Import from URL ---
@@ -122,6 +120,7 @@ async def import_note_from_url(
         )
 
         session.add(new_note)
+        sync_note_tags(session, new_note)
         session.commit()
         session.refresh(new_note)
         clear_user_search_cache(current_user.id)
@@ -152,7 +151,9 @@ async def create_note(
     note_data: NoteCreate,
     background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    # Closed when the function returns: request-scoped sessions stay open until
+    # background tasks finish, pinning a pooled connection through tag generation
+    session: Session = Depends(get_session, scope="function"),
 ):
     new_note = Note(
         title=note_data.title,
@@ -182,58 +183,122 @@ async def create_note(
 
 @router.get("/", response_model=List[NoteRead])
 async def get_all_notes(
+    request: Request,
+    tag: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_read_session),
 ):
+    etag = collection_etag(request, current_user.id, "notes")
+    if cached := not_modified(request, etag):
+        return cached
+
+    # The 384-float embedding is never returned, so don't load it
     statement = (
         select(Note)
+        .options(defer(Note.embedding))
         .where(Note.owner_id == current_user.id)
         .order_by(Note.is_pinned.desc(), Note.created_at.desc())
     )
+    if tag:
+        tagged = select(NoteTag.note_id).where(
+            NoteTag.owner_id == current_user.id, NoteTag.tag == tag.strip().title()
+        )
+        statement = statement.where(Note.id.in_(tagged))
     results = session.exec(statement).all()
-    return results
+    return RawJSONResponse(encode_rows(results, NoteRead), headers=etag_headers(etag))
+
+
+def compute_search(session: Session, user_id, q: str, cache_key: str) -> bytes:
+    """Runs the search and caches it (empty results are not cached)"""
+    started = time.perf_counter()
+    query_vector = get_vector(q)
+    statement = nearest_notes(
+        select(Note).where(Note.owner_id == user_id), query_vector, limit=10
+    ).options(defer(Note.embedding))
+
+    with STAGE_LATENCY.labels("vector_query").time():
+        tune_vector_search(session, limit=10)
+        results = session.exec(statement).all()
+    payload = encode_rows(results, NoteRead)
+
+    if results:
+        # Stored as note ids; the bodies go to the per-note cache
+        cache_notes(results)
+        set_swr_cache(
+            cache_key, pack_ids(results), settings.SEARCH_CACHE_FRESH_SECONDS, settings.SEARCH_CACHE_STALE_SECONDS,
+            time.perf_counter() - started,
+        )
+    return payload
+
+
+def refresh_search_cache(cache_key: str, token: str, user_id, q: str):
+    """Background revalidation of a stale (or early-expiring) search entry"""
+    try:
+        for session in get_read_session_for(user_id):
+            compute_search(session, user_id, q, cache_key)
+    except Exception as e:
+        print(f"🔥 Search refresh failed: {e}")
+    finally:
+        release_refresh(cache_key, token)
 
 
 @router.get("/search/", response_model=List[NoteRead])
 async def search_notes(
     q: str,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_read_session),
 ):
     cache_key = f"search:{current_user.id}:{q.lower()}"
-    cached_result = get_cache(cache_key)
-    if cached_result:
-        return cached_result
+    cached, refresh_token = get_swr_cache(cache_key)
+    if cached:
+        if refresh_token:
+            background_tasks.add_task(refresh_search_cache, cache_key, refresh_token, current_user.id, q)
+        return RawJSONResponse(hydrate_notes(session, current_user.id, unpack_ids(cached)))
+
+    # Miss (expired, or wiped by a write): one request computes, identical ones wait for it
+    fill_token = acquire_fill(cache_key)
+    if not fill_token and (cached := await wait_for_fill(cache_key)):
+        return RawJSONResponse(hydrate_notes(session, current_user.id, unpack_ids(cached)))
+    try:
+        payload = compute_search(session, current_user.id, q, cache_key)
+    finally:
+        if fill_token:
+            release_refresh(cache_key, fill_token)
+    return RawJSONResponse(payload)
 
-    query_vector = get_vector(q)
-    statement = (
-        select(Note)
-        .where(Note.owner_id == current_user.id)
-        .order_by(Note.embedding.cosine_distance(query_vector))
-        .limit(10)
-    )
 
-    results = session.exec(statement).all()
-    clean_results = [NoteRead.model_validate(note) for note in results]
+@router.get("/tags/")
+async def get_user_tags(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_read_session),
+):
+    etag = collection_etag(request, current_user.id, "tags")
+    if cached := not_modified(request, etag):
+        return cached
 
-    if clean_results:
-        set_cache(cache_key, clean_results)
-    return clean_results
+    return RawJSONResponse(encode(get_tag_counts(session, current_user.id)), headers=etag_headers(etag))
 
 
-@router.get("/tags/")
-async def get_user_tags(
+@router.get("/changes")
+async def get_note_changes(
+    since: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_read_session),
 ):
-    statement = select(Note.tags).where(Note.owner_id == current_user.id)
-    results = session.exec(statement).all()
-    tag_counter = Counter()
-    for tag_str in results:
-        if tag_str:
-            tags = [t.strip().title() for t in tag_str.split(",")]
-            tag_counter.update(tags)
-    return [tag for tag, count in tag_counter.most_common()]
+    """
+    Delta sync: notes changed and ids deleted since the `cursor` of the previous
+    call. With `reset: true` the client should replace its local copy instead.
+    """
+    try:
+        since_at = parse_cursor(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    changes = get_changes(session, current_user.id, since_at)
+    changes["upserted"] = rows_to_dicts(changes["upserted"], NoteRead)
+    return RawJSONResponse(encode(changes))
 
 
 @router.put("/{note_id}", response_model=NoteRead)
@@ -261,8 +326,9 @@ async def update_note(
 
     if note_data.code_snippet is not None:
         note.code_snippet = note_data.code_snippet
-        # 🚀 FIX: Await generate_tags
-        note.tags = await generate_tags(note.code_snippet, note.language)
+        # 🚀 FIX: Await generate_tags (the client is waiting on it, so not background priority)
+        note.tags = await generate_tags(note.code_snippet, note.language, INTERACTIVE)
+        sync_note_tags(session, note)
     
     if note_data.title is not None or note_data.code_snippet is not None:
         note.embedding = get_vector(f"{note.title} \n {note.code_snippet}")
@@ -271,6 +337,15 @@ async def update_note(
     session.commit()
     session.refresh(note)
     clear_user_search_cache(current_user.id)
+    invalidate_note(note.id)
+
+    changed = [field for field, value in note_data.model_dump().items() if value is not None]
+    if note_data.code_snippet is not None:
+        changed.append("tags")
+    publish_note_event(
+        "note.updated", current_user.id, note.id,
+        updated_at=note.updated_at, **{field: getattr(note, field) for field in changed},
+    )
     return note
 
 
@@ -292,6 +367,8 @@ async def toggle_pin(
     note.is_pinned = not note.is_pinned
     session.add(note)
     session.commit()
+    invalidate_note(note.id)
+    publish_note_event("note.updated", current_user.id, note.id, is_pinned=note.is_pinned, updated_at=note.updated_at)
     return {"message": "Toggled", "is_pinned": note.is_pinned}
 
 
@@ -310,50 +387,141 @@ async def delete_note(
     if not note or note.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Not found")
     
+    # note_tags rows are removed by the ON DELETE CASCADE foreign key
+    record_tombstone(session, note)
     session.delete(note)
     session.commit()
     clear_user_search_cache(current_user.id)
+    invalidate_note(n_uuid)
+    publish_note_event("note.deleted", current_user.id, n_uuid)
     return {"message": "Deleted"}
 
 
+# --- AI Actions ---
+# The JSON and streaming variants share the same cache entries
+
+# The answer depends on the project's model preference, so it is part of the key
+# ("auto" routing is a pure function of the input)
+def explain_cache_key(body: ExplainRequest, preference: Optional[str]) -> str:
+    snippet_hash = hashlib.md5(body.code_snippet.encode()).hexdigest()
+    return f"explain:{preference or 'auto'}:{snippet_hash}"
+
+
+def fix_cache_key(body: FixRequest, preference: Optional[str]) -> str:
+    raw_data = f"{body.code_snippet}-{body.language}-{body.action}"
+    snippet_hash = hashlib.md5(raw_data.encode()).hexdigest()
+    return f"fix:{preference or 'auto'}:{snippet_hash}"
+
+
+def project_model_preference(session: Session, project_id: Optional[uuid.UUID], owner_id: uuid.UUID):
+    if not project_id:
+        return None
+    project = session.get(Project, project_id)
+    if not project or project.owner_id != owner_id:
+        return None
+    return project.ai_model_preference
+
+
+def stream_and_cache(chunks, cache_key: str, field: str):
+    """
+    Streams an AI response as plain text and caches the full text once it completes.
+    Failed streams are not cached.
+    """
+    async def response_generator():
+        full_response = ""
+        async for chunk in chunks:
+            full_response += chunk
+            yield chunk
+
+        if not is_error_response(full_response):
+            set_simple_cache(cache_key, {field: full_response.strip()})
+
+    return StreamingResponse(response_generator(), media_type="text/plain")
+
+
+def replay_cached(text: str):
+    async def cached_gen():
+        yield text
+    return StreamingResponse(cached_gen(), media_type="text/plain")
+
+
 @router.post("/explain/")
-@limiter.limit("5/minute")
+@limiter.limit("5/minute", cost=llm_cost(5))
 async def explain_note(
     request: Request,
     body: ExplainRequest,
     current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_read_session),
 ):
-    snippet_hash = hashlib.md5(body.code_snippet.encode()).hexdigest()
-    cache_key = f"explain:{snippet_hash}"
-    cached_result = get_cache(cache_key)
-    if cached_result:
-        return cached_result
+    preference = project_model_preference(session, body.project_id, current_user.id)
+    cache_key = explain_cache_key(body, preference)
+    if cached := get_cache_raw(cache_key):
+        return RawJSONResponse(cached)
     
     # 🚀 FIX: Await explain_code_snippet
-    explanation = await explain_code_snippet(body.code_snippet, body.language)
+    explanation = await explain_code_snippet(body.code_snippet, body.language, preference)
     response_data = {"explanation": explanation}
-    set_simple_cache(cache_key, response_data)
+    if not is_error_response(explanation):
+        set_simple_cache(cache_key, response_data)
     return response_data
 
 
 @router.post("/fix/")
-@limiter.limit("5/minute")
+@limiter.limit("5/minute", cost=llm_cost(5))
 async def fix_code(
-    request: Request, body: FixRequest, current_user: User = Depends(get_current_user)
+    request: Request,
+    body: FixRequest,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_read_session),
 ):
-    request.state.user = current_user
-    raw_data = f"{body.code_snippet}-{body.language}-{body.action}"
-    snippet_hash = hashlib.md5(raw_data.encode()).hexdigest()
-    cache_key = f"fix:{snippet_hash}"
-    
-    cached_result = get_cache(cache_key)
-    if cached_result:
-        return cached_result
+    preference = project_model_preference(session, body.project_id, current_user.id)
+    cache_key = fix_cache_key(body, preference)
+    if cached := get_cache_raw(cache_key):
+        return RawJSONResponse(cached)
     
     # 🚀 FIX: Await perform_ai_action
     result_code = await perform_ai_action(
-        body.code_snippet, body.language, body.action, body.error_message
+        body.code_snippet, body.language, body.action, body.error_message, preference
     )
     response_data = {"fixed_code": result_code}
-    set_simple_cache(cache_key, response_data)
-    return response_data
\ No newline at end of file
+    if not is_error_response(result_code):
+        set_simple_cache(cache_key, response_data)
+    return response_data
+
+
+@router.post("/explain/stream/")
+@limiter.limit("5/minute", cost=llm_cost(5))
+async def explain_note_stream(
+    request: Request,
+    body: ExplainRequest,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_read_session),
+):
+    preference = project_model_preference(session, body.project_id, current_user.id)
+    cache_key = explain_cache_key(body, preference)
+    if cached := get_cache(cache_key):
+        return replay_cached(cached.get("explanation", ""))
+
+    return stream_and_cache(
+        stream_explanation(body.code_snippet, body.language, preference), cache_key, "explanation"
+    )
+
+
+@router.post("/fix/stream/")
+@limiter.limit("5/minute", cost=llm_cost(5))
+async def fix_code_stream(
+    request: Request,
+    body: FixRequest,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_read_session),
+):
+    preference = project_model_preference(session, body.project_id, current_user.id)
+    cache_key = fix_cache_key(body, preference)
+    if cached := get_cache(cache_key):
+        return replay_cached(cached.get("fixed_code", ""))
+
+    return stream_and_cache(
+        stream_ai_action(body.code_snippet, body.language, body.action, body.error_message, preference),
+        cache_key,
+        "fixed_code",
+    )
@@ -2,22 +2,32 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlmodel import Session, select
 from ..database import get_session
 from ..models import Project, User
-from ..routers.notes import get_current_user
+from ..services.event_service import publish_note_event
+from ..services.note_cache_service import invalidate_notes
+from ..dependencies import get_current_user
 from ..limiter import limiter
+from ..serialization import RawJSONResponse, encode_rows
+from ..conditional import collection_etag, not_modified, etag_headers
 from pydantic import BaseModel
+from typing import Literal
 import uuid
+from datetime import datetime
 
 router = APIRouter(prefix="/projects", tags=["Projects"])
 
+ModelPreference = Literal["auto", "fast", "smart"]
+
 class ProjectCreate(BaseModel):
     name: str
     description: str | None = None
+    ai_model_preference: ModelPreference | None = None
 
 # 🚀 NEW: Schema for updates
 class ProjectUpdate(BaseModel):
     name: str | None = None
     description: str | None = None
     is_pinned: bool | None = None
+    ai_model_preference: ModelPreference | None = None
 
 @router.post("/", response_model=Project)
 @limiter.limit("10/minute")
@@ -30,6 +40,7 @@ async def create_project(
     new_project = Project(
         name=project_data.name,
         description=project_data.description,
+        ai_model_preference=project_data.ai_model_preference,
         owner_id=current_user.id
     )
     session.add(new_project)
@@ -44,12 +55,17 @@ async def get_projects(
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
+    etag = collection_etag(request, current_user.id, "projects")
+    if cached := not_modified(request, etag):
+        return cached
+
     # Sort by Pinned first
     statement = select(Project).where(Project.owner_id == current_user.id).order_by(
         Project.is_pinned.desc(),
         Project.created_at.desc()
     )
-    return session.exec(statement).all()
+    rows = session.exec(statement).all()
+    return RawJSONResponse(encode_rows(rows, Project), headers=etag_headers(etag))
 
 # 🚀 NEW: Patch endpoint for Rename/Pin
 @router.patch("/{project_id}", response_model=Project)
@@ -74,6 +90,8 @@ async def update_project(
         project.description = project_data.description
     if project_data.is_pinned is not None:
         project.is_pinned = project_data.is_pinned
+    if project_data.ai_model_preference is not None:
+        project.ai_model_preference = project_data.ai_model_preference
         
     session.add(project)
     session.commit()
@@ -94,7 +112,19 @@ async def delete_project(
     project = session.get(Project, p_uuid)
     if not project or project.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Project not found")
-        
+
+    # Its notes move to "global": a change to each of them for caches, streams and sync
+    updated_at = datetime.utcnow()
+    note_ids = []
+    for note in project.notes:
+        note.project_id = None
+        note.updated_at = updated_at
+        note_ids.append(note.id)
+        session.add(note)
+
     session.delete(project)
     session.commit()
+    invalidate_notes(note_ids)
+    for note_id in note_ids:
+        publish_note_event("note.updated", current_user.id, note_id, project_id=None, updated_at=updated_at)
     return {"message": "Deleted"}
\ No newline at end of file
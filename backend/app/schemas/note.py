@@ -16,12 +16,14 @@ class NoteRead(NoteBase):
     tags: Optional[str] = None
     is_pinned: bool = False 
     created_at: datetime
+    updated_at: Optional[datetime] = None
     owner_id: uuid.UUID
     project_id: Optional[uuid.UUID] = None
 
 class ExplainRequest(SQLModel):
     code_snippet: str
     language: str
+    project_id: Optional[uuid.UUID] = None  # applies the project's model preference
 
 class ChatRequest(SQLModel):
     message: str
@@ -31,4 +33,5 @@ class FixRequest(SQLModel):
     code_snippet: str
     language: str
     error_message: Optional[str] = None
-    action: str = "fix"
\ No newline at end of file
+    action: str = "fix"
+    project_id: Optional[uuid.UUID] = None  # applies the project's model preference
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""
+Fills note_tags for tagged notes that have no tag rows (notes tagged before the
+table existed). Works in id-ordered batches with a commit per batch, so it can be
+interrupted and re-run: notes that already have rows are skipped.
+
+    python -m app.scripts.backfill_note_tags [--batch-size 1000]
+"""
+import argparse
+import time
+
+from sqlmodel import Session, select, exists
+
+from ..database import engine
+from ..models import Note, NoteTag
+from ..services.tag_service import sync_note_tags
+
+MISSING_TAG_ROWS = ~exists().where(NoteTag.note_id == Note.id)
+
+
+def backfill(batch_size: int):
+    started, total, last_id = time.monotonic(), 0, None
+    while True:
+        with Session(engine) as session:
+            statement = (
+                select(Note)
+                .where(Note.tags != None, Note.tags != "", MISSING_TAG_ROWS)
+                .order_by(Note.id)
+                .limit(batch_size)
+            )
+            if last_id is not None:
+                statement = statement.where(Note.id > last_id)
+            notes = session.exec(statement).all()
+            if not notes:
+                break
+            for note in notes:
+                sync_note_tags(session, note)
+            last_id = notes[-1].id
+            session.commit()
+        total += len(notes)
+        print(f"⚙️ {total} notes backfilled...")
+
+    print(f"✅ Backfilled tags for {total} notes in {time.monotonic() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Populate note_tags for notes tagged before it existed")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    backfill(args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
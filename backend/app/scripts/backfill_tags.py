@@ -0,0 +1,98 @@
+"""
+Re-tags every untagged note with batched LLM calls, filling in missing
+embeddings on the way.
+
+    python -m app.scripts.backfill_tags [--batch-size 10] [--concurrency 4] [--limit N]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlmodel import Session, select, or_
+
+from ..config import settings
+from ..database import engine
+from ..models import Note
+from ..services.ai_service import generate_tags_batch
+from ..services.cache_service import clear_user_search_cache
+from ..services.note_cache_service import invalidate_note
+from ..services.tag_service import sync_note_tags
+from ..services.vector_service import get_vector
+
+UNTAGGED = or_(Note.tags == None, Note.tags == "", Note.tags == "untagged")
+
+
+def load_untagged_ids(limit: int | None) -> list[uuid.UUID]:
+    with Session(engine) as session:
+        statement = select(Note.id).where(UNTAGGED).order_by(Note.created_at)
+        if limit:
+            statement = statement.limit(limit)
+        return list(session.exec(statement).all())
+
+
+async def tag_batch(note_ids: list[uuid.UUID]) -> set[uuid.UUID]:
+    """Tags one batch and returns the owners whose search cache is now stale."""
+    # Read, then release the connection while the LLM call is in flight
+    with Session(engine) as session:
+        notes = session.exec(select(Note).where(Note.id.in_(note_ids))).all()
+        items = [(note.code_snippet, note.language) for note in notes]
+        ids = [note.id for note in notes]
+
+    tags = await generate_tags_batch(items)
+
+    owners = set()
+    with Session(engine) as session:
+        for note_id, note_tags in zip(ids, tags):
+            note = session.get(Note, note_id)
+            if not note:
+                continue
+            note.tags = note_tags
+            if note.embedding is None:
+                note.embedding = get_vector(f"{note.title} \n {note.code_snippet}")
+            session.add(note)
+            sync_note_tags(session, note)
+            owners.add(note.owner_id)
+        session.commit()
+    for note_id in ids:
+        invalidate_note(note_id)
+    return owners
+
+
+async def backfill(batch_size: int, concurrency: int, limit: int | None):
+    note_ids = load_untagged_ids(limit)
+    batches = [note_ids[i:i + batch_size] for i in range(0, len(note_ids), batch_size)]
+    print(f"⚙️ Tagging {len(note_ids)} notes in {len(batches)} batches...")
+
+    # The LLM governor still caps upstream concurrency; this bounds open batches
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(batch):
+        async with semaphore:
+            try:
+                return await tag_batch(batch)
+            except Exception as e:
+                print(f"🔥 Batch failed: {e}")
+                return set()
+
+    started = time.monotonic()
+    results = await asyncio.gather(*(run(batch) for batch in batches))
+    elapsed = time.monotonic() - started
+
+    for owner_id in set().union(*results):
+        clear_user_search_cache(owner_id)
+    rate = len(note_ids) / elapsed if elapsed else 0
+    print(f"✅ Tagged {len(note_ids)} notes in {elapsed:.1f}s ({rate:.1f} notes/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-tag untagged notes with batched LLM calls")
+    parser.add_argument("--batch-size", type=int, default=settings.LLM_TAG_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.batch_size, args.concurrency, args.limit))
+
+
+if __name__ == "__main__":
+    main()
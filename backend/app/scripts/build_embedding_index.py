@@ -0,0 +1,50 @@
+"""
+Builds the HNSW index that EMBEDDING_STORAGE=halfvec / bit searches its candidates
+on. The build reads every embedding and can take minutes on a large note table;
+CONCURRENTLY keeps note readable and writable meanwhile. Safe to re-run: a valid
+index is left alone and one left invalid by an interrupted build is rebuilt.
+
+    python -m app.scripts.build_embedding_index [--storage halfvec|bit]
+"""
+import argparse
+import time
+
+from sqlalchemy import text
+
+from ..config import settings
+from ..database import engine, EMBEDDING_INDEXES
+
+
+def create_index(storage: str):
+    name, definition = EMBEDDING_INDEXES[storage]
+    # CONCURRENTLY cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        valid = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name"
+        ), {"name": name}).scalar()
+        if valid:
+            print(f"✅ {name} already exists")
+            return
+        if valid is False:
+            # Left behind by an interrupted concurrent build
+            conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY {name} {definition}"))
+    print(f"✅ Created {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the quantized embedding index")
+    parser.add_argument("--storage", choices=sorted(EMBEDDING_INDEXES), default=settings.EMBEDDING_STORAGE)
+    args = parser.parse_args()
+    if args.storage not in EMBEDDING_INDEXES:
+        print(f"EMBEDDING_STORAGE={args.storage} searches the embedding column directly, no index to build")
+        return
+
+    started = time.monotonic()
+    create_index(args.storage)
+    print(f"Done in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+from functools import lru_cache
+
+import orjson
+from fastapi.responses import Response
+
+
+class RawJSONResponse(Response):
+    """
+    Sends a body that is already JSON (bytes or str) as-is: no response_model
+    validation and no second encode. Used for list endpoints and cache hits.
+    """
+    media_type = "application/json"
+
+
+def encode(data) -> bytes:
+    return orjson.dumps(data)
+
+
+@lru_cache(maxsize=None)
+def _schema_fields(schema) -> tuple[str, ...]:
+    return tuple(schema.model_fields)
+
+
+def rows_to_dicts(rows, schema) -> list[dict]:
+    """
+    `schema`'s fields read straight off ORM rows, with no intermediate Pydantic
+    models. The schema must only declare plain column attributes (uuid,
+    datetime, str, ... are native to orjson).
+    """
+    fields = _schema_fields(schema)
+    return [{field: getattr(row, field) for field in fields} for row in rows]
+
+
+def encode_rows(rows, schema) -> bytes:
+    """Encodes ORM rows as a JSON array of `schema`'s fields."""
+    return orjson.dumps(rows_to_dicts(rows, schema))
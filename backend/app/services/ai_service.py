@@ -1,14 +1,168 @@
 import re 
-from groq import AsyncGroq
+import asyncio
+import hashlib
+import json
+import time
 from ..config import settings 
+from ..circuit_breaker import CircuitBreaker
+from ..metrics import LLM_COALESCED, LLM_CALL_LATENCY, LLM_TOKENS, LLM_ROUTE_FALLBACK, STAGE_LATENCY
+from .cache_service import (
+    get_cache, set_simple_cache, acquire_lock, release_lock, cache_exists, new_lock_token
+)
+from .llm_governor import INTERACTIVE, BACKGROUND, llm_slot, estimate_tokens, estimate_prompt_tokens
+from .llm_provider import get_provider
+
+# Groq in production; LLM_PROVIDER=stub swaps in the offline fake
+provider = get_provider()
 
-client = AsyncGroq(
-    api_key=settings.GROQ_API_KEY,
+# While the provider is down, calls fail fast (tagging falls back to "untagged",
+# streams end with STREAM_ERROR_PREFIX) instead of each waiting out the timeout
+llm_breaker = CircuitBreaker(
+    provider.name,
+    failure_threshold=settings.LLM_BREAKER_FAILURES,
+    reset_seconds=settings.LLM_BREAKER_RESET_SECONDS,
+    failure_types=provider.transient_errors,
 )
 
 MODEL_SMART = "llama-3.3-70b-versatile" 
 MODEL_FAST = "llama-3.1-8b-instant"
 
+# --- REQUEST COALESCING (single-flight) ---
+# Identical non-streaming requests (same model, messages, parameters and priority)
+# share one upstream call: in-process through a shared future, across workers through
+# a Redis lock whose holder publishes the result under a short-lived key.
+_inflight: dict[str, asyncio.Future] = {}
+
+def record_llm_call(route: str, model: str, seconds: float, prompt_tokens: int, completion_tokens: int):
+    LLM_CALL_LATENCY.labels(route, model).observe(seconds)
+    LLM_TOKENS.labels(route, model, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(route, model, "completion").inc(completion_tokens)
+
+async def _create_text(params: dict, priority: int, route: str) -> str:
+    est_tokens = estimate_tokens(params["messages"], params.get("max_tokens"))
+    # Checked before queueing for a governor slot, so an open circuit costs nothing
+    with llm_breaker.guard():
+        async with llm_slot(params["model"], priority, est_tokens):
+            started = time.monotonic()
+            completion = await provider.complete(**params)
+    record_llm_call(
+        route, params["model"], time.monotonic() - started,
+        completion.usage.get("prompt_tokens", 0), completion.usage.get("completion_tokens", 0),
+    )
+    return completion.text
+
+async def _complete_across_workers(key: str, params: dict, priority: int, route: str) -> str:
+    lock_key, result_key = f"sf:lock:{key}", f"sf:result:{key}"
+    token = new_lock_token()
+    wait_seconds = settings.LLM_COALESCE_WAIT_SECONDS
+
+    if acquire_lock(lock_key, token, wait_seconds * 1000):
+        LLM_COALESCED.labels("leader").inc()
+        try:
+            text = await _create_text(params, priority, route)
+            set_simple_cache(result_key, {"text": text}, expire=wait_seconds)
+            return text
+        finally:
+            release_lock(lock_key, token)
+
+    # Another worker owns this request: wait for its result
+    deadline = time.monotonic() + wait_seconds
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        if cached := get_cache(result_key):
+            LLM_COALESCED.labels("remote").inc()
+            return cached["text"]
+        if not cache_exists(lock_key):
+            break  # the owner failed without publishing a result
+
+    LLM_COALESCED.labels("fallback").inc()
+    return await _create_text(params, priority, route)
+
+async def complete_text(priority: int = INTERACTIVE, route: str = "other", **params) -> str:
+    """
+    Returns the message content of a chat completion, coalescing identical concurrent calls.
+    The upstream call waits for a governor slot at the given priority.
+    """
+    # Priority is part of the key: an interactive call never waits behind a background leader
+    key = hashlib.sha256(json.dumps({"priority": priority, **params}, sort_keys=True).encode()).hexdigest()
+
+    while (shared := _inflight.get(key)) is not None:
+        LLM_COALESCED.labels("local").inc()
+        try:
+            return await asyncio.shield(shared)
+        except asyncio.CancelledError:
+            if not shared.cancelled():
+                raise  # this caller was cancelled, not the leader
+            # The leader was cancelled (its client went away): the first follower
+            # back takes over, the rest attach to it
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        text = await _complete_across_workers(key, params, priority, route)
+        future.set_result(text)
+        return text
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        if not future.done():
+            future.cancel()  # cancelled leader: wake followers so they can retry
+        del _inflight[key]
+
+# --- MODEL ROUTING ---
+# Each call names its route (the AI action). Routes listed in LLM_FAST_ROUTES go to
+# the fast model while their input stays under the route's token limit; a project
+# can pin either model. A fast answer that fails its route's validator is retried
+# once on the smart model (the provider exposes no confidence score, so a
+# malformed answer is the low-confidence signal).
+def choose_model(route: str, messages: list, preference: str = None) -> str:
+    if preference == "smart":
+        return MODEL_SMART
+    if preference == "fast":
+        return MODEL_FAST
+    fast_limit = settings.LLM_FAST_ROUTES.get(route)
+    if fast_limit is not None and estimate_prompt_tokens(messages) <= fast_limit:
+        return MODEL_FAST
+    return MODEL_SMART
+
+def _valid_tags(text: str) -> bool:
+    tags = [t.strip() for t in text.split(",") if t.strip()]
+    return 1 <= len(tags) <= 8 and all(len(t) <= 40 and "\n" not in t for t in tags)
+
+def _valid_title(text: str) -> bool:
+    title = text.strip().strip('"')
+    return 0 < len(title.split()) <= 8 and "\n" not in title
+
+def _valid_code(text: str) -> bool:
+    return "```" in text
+
+def _valid_prose(text: str) -> bool:
+    return len(text.strip()) >= 20
+
+ROUTE_VALIDATORS = {
+    "tags": _valid_tags,
+    "title": _valid_title,
+    "explain": _valid_prose,
+    "fix": _valid_code,
+    "security": _valid_code,
+    "document": _valid_code,
+    "optimize": _valid_code,
+    "test": _valid_code,
+}
+
+async def routed_complete(route: str, messages: list, preference: str = None,
+                          priority: int = INTERACTIVE, **params) -> str:
+    model = choose_model(route, messages, preference)
+    text = await complete_text(priority=priority, route=route, messages=messages, model=model, **params)
+
+    validator = ROUTE_VALIDATORS.get(route)
+    if model != MODEL_SMART and validator and not validator(text or ""):
+        LLM_ROUTE_FALLBACK.labels(route).inc()
+        text = await complete_text(priority=priority, route=route, messages=messages, model=MODEL_SMART, **params)
+    return text
+
 # --- DYNAMIC SYSTEM PROMPT ---
 def get_adaptive_system_prompt(context_str: str, project_name: str = None):
     project_context = f"You are working on the project: '{project_name}'." if project_name else "You are acting as a General Technical Consultant."
@@ -41,60 +195,171 @@ def get_adaptive_system_prompt(context_str: str, project_name: str = None):
        - For pros/cons or comparisons, use Tables.
     """
 
-async def generate_tags(code_snippet: str, language: str):
+async def generate_tags(code_snippet: str, language: str, priority: int = BACKGROUND):
+    # Background by default; a caller awaiting the tags in its response passes INTERACTIVE
     try:
         prompt = "Analyze the code. Return ONLY a comma-separated list of 3-5 technical tags. IMPORTANT: Use correct technical capitalization."
-        chat_completion = await client.chat.completions.create(
-            messages=[{"role": "system", "content": prompt}, {"role": "user", "content": code_snippet}],
-            model=MODEL_FAST,
+        return await routed_complete(
+            "tags",
+            [{"role": "system", "content": prompt}, {"role": "user", "content": code_snippet}],
+            priority=priority,
         )
-        return chat_completion.choices[0].message.content
     except Exception as e:
         print(f"Error generating tags: {e}")
         return "untagged"
+
+# --- BATCHED TAGGING ---
+# Several snippets share one request (and one copy of the instructions). Items the
+# model skips or garbles are retried one by one with generate_tags.
+TAG_BATCH_PROMPT = (
+    "Analyze each numbered code snippet. For each one pick 3-5 technical tags. "
+    "IMPORTANT: Use correct technical capitalization. "
+    'Return ONLY a JSON object mapping the snippet number to a comma-separated tag string, e.g. {"1": "FastAPI, Async, SQL"}.'
+)
+
+def get_tag_batch_messages(items: list[tuple[str, str]]):
+    max_chars = settings.LLM_TAG_SNIPPET_TOKENS * 4
+    sections = [
+        f"### Snippet {i} ({language})\n{code_snippet[:max_chars]}"
+        for i, (code_snippet, language) in enumerate(items, start=1)
+    ]
+    return [
+        {"role": "system", "content": TAG_BATCH_PROMPT},
+        {"role": "user", "content": "\n\n".join(sections)},
+    ]
+
+def parse_tag_batch(text: str, count: int) -> dict[int, str]:
+    """
+    Maps 0-based item positions to tag strings. Tolerates code fences and chatter
+    around the JSON; entries that are missing or malformed are left out.
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    results = {}
+    for key, value in data.items():
+        try:
+            position = int(str(key).strip().lstrip("#")) - 1
+        except ValueError:
+            continue
+        if isinstance(value, list):
+            value = ", ".join(str(v) for v in value)
+        if 0 <= position < count and isinstance(value, str) and _valid_tags(value):
+            results[position] = value.strip()
+    return results
+
+async def generate_tags_batch(items: list[tuple[str, str]]) -> list[str]:
+    """
+    Tags for each (code_snippet, language) pair, in order.
+    """
+    parsed = {}
+    if len(items) > 1:
+        try:
+            text = await routed_complete(
+                "tags_batch",
+                get_tag_batch_messages(items),
+                priority=BACKGROUND,
+                max_tokens=30 * len(items) + 20,
+            )
+            parsed = parse_tag_batch(text or "", len(items))
+        except Exception as e:
+            print(f"Error generating batched tags: {e}")
+
+    missing = [i for i in range(len(items)) if i not in parsed]
+    if missing:
+        singles = await asyncio.gather(*(generate_tags(*items[i]) for i in missing))
+        parsed.update(zip(missing, singles))
+    return [parsed[i] for i in range(len(items))]
     
-async def explain_code_snippet(code_snippet: str, language: str):
+def get_explain_messages(code_snippet: str):
+    prompt = "You are a Senior Engineer. Explain this code clearly to a colleague. Be concise."
+    return [{"role": "system", "content": prompt}, {"role": "user", "content": code_snippet}]
+
+# Returned in place of an answer when the provider call fails (breaker open,
+# provider error, timeout)
+EXPLAIN_ERROR = "AI could not generate an explanation at this time."
+ACTION_ERROR_PREFIX = "// Error: Could not perform "
+
+async def explain_code_snippet(code_snippet: str, language: str, preference: str = None):
     try:
-        prompt = "You are a Senior Engineer. Explain this code clearly to a colleague. Be concise."
-        chat_completion = await client.chat.completions.create(
-            messages=[{"role": "system", "content": prompt}, {"role": "user", "content": code_snippet}],
-            model=MODEL_SMART,
-        )
-        return chat_completion.choices[0].message.content
+        return await routed_complete("explain", get_explain_messages(code_snippet), preference)
     except Exception as e:
         print(f"Error generating explanation: {e}")
-        return "AI could not generate an explanation at this time."
+        return EXPLAIN_ERROR
+
+# --- STREAMING ---
+# Streams end with this marker on failure, so callers know not to cache the text
+STREAM_ERROR_PREFIX = "\n[System Error: "
+
+def is_error_response(text: str) -> bool:
+    """True for the failure text of any AI call here, which must not be cached or stored"""
+    return STREAM_ERROR_PREFIX in text or text == EXPLAIN_ERROR or text.startswith(ACTION_ERROR_PREFIX)
+
+async def stream_completion(messages: list, model: str, temperature: float = None, route: str = "other"):
+    """
+    Yields content deltas. The governor slot is held for the whole stream.
+    Streams report no usage, so token spend is estimated from the text.
+    """
+    params = {"messages": messages, "model": model}
+    if temperature is not None:
+        params["temperature"] = temperature
+
+    with llm_breaker.guard():
+        async with llm_slot(model, INTERACTIVE, estimate_tokens(messages)):
+            started = time.monotonic()
+            streamed_chars = 0
+            try:
+                async for chunk in provider.stream(**params):
+                    if not streamed_chars:
+                        STAGE_LATENCY.labels("llm_ttft").observe(time.monotonic() - started)
+                    streamed_chars += len(chunk)
+                    yield chunk
+            finally:
+                elapsed = time.monotonic() - started
+                STAGE_LATENCY.labels("llm_stream").observe(elapsed)
+                record_llm_call(route, model, elapsed, estimate_prompt_tokens(messages), streamed_chars // 4)
+
+async def stream_explanation(code_snippet: str, language: str, preference: str = None):
+    try:
+        messages = get_explain_messages(code_snippet)
+        model = choose_model("explain", messages, preference)
+        async for chunk in stream_completion(messages, model, route="explain"):
+            yield chunk
+    except Exception as e:
+        yield f"{STREAM_ERROR_PREFIX}{str(e)}]"
 
 # --- THE MAIN CHAT ENGINE ---
-async def stream_chat_with_notes(context: str, question: str, history: list = [], project_name: str = None):
+async def stream_chat_with_notes(context: str, question: str, history: list = [], project_name: str = None,
+                                 preference: str = None):
     try:
         system_prompt = get_adaptive_system_prompt(context, project_name)
         messages = [{"role": "system", "content": system_prompt}]
         messages.extend(history)
         messages.append({"role": "user", "content": question})
         
-        stream = await client.chat.completions.create(
-            messages=messages,
-            model=MODEL_SMART,
-            temperature=0.3, 
-            stream=True 
-        )
-
-        async for chunk in stream:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+        model = choose_model("chat", messages, preference)
+        async for chunk in stream_completion(messages, model, temperature=0.3, route="chat"):
+            yield chunk
 
     except Exception as e:
-        yield f"\n[System Error: {str(e)}]"
+        yield f"{STREAM_ERROR_PREFIX}{str(e)}]"
 
 # --- BACKWARD COMPATIBILITY WRAPPER ---
-async def chat_with_notes(context: str, question: str, history: list = [], project_name: str = None):
+async def chat_with_notes(context: str, question: str, history: list = [], project_name: str = None,
+                          preference: str = None):
     response = ""
-    async for chunk in stream_chat_with_notes(context, question, history, project_name):
+    async for chunk in stream_chat_with_notes(context, question, history, project_name, preference):
         response += chunk
     return response
 
-async def perform_ai_action(code_snippet: str, language: str, action: str = "fix", error_msg: str = ""):
+def get_action_messages(code_snippet: str, language: str, action: str = "fix", error_msg: str = ""):
     language_rules = ""
     if language.lower() in ["javascript", "typescript", "js", "ts"]:
         language_rules = "RULE: In JavaScript/TypeScript, replace 'print()' with 'console.log()' unless explicitly asking for window printing."
@@ -110,33 +375,51 @@ async def perform_ai_action(code_snippet: str, language: str, action: str = "fix
     }
 
     selected_prompt = prompts.get(action, f"Improve this code. {base_instruction}")
-    
+    return [
+        {"role": "system", "content": f"You are an Elite Developer. Task: {selected_prompt}. Constraint: Code first."},
+        {"role": "user", "content": code_snippet}
+    ]
+
+def action_route(action: str) -> str:
+    return action if action in ROUTE_VALIDATORS else "improve"
+
+async def perform_ai_action(code_snippet: str, language: str, action: str = "fix", error_msg: str = "",
+                            preference: str = None):
     try:
-        chat_completion = await client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": f"You are an Elite Developer. Task: {selected_prompt}. Constraint: Code first."},
-                {"role": "user", "content": code_snippet}
-            ],
-            model=MODEL_SMART,
-            temperature=0.2, 
+        result = await routed_complete(
+            action_route(action),
+            get_action_messages(code_snippet, language, action, error_msg),
+            preference,
+            temperature=0.2,
         )
-        return chat_completion.choices[0].message.content.strip()
+        return result.strip()
 
     except Exception as e:
         print(f"Error in AI Action ({action}): {e}")
-        return f"// Error: Could not perform {action}."
+        return f"{ACTION_ERROR_PREFIX}{action}."
+
+async def stream_ai_action(code_snippet: str, language: str, action: str = "fix", error_msg: str = "",
+                           preference: str = None):
+    try:
+        route = action_route(action)
+        messages = get_action_messages(code_snippet, language, action, error_msg)
+        model = choose_model(route, messages, preference)
+        async for chunk in stream_completion(messages, model, temperature=0.2, route=route):
+            yield chunk
+    except Exception as e:
+        yield f"{STREAM_ERROR_PREFIX}{str(e)}]"
     
 async def generate_chat_title(first_message: str):
     try:
-        completion = await client.chat.completions.create(
-            messages=[
+        title = await routed_complete(
+            "title",
+            [
                 {"role": "system", "content": "Generate a concise label (3-5 words max) for this chat. Do not use quotes."},
                 {"role": "user", "content": first_message}
             ],
-            model="llama-3.3-70b-versatile",
             temperature=0.3,
             max_tokens=20,
         )
-        return completion.choices[0].message.content.strip().strip('"')
+        return title.strip().strip('"')
     except Exception as e:
         return "New Chat"
\ No newline at end of file
@@ -1,7 +1,13 @@
+import asyncio
 import bcrypt
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from ..config import settings
+from ..metrics import STAGE_LATENCY
 import os
 
 # Config
@@ -9,6 +15,10 @@ SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 REFRESH_TOKEN_EXPIRE_DAYS = 7     # Long lived for convenience
+TOKEN_CACHE_SIZE = 4096
+
+# token -> (subject, expiry). Signature checks are only repeated once a token falls out.
+_token_cache: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -23,10 +33,42 @@ def get_password_hash(password: str) -> str:
     Hashes a password using bcrypt with a generated salt.
     """
     pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(pwd_bytes, salt)
     return hashed.decode('utf-8')
 
+def needs_rehash(hashed_password: str) -> bool:
+    """True when a stored hash ($2b$<cost>$...) was made with another cost factor."""
+    try:
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+# --- Off-loop hashing ---
+# bcrypt takes tens to hundreds of ms per call (and releases the GIL), so async
+# endpoints hand it to a small dedicated pool instead of stalling the event loop.
+_hash_pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_MAX_PENDING)
+
+class PasswordHasherBusy(Exception):
+    pass
+
+async def _run_hasher(func, *args):
+    # Bounded so a login burst queues at most PASSWORD_HASH_MAX_PENDING jobs
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    try:
+        with STAGE_LATENCY.labels("password_hash").time():
+            return await asyncio.get_running_loop().run_in_executor(_hash_pool, func, *args)
+    finally:
+        _hash_slots.release()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hasher(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hasher(get_password_hash, password)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -45,4 +87,27 @@ def decode_token(token: str):
     try:
         return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        return None
\ No newline at end of file
+        return None
+
+def get_token_claims(token: str):
+    """
+    Returns (sub, exp) of a valid access token, or None.
+    Successful decodes are memoized until the token expires.
+    """
+    cached = _token_cache.get(token)
+    if cached and cached[1] > time.time():
+        return cached
+
+    payload = decode_token(token)
+    if not payload or payload.get("type") != "access" or not payload.get("sub"):
+        return None
+
+    claims = _token_cache[token] = (payload["sub"], payload["exp"])
+    if len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+    return claims
+
+def get_token_subject(token: str):
+    """Returns the `sub` of a valid access token, or None."""
+    claims = get_token_claims(token)
+    return claims[0] if claims else None
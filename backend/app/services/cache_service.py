@@ -1,52 +1,500 @@
 import redis
+import asyncio
 import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
 from ..config import settings
+from ..circuit_breaker import CircuitBreaker, CircuitOpenError
+from ..metrics import STAGE_LATENCY, record_cache_lookup, record_cache_revalidation, record_cache_tier
 
 # Connect using the Environment Variable (Works in Docker AND Render)
 # This automatically handles user, password, host, and port from the URL.
-redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+# Responses stay bytes: cached values are binary frames (see encode_frame)
+# Tight timeouts: the cache is an optimisation, so a slow Redis must not hold requests
+redis_client = redis.from_url(
+    settings.REDIS_URL,
+    decode_responses=False,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT_SECONDS,
+)
+
+# While Redis is down every helper below fails fast, behaving like a miss / no-op
+redis_breaker = CircuitBreaker(
+    "redis",
+    failure_threshold=settings.REDIS_BREAKER_FAILURES,
+    reset_seconds=settings.REDIS_BREAKER_RESET_SECONDS,
+    failure_types=(redis.exceptions.ConnectionError, redis.exceptions.TimeoutError),
+)
+
+def _log_error(action: str, e: Exception):
+    # Rejections while the circuit is open are expected; the transition is logged once
+    if not isinstance(e, CircuitOpenError):
+        print(f"Redis Error ({action}): {e}")
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+# --- Value framing ---
+# Every cached value is a small binary header plus the JSON payload:
+#   version (1 byte) | flags (1 byte) | soft expiry (double) | compute seconds (float)
+# Payloads of CACHE_COMPRESS_MIN_BYTES or more are zlib-compressed when that pays off.
+# Values that are not frames (written before the format existed) read as misses.
+FRAME_VERSION = 1
+FLAG_ZLIB = 1
+_FRAME = struct.Struct("!BBdf")
+
+def encode_frame(payload: bytes, soft_expiry: float = math.inf, compute_seconds: float = 0.0) -> bytes:
+    flags = 0
+    if len(payload) >= settings.CACHE_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(payload, settings.CACHE_COMPRESS_LEVEL)
+        if len(compressed) < len(payload):
+            payload, flags = compressed, FLAG_ZLIB
+    return _FRAME.pack(FRAME_VERSION, flags, soft_expiry, compute_seconds) + payload
+
+def decode_frame(raw):
+    """(payload, soft expiry, compute seconds), or None for anything that is not a frame"""
+    if not isinstance(raw, bytes) or len(raw) < _FRAME.size or raw[0] != FRAME_VERSION:
+        return None
+    _, flags, soft_expiry, compute_seconds = _FRAME.unpack_from(raw)
+    payload = raw[_FRAME.size:]
+    try:
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+    except zlib.error as e:
+        print(f"Redis Error (Decompress): {e}")
+        return None
+    return payload, soft_expiry, compute_seconds
+
+# --- L1: in-process cache in front of Redis ---
+# Hot keys under L1_CACHE_PREFIXES are kept (decoded) in an LRU bounded by entry
+# count, bytes and a short TTL. Writes and deletes are broadcast on L1_CHANNEL so
+# other workers drop their copy; the TTL bounds staleness if a broadcast is missed.
+L1_CHANNEL = "l1:invalidate"
+WORKER_ID = uuid.uuid4().hex[:12]
+
+_l1: OrderedDict[str, tuple[float, tuple]] = OrderedDict()  # key -> (expires_at, decoded frame)
+_l1_bytes = 0
+_l1_lock = threading.Lock()
+
+def _l1_enabled(key: str) -> bool:
+    return settings.L1_CACHE_MAX_ENTRIES > 0 and key.split(":", 1)[0] in settings.L1_CACHE_PREFIXES
+
+def _l1_remove(key: str):
+    global _l1_bytes
+    entry = _l1.pop(key, None)
+    if entry:
+        _l1_bytes -= len(entry[1][0])
+
+def l1_get(key: str):
+    with _l1_lock:
+        entry = _l1.get(key)
+        if not entry:
+            return None
+        if entry[0] <= time.monotonic():
+            _l1_remove(key)
+            return None
+        _l1.move_to_end(key)
+        return entry[1]
+
+def l1_put(key: str, entry: tuple, ttl: float):
+    global _l1_bytes
+    if len(entry[0]) > settings.L1_CACHE_MAX_ITEM_BYTES:
+        return
+    with _l1_lock:
+        _l1_remove(key)
+        _l1[key] = (time.monotonic() + min(ttl, settings.L1_CACHE_TTL_SECONDS), entry)
+        _l1_bytes += len(entry[0])
+        while len(_l1) > settings.L1_CACHE_MAX_ENTRIES or _l1_bytes > settings.L1_CACHE_MAX_BYTES:
+            _l1_remove(next(iter(_l1)))
+
+def l1_drop(key: str = None, prefix: str = None):
+    """Drops one key, every key under a prefix, or (with neither) everything"""
+    global _l1_bytes
+    with _l1_lock:
+        if key is not None:
+            _l1_remove(key)
+        elif prefix is not None:
+            for cached_key in [k for k in _l1 if k.startswith(prefix)]:
+                _l1_remove(cached_key)
+        else:
+            _l1.clear()
+            _l1_bytes = 0
+
+def _l1_broadcast(kind: str, target: str):
+    publish(L1_CHANNEL, f"{WORKER_ID} {kind} {target}")
+
+def _l1_invalidate(key: str = None, prefix: str = None):
+    l1_drop(key=key, prefix=prefix)
+    _l1_broadcast(*(("key", key) if key is not None else ("prefix", prefix)))
+
+def _listen_for_invalidations():
+    # Own connection without a socket timeout: it sits idle in listen() between messages
+    listener = redis.from_url(settings.REDIS_URL, socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT_SECONDS)
+    while True:
+        try:
+            pubsub = listener.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(L1_CHANNEL)
+            # Broadcasts sent while we were not subscribed are lost
+            l1_drop()
+            for message in pubsub.listen():
+                sender, kind, target = _text(message["data"]).split(" ", 2)
+                if sender != WORKER_ID:
+                    l1_drop(**{kind: target})
+        except Exception as e:
+            print(f"Redis Error (L1 Invalidation): {e}")
+            time.sleep(1)
+
+def start_l1_invalidation():
+    """Starts this worker's invalidation listener (once, at startup)"""
+    if settings.L1_CACHE_MAX_ENTRIES > 0:
+        threading.Thread(target=_listen_for_invalidations, name="l1-invalidation", daemon=True).start()
+
+# --- Reads and writes ---
+def _get_entry(key: str):
+    """Decoded frame for a key, from L1 or Redis; None on a miss"""
+    use_l1 = _l1_enabled(key)
+    if use_l1:
+        entry = l1_get(key)
+        record_cache_tier(key, "l1", entry is not None)
+        if entry is not None:
+            record_cache_lookup(key, True)
+            return entry
+
+    entry = None
+    try:
+        with redis_breaker.guard(), STAGE_LATENCY.labels("redis_get").time():
+            entry = decode_frame(redis_client.get(key))
+    except Exception as e:
+        _log_error("Get", e)
+    finally:
+        record_cache_tier(key, "redis", entry is not None)
+        record_cache_lookup(key, entry is not None)
+    if entry is not None and use_l1:
+        l1_put(key, entry, settings.L1_CACHE_TTL_SECONDS)
+    return entry
+
+def get_cache_raw(key: str):
+    """Retrieve the stored payload bytes, unparsed (serve JSON with RawJSONResponse)"""
+    entry = _get_entry(key)
+    return entry[0] if entry else None
 
 def get_cache(key: str):
     """Retrieve data from Redis"""
-    try:
-        data = redis_client.get(key)
-        if data:
+    data = get_cache_raw(key)
+    if data:
+        try:
             return json.loads(data)
-    except Exception as e:
-        print(f"Redis Error (Get): {e}")
+        except ValueError as e:
+            print(f"Redis Error (Decode): {e}")
     return None
 
-def set_cache(key: str, data: list, expire: int = 300):
-    """Save data to Redis (Default expiry: 5 minutes)"""
+def get_many_raw(keys: list[str]) -> list:
+    """Payloads for several keys (None for misses): L1 first, then one MGET for the rest"""
+    results = [None] * len(keys)
+    remote = []
+    for i, key in enumerate(keys):
+        entry = None
+        if _l1_enabled(key):
+            entry = l1_get(key)
+            record_cache_tier(key, "l1", entry is not None)
+        if entry is not None:
+            results[i] = entry[0]
+            record_cache_lookup(key, True)
+        else:
+            remote.append(i)
+    if remote:
+        try:
+            with redis_breaker.guard(), STAGE_LATENCY.labels("redis_get").time():
+                values = redis_client.mget([keys[i] for i in remote])
+            for i, raw in zip(remote, values):
+                entry = decode_frame(raw)
+                if entry is not None:
+                    results[i] = entry[0]
+                    if _l1_enabled(keys[i]):
+                        l1_put(keys[i], entry, settings.L1_CACHE_TTL_SECONDS)
+        except Exception as e:
+            _log_error("Get Many", e)
+        for i in remote:
+            record_cache_tier(keys[i], "redis", results[i] is not None)
+            record_cache_lookup(keys[i], results[i] is not None)
+    return results
+
+def _store(key: str, entry: tuple, expire: int, label: str):
+    try:
+        with redis_breaker.guard(), STAGE_LATENCY.labels("redis_set").time():
+            redis_client.setex(key, expire, encode_frame(*entry))
+        if _l1_enabled(key):
+            # Keep our copy current and tell the other workers to drop theirs
+            l1_put(key, entry, expire)
+            _l1_broadcast("key", key)
+    except Exception as e:
+        _log_error(label, e)
+
+def set_cache(key: str, payload: bytes, expire: int = 300):
+    """Save an already-encoded JSON payload to Redis (Default expiry: 5 minutes)"""
+    _store(key, (payload, math.inf, 0.0), expire, "Set")
+
+def set_many(payloads: dict, expire: int):
+    """
+    Saves several already-encoded payloads in one round trip, which also carries
+    the L1 invalidation broadcasts for them
+    """
+    if not payloads:
+        return
     try:
-        # We must convert Python objects to JSON strings to store them
-        serialized_data = json.dumps([item.model_dump(mode='json') for item in data])
-        redis_client.setex(key, expire, serialized_data)
+        with redis_breaker.guard(), STAGE_LATENCY.labels("redis_set").time():
+            pipe = redis_client.pipeline(transaction=False)
+            for key, payload in payloads.items():
+                pipe.setex(key, expire, encode_frame(payload))
+                if _l1_enabled(key):
+                    pipe.publish(L1_CHANNEL, f"{WORKER_ID} key {key}")
+            pipe.execute()
+        for key, payload in payloads.items():
+            if _l1_enabled(key):
+                l1_put(key, (payload, math.inf, 0.0), expire)
     except Exception as e:
-        print(f"Redis Error (Set): {e}")
-    
+        _log_error("Set Many", e)
+
 def clear_user_search_cache(user_id):
     """
     Deletes all search cache entries for a specific user.
     """
+    _l1_invalidate(prefix=f"search:{user_id}:")
     try:
         # Pattern: search:{user_id}:*
         pattern = f"search:{user_id}:*"
         
-        # Find all keys matching the pattern
-        keys = list(redis_client.scan_iter(match=pattern))
-        
-        if keys:
-            redis_client.delete(*keys)
-            print(f"Cleared {len(keys)} cache keys for user {user_id}")
+        with redis_breaker.guard():
+            # Find all keys matching the pattern
+            keys = list(redis_client.scan_iter(match=pattern))
+
+            if keys:
+                redis_client.delete(*keys)
+                print(f"Cleared {len(keys)} cache keys for user {user_id}")
     except Exception as e:
-        print(f"Redis Error (Clear): {e}")
+        _log_error("Clear", e)
 
 def set_simple_cache(key: str, data: dict, expire: int = 3600):
     """
     Save simple dictionary/text data to Redis (Default: 1 hour)
     """
+    _store(key, (json.dumps(data).encode(), math.inf, 0.0), expire, "Set Simple")
+
+# --- Stale-while-revalidate ---
+# Entries carry a soft expiry and their compute time in the frame header. Redis keeps
+# the key until the hard expiry (soft + stale window). Between the two the value is
+# served stale while exactly one request (holding the refresh lock) recomputes it.
+# Before the soft expiry, XFetch (Vattani et al.) refreshes early with a probability
+# that grows as expiry approaches and with how long the value takes to compute.
+
+def set_swr_cache(key: str, payload: bytes, fresh: int, stale: int, compute_seconds: float):
+    _store(key, (payload, time.time() + fresh, compute_seconds), fresh + stale, "Set SWR")
+
+def _refresh_lock_key(key: str) -> str:
+    return f"swr:lock:{key}"
+
+def get_swr_cache(key: str):
+    """
+    Returns (payload, refresh_token). A token means this caller won the refresh:
+    recompute, store with set_swr_cache(), then release_refresh(key, token).
+    """
+    entry = _get_entry(key)
+    if not entry:
+        return None, None
+    payload, soft_expiry, compute_seconds = entry
+
+    now = time.time()
+    if now >= soft_expiry:
+        event = "stale"
+    elif now - compute_seconds * settings.CACHE_XFETCH_BETA * math.log(1.0 - random.random()) >= soft_expiry:
+        event = "early"
+    else:
+        return payload, None
+
+    token = new_lock_token()
+    if not acquire_lock(_refresh_lock_key(key), token, settings.CACHE_REFRESH_LOCK_SECONDS * 1000):
+        return payload, None
+    record_cache_revalidation(key, event)
+    return payload, token
+
+def release_refresh(key: str, token: str):
+    release_lock(_refresh_lock_key(key), token)
+
+def acquire_fill(key: str, lease: float = None):
+    """
+    Stampede protection for misses: returns a token when this caller should compute
+    the value (release it with release_refresh), None when another request already is.
+    """
+    lease = lease or settings.CACHE_REFRESH_LOCK_SECONDS
+    token = new_lock_token()
+    if acquire_lock(_refresh_lock_key(key), token, int(lease * 1000)):
+        return token
+    return None
+
+async def wait_for_fill(key: str, timeout: float = None):
+    """Polls for the value another request is computing. None if it never arrives."""
+    deadline = time.monotonic() + (timeout or settings.CACHE_FILL_WAIT_SECONDS)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        try:
+            with redis_breaker.guard():
+                entry = decode_frame(redis_client.get(key))  # not a lookup of its own, so not via _get_entry
+        except Exception as e:
+            _log_error("Wait Fill", e)
+            break
+        if entry:
+            record_cache_revalidation(key, "waited")
+            return entry[0]
+        if not cache_exists(_refresh_lock_key(key)):
+            break  # the computing request failed or found nothing to cache
+    record_cache_revalidation(key, "wait_timeout")
+    return None
+
+# --- Collection versions (ETags) ---
+# One opaque version per user and collection (notes, tags, projects, sessions),
+# replaced after every committed write. A missing key starts from a random value,
+# so ETags issued before an eviction or flush can never match again.
+VERSION_TTL = 30 * 24 * 3600
+
+def _version_key(user_id, collection: str) -> str:
+    return f"ver:{user_id}:{collection}"
+
+def get_collection_version(user_id, collection: str):
+    key = _version_key(user_id, collection)
+    try:
+        with redis_breaker.guard():
+            version = redis_client.get(key)
+            if version is None:
+                redis_client.set(key, uuid.uuid4().hex, ex=VERSION_TTL, nx=True)
+                version = redis_client.get(key)
+        return _text(version)
+    except Exception as e:
+        _log_error("Get Version", e)
+        return None
+
+def bump_collection_versions(user_id, collections):
+    try:
+        with redis_breaker.guard():
+            pipe = redis_client.pipeline(transaction=False)
+            for collection in collections:
+                pipe.set(_version_key(user_id, collection), uuid.uuid4().hex, ex=VERSION_TTL)
+            pipe.execute()
+    except Exception as e:
+        _log_error("Bump Version", e)
+
+def delete_cache(key: str):
+    if _l1_enabled(key):
+        _l1_invalidate(key=key)
+    try:
+        with redis_breaker.guard():
+            redis_client.delete(key)
+    except Exception as e:
+        _log_error("Delete", e)
+
+def delete_many(keys: list[str]):
+    """delete_cache() for several keys in one round trip"""
+    if not keys:
+        return
+    try:
+        with redis_breaker.guard():
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.delete(*keys)
+            for key in keys:
+                if _l1_enabled(key):
+                    l1_drop(key=key)
+                    pipe.publish(L1_CHANNEL, f"{WORKER_ID} key {key}")
+            pipe.execute()
+    except Exception as e:
+        _log_error("Delete Many", e)
+
+def mark_recent_write(user_id, window: int):
+    """
+    Flags a user as having written recently so their reads skip the replica.
+    """
+    try:
+        with redis_breaker.guard():
+            redis_client.setex(f"rw:{user_id}", window, 1)
+    except Exception as e:
+        _log_error("Mark Write", e)
+
+def has_recent_write(user_id) -> bool:
+    try:
+        with redis_breaker.guard():
+            return bool(redis_client.exists(f"rw:{user_id}"))
+    except Exception as e:
+        _log_error("Check Write", e)
+        # The primary is always consistent, so fall back to it
+        return True
+
+
+# --- Distributed locks ---
+# Delete only if we still own it, so an expired lock taken over by another worker is left alone
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def new_lock_token() -> str:
+    return uuid.uuid4().hex
+
+def acquire_lock(key: str, token: str, ttl_ms: int) -> bool:
+    """
+    SET NX PX lock. Returns True when Redis is unreachable so callers
+    degrade to doing the work themselves instead of waiting.
+    """
+    try:
+        with redis_breaker.guard():
+            return bool(redis_client.set(key, token, nx=True, px=ttl_ms))
+    except Exception as e:
+        _log_error("Lock", e)
+        return True
+
+def release_lock(key: str, token: str):
+    try:
+        with redis_breaker.guard():
+            redis_client.eval(RELEASE_LOCK_SCRIPT, 1, key, token)
+    except Exception as e:
+        _log_error("Unlock", e)
+
+def publish(channel: str, message):
+    """Fire-and-forget pub/sub publish (no subscribers is not an error)"""
+    try:
+        with redis_breaker.guard():
+            redis_client.publish(channel, message)
+    except Exception as e:
+        _log_error("Publish", e)
+
+def cache_exists(key: str) -> bool:
+    try:
+        with redis_breaker.guard():
+            return bool(redis_client.exists(key))
+    except Exception as e:
+        _log_error("Exists", e)
+        return False
+
+
+# --- Single-use tickets ---
+def store_ticket(key: str, value: str, ttl: int) -> bool:
+    try:
+        with redis_breaker.guard():
+            return bool(redis_client.set(key, value, ex=ttl, nx=True))
+    except Exception as e:
+        _log_error("Store Ticket", e)
+        return False
+
+def take_ticket(key: str) -> str | None:
+    """GETDEL: a ticket can be redeemed once, even with concurrent attempts"""
     try:
-        redis_client.setex(key, expire, json.dumps(data))
+        with redis_breaker.guard():
+            return _text(redis_client.getdel(key))
     except Exception as e:
-        print(f"Redis Error (Set Simple): {e}")
\ No newline at end of file
+        _log_error("Take Ticket", e)
+        return None
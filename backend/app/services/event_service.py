@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import secrets
+import time
+import redis.asyncio as aioredis
+from ..config import settings
+from ..serialization import encode
+from .cache_service import publish, store_ticket, take_ticket
+
+# Per-user pub/sub channels, so an event reaches the user's streams on every worker.
+# Messages are published as ready-made SSE frames and relayed to clients as-is.
+# Each worker holds one Redis subscription (like the L1 invalidation listener) and
+# fans messages out to its open streams through local queues.
+
+def _channel(user_id) -> str:
+    return f"events:{user_id}"
+
+def _ticket_key(ticket: str) -> str:
+    return f"st:{hashlib.sha256(ticket.encode()).hexdigest()}"
+
+def publish_note_event(event: str, user_id, note_id, **fields):
+    """
+    Pushes note.processed / note.updated / note.deleted to the owner's streams.
+    Call after the commit. Delivery is best-effort: clients that were offline
+    catch up through GET /notes/changes.
+    """
+    data = encode({"id": note_id, **fields}).decode()
+    publish(_channel(user_id), f"event: {event}\ndata: {data}\n\n")
+
+
+# --- Stream tickets ---
+# EventSource cannot send headers, and an access token in the URL would end up in
+# access and proxy logs. Clients trade their token for a short-lived, single-use
+# ticket instead; it carries the token's expiry, which also ends the stream.
+def issue_stream_ticket(user_id, expires_at: float) -> str | None:
+    ticket = secrets.token_urlsafe(32)
+    if not store_ticket(_ticket_key(ticket), f"{user_id}:{expires_at}", settings.EVENTS_TICKET_SECONDS):
+        return None
+    return ticket
+
+def redeem_stream_ticket(ticket: str) -> tuple[str, float] | None:
+    """(user_id, access expiry), once per ticket"""
+    value = take_ticket(_ticket_key(ticket))
+    if not value:
+        return None
+    user_id, _, expires_at = value.partition(":")
+    return user_id, float(expires_at)
+
+
+# --- Per-worker subscriber ---
+class _EventHub:
+    def __init__(self, loop):
+        self.loop = loop
+        # Async connections belong to the loop they were made on
+        self.client = aioredis.from_url(
+            settings.REDIS_URL, decode_responses=True, socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT_SECONDS
+        )
+        self.pubsub = None
+        self.reader = None
+        self.lock = asyncio.Lock()
+        self.queues: dict[str, set[asyncio.Queue]] = {}
+        self.pending: set[asyncio.Task] = set()
+
+    async def open(self, channel: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        async with self.lock:
+            if self.pubsub is None:
+                self.pubsub = self.client.pubsub()
+            if channel not in self.queues:
+                await self.pubsub.subscribe(channel)
+                self.queues[channel] = set()
+            self.queues[channel].add(queue)
+            if self.reader is None or self.reader.done():
+                self.reader = self.loop.create_task(self._read())
+        return queue
+
+    def close(self, channel: str, queue: asyncio.Queue):
+        # Synchronous, so it still runs from a stream cancelled by a disconnect;
+        # the unsubscribe happens in its own task
+        queues = self.queues.get(channel)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            task = self.loop.create_task(self._unsubscribe(channel))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def _unsubscribe(self, channel: str):
+        async with self.lock:
+            if self.queues.get(channel):
+                return  # a new stream for this user opened meanwhile
+            self.queues.pop(channel, None)
+            if self.pubsub is None:
+                return
+            try:
+                await self.pubsub.unsubscribe(channel)
+            except Exception as e:
+                print(f"Redis Error (Unsubscribe): {e}")
+
+    async def _read(self):
+        while self.queues:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                print(f"Redis Error (Events): {e}")
+                await self._drop_all()
+                return
+            if not message:
+                continue
+            for queue in self.queues.get(message["channel"], ()):
+                try:
+                    queue.put_nowait(message["data"])
+                except asyncio.QueueFull:
+                    pass  # the client fell behind; it catches up through /notes/changes
+
+    async def _drop_all(self):
+        # Ends every stream (None); clients reconnect after `retry` and resubscribe
+        async with self.lock:
+            for queues in self.queues.values():
+                for queue in queues:
+                    if queue.full():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+            self.queues.clear()
+            pubsub, self.pubsub = self.pubsub, None
+        try:
+            await pubsub.aclose()
+        except Exception:
+            pass
+
+_hub: _EventHub | None = None
+
+def _get_hub() -> _EventHub:
+    global _hub
+    loop = asyncio.get_running_loop()
+    if _hub is None or _hub.loop is not loop:
+        _hub = _EventHub(loop)
+    return _hub
+
+async def open_user_events(user_id):
+    """Subscribes before the response starts, so a Redis outage can still become a 503"""
+    hub = _get_hub()
+    channel = _channel(user_id)
+    return hub, channel, await hub.open(channel)
+
+async def stream_user_events(subscription, expires_at: float):
+    """
+    SSE frames for a subscription from open_user_events(), with heartbeats while
+    idle. Ends with an `expired` event once the access behind it expires.
+    """
+    hub, channel, queue = subscription
+    try:
+        yield f"retry: {settings.EVENTS_RETRY_MS}\n\n"
+        while True:
+            remaining = expires_at - time.time()
+            if remaining <= 0:
+                yield "event: expired\ndata: {}\n\n"
+                return
+            try:
+                frame = await asyncio.wait_for(queue.get(), min(settings.EVENTS_HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if frame is None:
+                return
+            yield frame
+    finally:
+        hub.close(channel, queue)
@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import itertools
+import re
+import time
+from contextlib import asynccontextmanager
+from ..config import settings
+from ..metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_RATELIMIT_REMAINING
+
+# Lower number = served first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+DEFAULT_COMPLETION_TOKENS = 512
+
+_sequence = itertools.count()
+
+
+def estimate_prompt_tokens(messages: list) -> int:
+    """Rough prompt size (~4 characters per token)."""
+    return sum(len(m.get("content") or "") for m in messages) // 4
+
+
+def estimate_tokens(messages: list, max_tokens: int | None = None) -> int:
+    """Rough prompt + completion size."""
+    return estimate_prompt_tokens(messages) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def parse_reset(value: str | None) -> float:
+    """Parses provider reset durations such as '7.66s', '2m59.56s' or '350ms' into seconds."""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+class ModelGovernor:
+    """
+    Admission control for one model: a concurrency cap, a token bucket refilled
+    at tokens-per-minute, and a priority queue for everything that has to wait.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.max_concurrency = settings.LLM_MAX_CONCURRENCY.get(model, settings.LLM_DEFAULT_CONCURRENCY)
+        self.tokens_per_minute = settings.LLM_TOKENS_PER_MINUTE.get(model, settings.LLM_DEFAULT_TOKENS_PER_MINUTE)
+        self.tokens = float(self.tokens_per_minute)
+        self.refilled_at = time.monotonic()
+        self.paused_until = 0.0
+        self.active = 0
+        self.waiters = []  # heap of (priority, seq, est_tokens, future)
+        self.wakeup = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.tokens_per_minute,
+            self.tokens + (now - self.refilled_at) * self.tokens_per_minute / 60,
+        )
+        self.refilled_at = now
+
+    def _delay(self, priority: int, est_tokens: int):
+        """0 if the request may start now, seconds to wait for tokens, or None to wait for a release."""
+        now = time.monotonic()
+        if self.paused_until > now:
+            return self.paused_until - now
+        cap = self.max_concurrency
+        if priority != INTERACTIVE:
+            cap = max(1, cap - settings.LLM_INTERACTIVE_RESERVE)
+        if self.active >= cap:
+            return None
+        self._refill()
+        if self.tokens < est_tokens:
+            return (est_tokens - self.tokens) * 60 / self.tokens_per_minute
+        return 0
+
+    def _start(self, est_tokens: int):
+        self.active += 1
+        self.tokens -= est_tokens
+
+    def _schedule_wakeup(self, delay: float):
+        if self.wakeup:
+            self.wakeup.cancel()
+        self.wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        self.wakeup = None
+        while self.waiters:
+            priority, _, est_tokens, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            delay = self._delay(priority, est_tokens)
+            if delay != 0:
+                if delay is not None:
+                    self._schedule_wakeup(delay)
+                return
+            heapq.heappop(self.waiters)
+            LLM_QUEUE_DEPTH.labels(self.model, PRIORITY_NAMES[priority]).dec()
+            self._start(est_tokens)
+            future.set_result(None)
+
+    async def acquire(self, priority: int, est_tokens: int):
+        est_tokens = min(est_tokens, self.tokens_per_minute)
+        if not self.waiters and self._delay(priority, est_tokens) == 0:
+            self._start(est_tokens)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(_sequence), est_tokens, future))
+        LLM_QUEUE_DEPTH.labels(self.model, PRIORITY_NAMES[priority]).inc()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # admitted just as we were cancelled
+            else:
+                future.cancel()
+                LLM_QUEUE_DEPTH.labels(self.model, PRIORITY_NAMES[priority]).dec()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def observe(self, status_code: int, headers):
+        """Tightens the local budget from the provider's rate-limit headers."""
+        remaining = headers.get("x-ratelimit-remaining-tokens")
+        if remaining is not None:
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                remaining = None
+        if remaining is not None:
+            LLM_RATELIMIT_REMAINING.labels(self.model).set(remaining)
+            self._refill()
+            self.tokens = min(self.tokens, remaining)
+
+        pause = 0.0
+        if status_code == 429:
+            pause = parse_reset(headers.get("retry-after")) or parse_reset(headers.get("x-ratelimit-reset-tokens"))
+        elif headers.get("x-ratelimit-remaining-requests") == "0":
+            pause = parse_reset(headers.get("x-ratelimit-reset-requests"))
+        if pause:
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+
+_governors: dict[str, ModelGovernor] = {}
+
+
+def governor_for(model: str) -> ModelGovernor:
+    if model not in _governors:
+        _governors[model] = ModelGovernor(model)
+    return _governors[model]
+
+
+@asynccontextmanager
+async def llm_slot(model: str, priority: int, est_tokens: int):
+    """
+    Holds a slot for one upstream call (the whole stream, for streaming calls).
+    """
+    governor = governor_for(model)
+    started = time.monotonic()
+    await governor.acquire(priority, est_tokens)
+    LLM_QUEUE_WAIT.labels(model, PRIORITY_NAMES[priority]).observe(time.monotonic() - started)
+    try:
+        yield
+    finally:
+        governor.release()
+
+
+def observe_rate_limit_headers(model: str, status_code: int, headers):
+    if model:
+        governor_for(model).observe(status_code, headers)
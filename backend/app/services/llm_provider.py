@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import json
+import random
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+import httpx
+from groq import AsyncGroq, DefaultAsyncHttpxClient, APIConnectionError, InternalServerError
+from ..config import settings
+from .llm_governor import observe_rate_limit_headers
+
+
+@dataclass
+class Completion:
+    text: str
+    usage: dict = field(default_factory=dict)  # prompt_tokens / completion_tokens when known
+
+
+class LLMProvider(ABC):
+    """
+    Interface every chat-completion backend implements. `params` are the
+    OpenAI-style arguments (model, messages, temperature, max_tokens, ...).
+    """
+    name = "base"
+    # Errors that mean the backend itself is unavailable (they trip the circuit breaker)
+    transient_errors: tuple = ()
+
+    @abstractmethod
+    async def complete(self, **params) -> Completion:
+        ...
+
+    @abstractmethod
+    def stream(self, **params) -> AsyncIterator[str]:
+        """Async generator of content deltas."""
+
+
+# --- GROQ ---
+async def _observe_rate_limits(response):
+    # Feeds Groq's x-ratelimit-* headers back into the governor for the requested model
+    try:
+        model = json.loads(response.request.content).get("model")
+        observe_rate_limit_headers(model, response.status_code, response.headers)
+    except Exception:
+        pass
+
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+    # APITimeoutError is an APIConnectionError; InternalServerError covers 5xx
+    transient_errors = (APIConnectionError, InternalServerError)
+
+    def __init__(self):
+        self.client = AsyncGroq(
+            api_key=settings.GROQ_API_KEY,
+            timeout=httpx.Timeout(settings.GROQ_TIMEOUT_SECONDS, connect=settings.GROQ_CONNECT_TIMEOUT_SECONDS),
+            max_retries=settings.GROQ_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(event_hooks={"response": [_observe_rate_limits]}),
+        )
+
+    async def complete(self, **params) -> Completion:
+        chat_completion = await self.client.chat.completions.create(**params)
+        usage = {}
+        if chat_completion.usage:
+            usage = {
+                "prompt_tokens": chat_completion.usage.prompt_tokens,
+                "completion_tokens": chat_completion.usage.completion_tokens,
+            }
+        return Completion(text=chat_completion.choices[0].message.content, usage=usage)
+
+    async def stream(self, **params):
+        stream = await self.client.chat.completions.create(stream=True, **params)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+# --- STUB ---
+class StubProviderError(Exception):
+    pass
+
+
+class StubProvider(LLMProvider):
+    """
+    Offline fake with a configurable time-to-first-token, generation speed and
+    error rate. Output is derived from a hash of the request, so identical
+    requests always get identical text.
+    """
+    name = "stub"
+    transient_errors = (StubProviderError,)
+    WORDS = ["async", "cache", "vector", "query", "index", "token", "stream", "handler", "schema", "retry"]
+
+    def __init__(self, latency_ms: int = None, tokens_per_second: float = None,
+                 error_rate: float = None, response_tokens: int = None):
+        self.latency_ms = settings.LLM_STUB_LATENCY_MS if latency_ms is None else latency_ms
+        self.tokens_per_second = settings.LLM_STUB_TOKENS_PER_SECOND if tokens_per_second is None else tokens_per_second
+        self.error_rate = settings.LLM_STUB_ERROR_RATE if error_rate is None else error_rate
+        self.response_tokens = settings.LLM_STUB_RESPONSE_TOKENS if response_tokens is None else response_tokens
+        self.calls = 0
+
+    def _tokens(self, params: dict) -> list[str]:
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        rng = random.Random(digest)
+        count = min(self.response_tokens, params.get("max_tokens") or self.response_tokens)
+        return [rng.choice(self.WORDS) + " " for _ in range(count)]
+
+    async def _begin(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            raise StubProviderError("Stub provider injected failure")
+
+    def _token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0
+
+    async def complete(self, **params) -> Completion:
+        tokens = self._tokens(params)
+        await self._begin()
+        await asyncio.sleep(len(tokens) * self._token_delay())
+        prompt_tokens = sum(len(m.get("content") or "") for m in params.get("messages", [])) // 4
+        return Completion(
+            text="".join(tokens).strip(),
+            usage={"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens)},
+        )
+
+    async def stream(self, **params):
+        tokens = self._tokens(params)
+        await self._begin()
+        delay = self._token_delay()
+        for token in tokens:
+            if delay:
+                await asyncio.sleep(delay)
+            yield token
+
+
+def get_provider() -> LLMProvider:
+    if settings.LLM_PROVIDER == "stub":
+        return StubProvider()
+    return GroqProvider()
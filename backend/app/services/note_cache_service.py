@@ -0,0 +1,53 @@
+import uuid
+from sqlalchemy.orm import defer
+from sqlmodel import Session, select
+from ..config import settings
+from ..models import Note
+from ..schemas.note import NoteRead
+from ..serialization import encode_rows
+from .cache_service import get_many_raw, set_many, delete_cache, delete_many
+
+# Search results are cached as packed 16-byte note ids, and the NoteRead JSON of each
+# note is cached once under note:{id}, so the same snippet body is not duplicated
+# across every search that returns it.
+
+def note_key(note_id) -> str:
+    return f"note:{note_id}"
+
+def pack_ids(notes) -> bytes:
+    return b"".join(note.id.bytes for note in notes)
+
+def unpack_ids(packed: bytes) -> list[uuid.UUID]:
+    return [uuid.UUID(bytes=packed[i:i + 16]) for i in range(0, len(packed), 16)]
+
+def _note_json(note) -> bytes:
+    # encode_rows gives "[{...}]"; strip the brackets to get the object
+    return encode_rows([note], NoteRead)[1:-1]
+
+def cache_notes(notes):
+    """Stores the NoteRead JSON of freshly loaded notes"""
+    set_many({note_key(note.id): _note_json(note) for note in notes}, settings.NOTE_CACHE_SECONDS)
+
+def invalidate_note(note_id):
+    """Call after committing any change to (or the deletion of) a note"""
+    delete_cache(note_key(note_id))
+
+def invalidate_notes(note_ids):
+    """invalidate_note() for a batch, in one round trip"""
+    delete_many([note_key(note_id) for note_id in note_ids])
+
+def hydrate_notes(session: Session, owner_id, note_ids: list[uuid.UUID]) -> bytes:
+    """
+    A JSON array of the notes, in order, spliced from cached entries. Notes missing
+    from the cache are loaded in one query and cached; deleted ones are left out.
+    """
+    cached = get_many_raw([note_key(note_id) for note_id in note_ids])
+    missing = [note_id for note_id, body in zip(note_ids, cached) if body is None]
+    if missing:
+        loaded = session.exec(
+            select(Note).options(defer(Note.embedding)).where(Note.id.in_(missing), Note.owner_id == owner_id)
+        ).all()
+        cache_notes(loaded)
+        by_id = {note.id: _note_json(note) for note in loaded}
+        cached = [body if body is not None else by_id.get(note_id) for note_id, body in zip(note_ids, cached)]
+    return b"[" + b",".join(body for body in cached if body is not None) + b"]"
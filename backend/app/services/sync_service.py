@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+from sqlalchemy.orm import defer
+from sqlmodel import Session, select, delete
+from ..config import settings
+from ..models import Note, NoteTombstone
+
+def record_tombstone(session: Session, note: Note):
+    """
+    Logs a note deletion for delta sync and prunes the owner's expired tombstones.
+    Does not commit, so it lands in the same transaction as the delete.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+    session.exec(delete(NoteTombstone).where(
+        NoteTombstone.owner_id == note.owner_id, NoteTombstone.deleted_at < cutoff
+    ))
+    session.merge(NoteTombstone(note_id=note.id, owner_id=note.owner_id))
+
+def parse_cursor(cursor: str | None) -> datetime | None:
+    """Cursors are the ISO timestamps returned by get_changes(). Raises ValueError."""
+    return datetime.fromisoformat(cursor) if cursor else None
+
+def get_changes(session: Session, owner_id, since: datetime | None) -> dict:
+    """
+    Notes inserted or updated and ids deleted after `since`, plus the cursor for the
+    next call. Without a usable `since` (first sync, or older than the tombstone
+    retention) `reset` is set and `upserted` is the whole library.
+
+    Results overlap the previous call by SYNC_OVERLAP_SECONDS, so clients must
+    apply them idempotently (upsert by id).
+    """
+    # Taken before querying: anything committed later is newer than the cursor
+    now = datetime.utcnow()
+    retention_start = now - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+    reset = since is None or since < retention_start
+
+    notes = select(Note).options(defer(Note.embedding)).where(Note.owner_id == owner_id)
+    deleted = []
+    if not reset:
+        window_start = since - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS)
+        notes = notes.where(Note.updated_at > window_start)
+        deleted = session.exec(select(NoteTombstone.note_id).where(
+            NoteTombstone.owner_id == owner_id, NoteTombstone.deleted_at > window_start
+        )).all()
+
+    return {
+        "upserted": session.exec(notes.order_by(Note.updated_at)).all(),
+        "deleted": list(deleted),
+        "cursor": now.isoformat(),
+        "reset": reset,
+    }
@@ -0,0 +1,37 @@
+from sqlmodel import Session, select, delete, func
+from ..models import Note, NoteTag
+
+def parse_tags(tag_str: str | None) -> list[str]:
+    """
+    Splits a comma-separated tag string into unique, title-cased tags.
+    """
+    if not tag_str:
+        return []
+    tags = []
+    for raw in tag_str.split(","):
+        tag = raw.strip().title()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+def sync_note_tags(session: Session, note: Note):
+    """
+    Rewrites the note_tags rows for a note from its `tags` string.
+    Does not commit, so it lands in the same transaction as the note update.
+    """
+    session.exec(delete(NoteTag).where(NoteTag.note_id == note.id))
+    for tag in parse_tags(note.tags):
+        session.add(NoteTag(note_id=note.id, tag=tag, owner_id=note.owner_id))
+
+def get_tag_counts(session: Session, owner_id) -> list[str]:
+    """
+    A user's tags, most used first. Served by the (owner_id, tag) index.
+    """
+    usage = func.count(NoteTag.note_id)
+    statement = (
+        select(NoteTag.tag)
+        .where(NoteTag.owner_id == owner_id)
+        .group_by(NoteTag.tag)
+        .order_by(usage.desc(), NoteTag.tag)
+    )
+    return list(session.exec(statement).all())
@@ -0,0 +1,138 @@
+import hashlib
+import uuid
+from ..config import settings
+from . import cache_service
+from .cache_service import redis_breaker
+from .auth_service import create_refresh_token, REFRESH_TOKEN_EXPIRE_DAYS
+
+# Refresh tokens live in Redis, not on the users row, so issuing and rotating them
+# never touches Postgres. Each token carries a random `jti` and a `fam` (family: one
+# per sign-in, so every device has its own). Only sha256(jti) is stored:
+#   rt:{hash}       -> "{user_id}:{family}"   the family's single live token
+#   rtf:{family}    -> hash {user, current}    key of that live token
+#   rtu:{user_id}   -> set of families         the user's signed-in devices
+# Rotation replaces the live token atomically. A token that was already rotated away
+# can only be a copy, so presenting it revokes the whole family (reuse detection),
+# except within a short grace period that absorbs concurrent refreshes.
+
+TOKEN_TTL = REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600
+
+
+class TokenStoreUnavailable(Exception):
+    pass
+
+
+REVOKE_FAMILY = """
+local current = redis.call('HGET', KEYS[1], 'current')
+if current then redis.call('DEL', current) end
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[1])
+"""
+
+# KEYS: presented token, family, user's families, new token
+# ARGV: owner ("user:family"), family, ttl, new jti, grace seconds
+# The rotated-away token is kept for the grace period as "owner|successor key|successor jti"
+ROTATE_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if value == ARGV[1] then
+    if tonumber(ARGV[5]) > 0 then
+        redis.call('SET', KEYS[1], ARGV[1] .. '|' .. KEYS[4] .. '|' .. ARGV[4], 'EX', ARGV[5])
+    else
+        redis.call('DEL', KEYS[1])
+    end
+    redis.call('SET', KEYS[4], ARGV[1], 'EX', ARGV[3])
+    redis.call('HSET', KEYS[2], 'current', KEYS[4])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    redis.call('EXPIRE', KEYS[3], ARGV[3])
+    return {1, ARGV[4]}
+end
+if value then
+    local owner, successor, jti = string.match(value, '^([^|]*)|([^|]*)|([^|]*)$')
+    if owner == ARGV[1] and redis.call('GET', successor) == ARGV[1] then
+        return {2, jti}
+    end
+end
+local current = redis.call('HGET', KEYS[2], 'current')
+if current then redis.call('DEL', current) end
+redis.call('DEL', KEYS[2])
+redis.call('SREM', KEYS[3], ARGV[2])
+return {0}
+"""
+
+
+def _token_key(jti: str) -> str:
+    return f"rt:{hashlib.sha256(jti.encode()).hexdigest()}"
+
+def _family_key(family: str) -> str:
+    return f"rtf:{family}"
+
+def _user_key(user_id) -> str:
+    return f"rtu:{user_id}"
+
+
+def _run(action: str, func):
+    # Without Redis there is nowhere to check or record tokens: callers answer 503
+    try:
+        with redis_breaker.guard():
+            return func(cache_service.redis_client)
+    except Exception as e:
+        print(f"Redis Error ({action}): {e}")
+        raise TokenStoreUnavailable() from e
+
+
+def issue_refresh_token(user_id) -> str:
+    """Starts a new family (a new device sign-in) and returns its first token."""
+    family, jti = uuid.uuid4().hex, uuid.uuid4().hex
+    token = create_refresh_token(data={"sub": str(user_id), "fam": family, "jti": jti})
+    key = _token_key(jti)
+
+    def store(client):
+        pipe = client.pipeline()
+        pipe.set(key, f"{user_id}:{family}", ex=TOKEN_TTL)
+        pipe.hset(_family_key(family), mapping={"user": str(user_id), "current": key})
+        pipe.expire(_family_key(family), TOKEN_TTL)
+        pipe.sadd(_user_key(user_id), family)
+        pipe.expire(_user_key(user_id), TOKEN_TTL)
+        pipe.execute()
+
+    _run("Issue Refresh Token", store)
+    return token
+
+
+def rotate_refresh_token(claims: dict) -> str | None:
+    """
+    Swaps the presented token (decoded claims) for the next one in its family.
+    Within the grace period after a rotation, the same token again gets the token it
+    was rotated to (concurrent refreshes). None if it is no longer live: revoked, or
+    reused after the grace period (the family is then revoked).
+    """
+    user_id, family = claims["sub"], claims["fam"]
+    new_jti = uuid.uuid4().hex
+
+    result = _run("Rotate Refresh Token", lambda client: client.eval(
+        ROTATE_SCRIPT, 4,
+        _token_key(claims["jti"]), _family_key(family), _user_key(user_id), _token_key(new_jti),
+        f"{user_id}:{family}", family, TOKEN_TTL, new_jti, settings.REFRESH_TOKEN_REUSE_GRACE_SECONDS,
+    ))
+    if not result or int(result[0]) == 0:
+        return None
+    # Re-minting for the same jti gives a token that maps to the same Redis entry
+    jti = result[1].decode() if isinstance(result[1], bytes) else result[1]
+    return create_refresh_token(data={"sub": user_id, "fam": family, "jti": jti})
+
+
+def revoke_family(user_id, family: str):
+    """Signs one device out."""
+    _run("Revoke Refresh Token", lambda client: client.eval(
+        REVOKE_FAMILY, 2, _family_key(family), _user_key(user_id), family
+    ))
+
+
+def revoke_all(user_id):
+    """Signs every device out."""
+    def revoke(client):
+        for family in client.smembers(_user_key(user_id)):
+            family = family.decode() if isinstance(family, bytes) else family
+            client.eval(REVOKE_FAMILY, 2, _family_key(family), _user_key(user_id), family)
+
+    _run("Revoke Refresh Tokens", revoke)
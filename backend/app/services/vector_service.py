@@ -1,4 +1,12 @@
 from fastembed import TextEmbedding
+from pgvector.sqlalchemy import Vector, HALFVEC, BIT
+from sqlalchemy import cast, func
+from ..config import settings
+from ..database import tune_hnsw_search
+from ..metrics import STAGE_LATENCY
+from ..models import Note
+
+EMBEDDING_DIM = 384
 
 # Initialize the model once. It downloads automatically the first time.
 # 'BAAI/bge-small-en-v1.5' is optimized for retrieval and is very fast.
@@ -10,8 +18,53 @@ def get_vector(text: str) -> list[float]:
     """
     try:
         # FastEmbed is a generator, so we convert to list
-        vectors = list(embedding_model.embed([text]))
+        with STAGE_LATENCY.labels("embedding").time():
+            vectors = list(embedding_model.embed([text]))
         return vectors[0].tolist() # Return the first (and only) vector
     except Exception as e:
         print(f"Error generating vector: {e}")
-        return []
\ No newline at end of file
+        return []
+
+def candidate_distance(query_vector: list[float]):
+    """
+    Distance expression for the candidate pass. Must match the expression
+    indexes created in init_db() so Postgres can use them.
+    """
+    if settings.EMBEDDING_STORAGE == "halfvec":
+        return cast(Note.embedding, HALFVEC(EMBEDDING_DIM)).cosine_distance(
+            cast(query_vector, HALFVEC(EMBEDDING_DIM))
+        )
+    if settings.EMBEDDING_STORAGE == "bit":
+        query_bits = func.binary_quantize(cast(query_vector, Vector(EMBEDDING_DIM)))
+        return cast(func.binary_quantize(Note.embedding), BIT(EMBEDDING_DIM)).hamming_distance(
+            cast(query_bits, BIT(EMBEDDING_DIM))
+        )
+    return Note.embedding.cosine_distance(query_vector)
+
+def nearest_notes(statement, query_vector: list[float], limit: int):
+    """
+    Orders a `select(Note)` statement by similarity to query_vector.
+    With quantized storage, the top `limit * EMBEDDING_RERANK_FACTOR` candidates
+    come from the compact index and are re-ranked on full precision in the same query.
+    """
+    exact_distance = Note.embedding.cosine_distance(query_vector)
+    if settings.EMBEDDING_STORAGE == "full":
+        return statement.order_by(exact_distance).limit(limit)
+
+    candidates = (
+        statement.with_only_columns(Note.id)
+        .order_by(candidate_distance(query_vector))
+        .limit(limit * settings.EMBEDDING_RERANK_FACTOR)
+    )
+    return statement.where(Note.id.in_(candidates)).order_by(exact_distance).limit(limit)
+
+
+def tune_vector_search(session, limit: int):
+    """
+    Widens the HNSW scan for a nearest_notes() query with `limit` that runs next on
+    this session, so owner / project filters still find enough rows on a shared table.
+    """
+    if settings.EMBEDDING_STORAGE == "full":
+        tune_hnsw_search(session.connection(), limit)
+    else:
+        tune_hnsw_search(session.connection(), limit * settings.EMBEDDING_RERANK_FACTOR, exact_order=False)
@@ -0,0 +1,58 @@
+"""
+Per-request cost of get_current_user: uncached (JWT decode + Postgres),
+Redis-cached principal, and the in-process cache.
+
+    python -m benchmarks.bench_auth --iterations 2000
+"""
+import argparse
+
+from sqlmodel import Session
+
+from app import dependencies
+from app.database import engine
+from app.services import auth_service
+from app.services.auth_service import create_access_token
+from benchmarks.common import Timer, summarize, write_report
+from benchmarks.seed import cleanup, create_user
+
+
+def measure(token: str, iterations: int, reset) -> dict:
+    samples = []
+    for _ in range(iterations):
+        reset()
+        with Timer(samples):
+            dependencies.get_current_user(token)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        user = create_user(session)
+    token = create_access_token(data={"sub": str(user.id)})
+
+    def cold():
+        auth_service._token_cache.clear()
+        dependencies.invalidate_principal(user.id)
+
+    def redis_only():
+        dependencies._local_principals.clear()
+
+    try:
+        results = {
+            "uncached": measure(token, args.iterations, cold),
+            "redis_cached": measure(token, args.iterations, redis_only),
+            "local_cached": measure(token, args.iterations, lambda: None),
+        }
+    finally:
+        cleanup(engine)
+
+    write_report("auth", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+End-to-end /chat/{id} throughput and time-to-first-token against the offline
+stub provider, so no Groq quota is spent.
+
+    python -m benchmarks.bench_chat_stream --requests 200 --concurrency 16 \\
+        --latency-ms 300 --tokens-per-second 200
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+from sqlmodel import Session
+
+from app.database import engine
+from app.dependencies import get_current_user
+from app.limiter import limiter
+from app.main import app
+from app.models import ChatSession
+from benchmarks.common import serve_in_thread, summarize, use_stub_llm, write_report
+from benchmarks.seed import cleanup, create_user, seed_notes
+
+
+async def stream_chat(base_url: str, session_ids: list, total: int, concurrency: int) -> dict:
+    ttft, totals = [], []
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        async def worker(worker_id: int):
+            for i in counter:
+                session_id = session_ids[worker_id % len(session_ids)]
+                # Unique messages so the chat: cache never answers
+                body = {"message": f"How does handler {i} work? {uuid.uuid4().hex}"}
+                started = time.perf_counter()
+                first = None
+                async with client.stream("POST", f"/chat/{session_id}", json=body) as response:
+                    response.raise_for_status()
+                    async for _ in response.aiter_bytes():
+                        if first is None:
+                            first = time.perf_counter()
+                finished = time.perf_counter()
+                ttft.append(((first or finished) - started) * 1000)
+                totals.append((finished - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {"time_to_first_token": summarize(ttft), "total": summarize(totals, elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=int, default=300)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--keep-token-budget", action="store_true",
+                        help="keep the Groq tokens-per-minute budgets (the stub has no quota of its own)")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    use_stub_llm(args.latency_ms, args.tokens_per_second, args.error_rate, args.keep_token_budget)
+    limiter.enabled = False
+
+    with Session(engine) as session:
+        user = create_user(session)
+        chat_sessions = [ChatSession(user_id=user.id, title="Benchmark") for _ in range(args.concurrency)]
+        session.add_all(chat_sessions)
+        session.commit()
+        session_ids = [str(s.id) for s in chat_sessions]
+        session.refresh(user)
+        session.expunge(user)
+    seed_notes(engine, user.id, args.notes)
+
+    app.dependency_overrides[get_current_user] = lambda: user
+    try:
+        with serve_in_thread(app) as base_url:
+            results = asyncio.run(stream_chat(base_url, session_ids, args.requests, args.concurrency))
+    finally:
+        app.dependency_overrides = {}
+        cleanup(engine)
+
+    results["stub"] = vars(args)
+    write_report("chat_stream", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
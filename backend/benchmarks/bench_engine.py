@@ -0,0 +1,85 @@
+"""
+GET /notes/ throughput with the old engine (echo=True, default pool) versus the
+engine built from the DB_* settings.
+
+    python -m benchmarks.bench_engine --notes 500 --requests 400 --concurrency 8
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from sqlmodel import Session, create_engine
+
+from app.config import settings
+from app.database import build_engine, get_session
+from app.main import app
+from app.routers.notes import get_current_user
+from benchmarks.common import summarize, write_report
+from benchmarks.seed import cleanup, create_user, seed_notes
+
+
+def session_factory(engine):
+    def override():
+        with Session(engine) as session:
+            yield session
+    return override
+
+
+async def drive(path: str, total: int, concurrency: int) -> dict:
+    samples = []
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                t0 = time.perf_counter()
+                response = await client.get(path)
+                response.raise_for_status()
+                samples.append((time.perf_counter() - t0) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return summarize(samples, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    # Measure what production runs with, regardless of the local ENVIRONMENT
+    settings.DB_ECHO = False
+    engines = {
+        "legacy": create_engine(settings.DATABASE_URL, echo=True),
+        "tuned": build_engine(settings.DATABASE_URL),
+    }
+
+    seed_engine = engines["tuned"]
+    with Session(seed_engine) as session:
+        user = create_user(session)
+    seed_notes(seed_engine, user.id, args.notes)
+
+    results = {"notes": args.notes, "concurrency": args.concurrency, "engines": {}}
+    try:
+        app.dependency_overrides[get_current_user] = lambda: user
+        for name, engine in engines.items():
+            app.dependency_overrides[get_session] = session_factory(engine)
+            results["engines"][name] = asyncio.run(drive("/notes/", args.requests, args.concurrency))
+    finally:
+        app.dependency_overrides = {}
+        cleanup(seed_engine)
+
+    write_report("engine", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Throughput and latency of the main hot paths against a seeded dataset, over
+real HTTP (uvicorn in a thread) with real access tokens and the stub LLM.
+
+    python -m benchmarks.bench_hot_paths --scale 100k --concurrency 16 --requests 500 \\
+        --output head.json --keep
+    python -m benchmarks.bench_hot_paths --scale 100k --reuse ...   # skip seeding
+    python -m benchmarks.compare base.json head.json
+
+Scenarios: search (GET /notes/search/), list (GET /notes/), tags
+(GET /notes/tags/), chat (POST /chat/{id}, streamed) and create (POST /notes/).
+Rate limiting is disabled so the limiter does not cap the offered load.
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+import httpx
+from sqlmodel import Session
+
+from app.config import settings
+from app.database import engine
+from app.limiter import limiter
+from app.main import app
+from app.models import ChatSession
+from app.services.auth_service import create_access_token
+from benchmarks.common import serve_in_thread, summarize, use_stub_llm, write_report
+from benchmarks.seed import LANGUAGES, cleanup, copy_notes, create_users, find_users
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+SCENARIOS = ["search", "list", "tags", "chat", "create"]
+QUERY_TERMS = ["async handler", "database session", "retry with backoff", "parse json", "jwt auth",
+               "vector search", "react hook", "docker compose", "regex email", "redis cache"]
+
+
+class Workload:
+    """Per-run state the scenario functions draw from."""
+
+    def __init__(self, user_ids: list[uuid.UUID], chat_sessions: dict, search_queries: int, seed: int):
+        self.tokens = {user_id: create_access_token(data={"sub": str(user_id)}) for user_id in user_ids}
+        self.user_ids = user_ids
+        self.chat_sessions = chat_sessions
+        self.search_queries = search_queries
+        self.rng = random.Random(seed)
+
+    def user(self):
+        user_id = self.rng.choice(self.user_ids)
+        return user_id, {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+    def query(self) -> str:
+        term = self.rng.choice(QUERY_TERMS)
+        return f"{term} {self.rng.randrange(self.search_queries)}"
+
+
+# Each scenario returns the time to the first body byte (for streams) or None
+async def run_search(client, workload):
+    _, headers = workload.user()
+    response = await client.get("/notes/search/", params={"q": workload.query()}, headers=headers)
+    response.raise_for_status()
+
+
+async def run_list(client, workload):
+    _, headers = workload.user()
+    response = await client.get("/notes/", headers=headers)
+    response.raise_for_status()
+
+
+async def run_tags(client, workload):
+    _, headers = workload.user()
+    response = await client.get("/notes/tags/", headers=headers)
+    response.raise_for_status()
+
+
+async def run_chat(client, workload):
+    user_id, headers = workload.user()
+    body = {"message": f"How do I {workload.query()}? {uuid.uuid4().hex[:8]}"}
+    started, first = time.perf_counter(), None
+    async with client.stream("POST", f"/chat/{workload.chat_sessions[user_id]}", json=body, headers=headers) as response:
+        response.raise_for_status()
+        async for _ in response.aiter_bytes():
+            if first is None:
+                first = time.perf_counter()
+    return ((first or time.perf_counter()) - started) * 1000
+
+
+async def run_create(client, workload):
+    _, headers = workload.user()
+    body = {
+        "title": f"Bench note {uuid.uuid4().hex[:8]}",
+        "code_snippet": "async def fetch(session, url):\n    return await session.get(url)\n",
+        "language": workload.rng.choice(LANGUAGES),
+    }
+    response = await client.post("/notes/", json=body, headers=headers)
+    response.raise_for_status()
+
+
+RUNNERS = {"search": run_search, "list": run_list, "tags": run_tags, "chat": run_chat, "create": run_create}
+
+
+async def drive(base_url: str, scenario: str, workload: Workload, total: int, concurrency: int) -> dict:
+    runner = RUNNERS[scenario]
+    samples, first_byte, errors = [], [], 0
+    remaining = iter(range(total))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    ttfb = await runner(client, workload)
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                samples.append((time.perf_counter() - started) * 1000)
+                if ttfb is not None:
+                    first_byte.append(ttfb)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    result = summarize(samples, elapsed)
+    result["errors"] = errors
+    if first_byte:
+        result["time_to_first_byte"] = summarize(first_byte)
+    return result
+
+
+def prepare_dataset(label: str, notes: int, notes_per_user: int, reuse: bool) -> list[uuid.UUID]:
+    with Session(engine) as session:
+        user_ids = find_users(session, label) if reuse else []
+        if user_ids:
+            print(f"Reusing {len(user_ids)} users from dataset '{label}'")
+            return user_ids
+        cleanup(engine, label)
+        user_ids = create_users(session, max(1, notes // notes_per_user), label)
+
+    print(f"Seeding {notes} notes for {len(user_ids)} users...")
+    copy_notes(engine, user_ids, notes)
+    return user_ids
+
+
+def create_chat_sessions(user_ids: list[uuid.UUID]) -> dict:
+    with Session(engine) as session:
+        # A non-default title skips title generation, so every message costs the same
+        chat_sessions = {user_id: ChatSession(user_id=user_id, title="Benchmark") for user_id in user_ids}
+        session.add_all(chat_sessions.values())
+        session.commit()
+        return {user_id: str(chat.id) for user_id, chat in chat_sessions.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--notes", type=int, help="overrides the note count of --scale")
+    parser.add_argument("--notes-per-user", type=int, default=200)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=300, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--search-queries", type=int, default=1000,
+                        help="distinct search strings; fewer means more search cache hits")
+    parser.add_argument("--latency-ms", type=int, default=300, help="stub LLM time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="stub LLM generation speed")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reuse", action="store_true", help="reuse a dataset kept by an earlier --keep run")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded dataset for later --reuse runs")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    notes = args.notes or SCALES[args.scale]
+    label = f"{notes}n"
+    use_stub_llm(args.latency_ms, args.tokens_per_second)
+    limiter.enabled = False
+    settings.DB_ECHO = False
+
+    user_ids = prepare_dataset(label, notes, args.notes_per_user, args.reuse)
+    workload = Workload(user_ids, create_chat_sessions(user_ids), args.search_queries, args.seed)
+
+    results = {"config": {
+        "notes": notes,
+        "users": len(user_ids),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "search_queries": args.search_queries,
+        "embedding_storage": settings.EMBEDDING_STORAGE,
+        "stub_latency_ms": args.latency_ms,
+        "stub_tokens_per_second": args.tokens_per_second,
+    }}
+    try:
+        with serve_in_thread(app) as base_url:
+            for scenario in scenarios:
+                print(f"Running {scenario}...")
+                results[scenario] = asyncio.run(
+                    drive(base_url, scenario, workload, args.requests, args.concurrency)
+                )
+    finally:
+        if not args.keep:
+            cleanup(engine, label)
+
+    write_report("hot_paths", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
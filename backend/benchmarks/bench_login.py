@@ -0,0 +1,136 @@
+"""
+Login throughput, and what a login burst does to the latency of other requests
+served by the same worker (uvicorn in a thread, real bcrypt, rate limiting off).
+
+    python -m benchmarks.bench_login --logins 200 --concurrency 16 --output head.json
+    python -m benchmarks.compare base.json head.json
+
+A probe client calls GET /auth/me at a steady rate, first on an idle server
+("probe_idle") and then while the login burst runs ("probe_during_logins").
+When bcrypt runs on the event loop, every login stalls the probe; off the loop,
+probe latency should stay close to idle.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from sqlmodel import Session
+
+from app.config import settings
+from app.database import engine
+from app.limiter import limiter
+from app.main import app
+from app.models import User
+from app.services.auth_service import create_access_token, get_password_hash
+from benchmarks.common import serve_in_thread, summarize, write_report
+from benchmarks.seed import cleanup, create_users
+
+PASSWORD = "benchmark-password"
+
+
+async def probe(client: httpx.AsyncClient, token: str, interval: float, stop: asyncio.Event) -> list[float]:
+    samples = []
+    headers = {"Authorization": f"Bearer {token}"}
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get("/auth/me", headers=headers)
+        response.raise_for_status()
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return samples
+
+
+async def login_burst(client: httpx.AsyncClient, emails: list[str], total: int, concurrency: int) -> dict:
+    samples, errors = [], 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            started = time.perf_counter()
+            response = await client.post(
+                "/auth/login", data={"username": emails[i % len(emails)], "password": PASSWORD}
+            )
+            if response.status_code != 200:
+                errors += 1
+                continue
+            samples.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(samples, time.perf_counter() - started)
+    result["errors"] = errors
+    return result
+
+
+async def run(base_url: str, emails: list[str], token: str, args) -> dict:
+    interval = args.probe_interval_ms / 1000
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        stop = asyncio.Event()
+        idle = asyncio.create_task(probe(client, token, interval, stop))
+        await asyncio.sleep(args.idle_seconds)
+        stop.set()
+        probe_idle = await idle
+
+        stop = asyncio.Event()
+        busy = asyncio.create_task(probe(client, token, interval, stop))
+        logins = await login_burst(client, emails, args.logins, args.concurrency)
+        stop.set()
+        probe_busy = await busy
+
+    return {
+        "login": logins,
+        "probe_idle": summarize(probe_idle),
+        "probe_during_logins": summarize(probe_busy),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=settings.BCRYPT_ROUNDS, help="bcrypt cost factor")
+    parser.add_argument("--probe-interval-ms", type=float, default=20)
+    parser.add_argument("--idle-seconds", type=float, default=3)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    settings.BCRYPT_ROUNDS = args.rounds
+    limiter.enabled = False
+    settings.DB_ECHO = False
+
+    label = "login"
+    cleanup(engine, label)
+    with Session(engine) as session:
+        user_ids = create_users(session, args.users, label)
+        # One hash at the benchmark cost, so logins never trigger a rehash
+        password_hash = get_password_hash(PASSWORD)
+        users = [session.get(User, user_id) for user_id in user_ids]
+        for user in users:
+            user.password_hash = password_hash
+        session.add_all(users)
+        session.commit()
+        emails = [user.email for user in users]
+    token = create_access_token(data={"sub": str(user_ids[0])})
+
+    results = {"config": {
+        "logins": args.logins,
+        "concurrency": args.concurrency,
+        "bcrypt_rounds": args.rounds,
+        "hash_workers": settings.PASSWORD_HASH_WORKERS,
+        "probe_interval_ms": args.probe_interval_ms,
+    }}
+    try:
+        with serve_in_thread(app) as base_url:
+            results.update(asyncio.run(run(base_url, emails, token, args)))
+    finally:
+        cleanup(engine, label)
+
+    write_report("login", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Recall vs latency for full / halfvec / bit embedding search.
+
+Builds a synthetic clustered corpus in a scratch table (needs pgvector >= 0.7),
+then runs the same two-phase query vector_service.nearest_notes() emits, with the
+HNSW scan settings the app applies (database.tune_hnsw_search). With --owners N the
+rows are spread over N owners and every query is filtered to one of them, like the
+per-user search on a shared note table.
+
+    python -m benchmarks.bench_quantized_search --rows 100000 --queries 200 [--owners 50]
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from app.config import settings
+from app.database import tune_hnsw_search
+from benchmarks.common import summarize, write_report
+
+DIM = 384
+TABLE = "bench_quantized_embeddings"
+
+INDEXES = {
+    "full": f"CREATE INDEX {TABLE}_full ON {TABLE} USING hnsw (embedding vector_cosine_ops)",
+    "halfvec": f"CREATE INDEX {TABLE}_halfvec ON {TABLE} USING hnsw ((embedding::halfvec({DIM})) halfvec_cosine_ops)",
+    "bit": f"CREATE INDEX {TABLE}_bit ON {TABLE} USING hnsw ((binary_quantize(embedding)::bit({DIM})) bit_hamming_ops)",
+}
+
+CANDIDATE_ORDER = {
+    "halfvec": f"embedding::halfvec({DIM}) <=> CAST(:q AS halfvec({DIM}))",
+    "bit": f"binary_quantize(embedding)::bit({DIM}) <~> binary_quantize(CAST(:q AS vector({DIM})))::bit({DIM})",
+}
+
+
+def synthetic_corpus(rows: int, clusters: int, seed: int) -> np.ndarray:
+    # Clustered data looks more like real embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, DIM)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    data = centers[labels] + 0.35 * rng.standard_normal((rows, DIM)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def to_pg(vector) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in vector) + "]"
+
+
+def load_corpus(engine, corpus: np.ndarray, owners: int):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        conn.execute(text(f"CREATE TABLE {TABLE} (id integer PRIMARY KEY, owner integer, embedding vector({DIM}))"))
+
+    buffer = io.StringIO()
+    for i, row in enumerate(corpus):
+        buffer.write(f"{i}\t{i % owners}\t{to_pg(row)}\n")
+    buffer.seek(0)
+
+    raw = engine.raw_connection()
+    try:
+        raw.cursor().copy_expert(f"COPY {TABLE} (id, owner, embedding) FROM STDIN", buffer)
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def run_mode(engine, mode: str, queries: np.ndarray, truth: np.ndarray, k: int, rerank: int) -> dict:
+    with engine.begin() as conn:
+        started = time.perf_counter()
+        conn.execute(text(INDEXES[mode]))
+        build_s = time.perf_counter() - started
+        conn.execute(text(f"ANALYZE {TABLE}"))
+        index_bytes = conn.execute(text(f"SELECT pg_relation_size('{TABLE}_{mode}')")).scalar()
+
+    if mode == "full":
+        sql = text(f"SELECT id FROM {TABLE} WHERE owner = 0 ORDER BY embedding <=> CAST(:q AS vector({DIM})) LIMIT :k")
+    else:
+        sql = text(
+            f"SELECT id FROM {TABLE} WHERE owner = 0 AND id IN ("
+            f"SELECT id FROM {TABLE} WHERE owner = 0 ORDER BY {CANDIDATE_ORDER[mode]} LIMIT :candidates"
+            f") ORDER BY embedding <=> CAST(:q AS vector({DIM})) LIMIT :k"
+        )
+
+    samples, hits = [], 0
+    with engine.connect() as conn:
+        if mode == "full":
+            tune_hnsw_search(conn, k)
+        else:
+            tune_hnsw_search(conn, k * rerank, exact_order=False)
+        started = time.perf_counter()
+        for query, expected in zip(queries, truth):
+            t0 = time.perf_counter()
+            ids = conn.execute(sql, {"q": to_pg(query), "k": k, "candidates": k * rerank}).scalars().all()
+            samples.append((time.perf_counter() - t0) * 1000)
+            hits += len(set(ids) & set(expected.tolist()))
+        elapsed = time.perf_counter() - started
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX {TABLE}_{mode}"))
+
+    return {
+        "recall_at_k": round(hits / (len(queries) * k), 4),
+        "index_bytes": index_bytes,
+        "index_build_s": round(build_s, 2),
+        "latency": summarize(samples, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=settings.EMBEDDING_RERANK_FACTOR)
+    parser.add_argument("--modes", default="full,halfvec,bit")
+    parser.add_argument("--owners", type=int, default=1, help="Spread rows over N owners and search one")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch table afterwards")
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.rows, args.clusters, args.seed)
+    queries = synthetic_corpus(args.queries, args.clusters, args.seed + 1)
+    # Exact top-k on normalized vectors is just the largest dot products, among the
+    # searched owner's rows (ids 0, N, 2N, ...)
+    owned = np.arange(0, args.rows, args.owners)
+    truth = owned[np.argsort(-(queries @ corpus[owned].T), axis=1)[:, : args.k]]
+
+    engine = create_engine(settings.DATABASE_URL)
+    load_corpus(engine, corpus, args.owners)
+
+    results = {"rows": args.rows, "owners": args.owners, "k": args.k, "rerank_factor": args.rerank, "modes": {}}
+    for mode in args.modes.split(","):
+        results["modes"][mode] = run_mode(engine, mode, queries, truth, args.k, args.rerank)
+
+    if not args.keep:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+    write_report("quantized_search", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
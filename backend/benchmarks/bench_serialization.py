@@ -0,0 +1,113 @@
+"""
+Cost of turning 1k notes into a response body: FastAPI's response_model path
+versus encode_rows, and a search cache hit parsed and re-validated versus
+passed through. With --db, also times loading the rows with and without the
+embedding column.
+
+    python -m benchmarks.bench_serialization --notes 1000 --iterations 50 [--db]
+"""
+import argparse
+import json
+import uuid
+from datetime import datetime
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy.orm import defer
+from sqlmodel import Session, select
+
+from app.models import Note
+from app.schemas.note import NoteRead
+from app.serialization import RawJSONResponse, encode_rows
+from benchmarks.common import Timer, summarize, write_report
+
+RESPONSE_FIELD = create_model_field(name="Response", type_=list[NoteRead], mode="serialization")
+
+
+def make_notes(count: int) -> list[Note]:
+    owner_id = uuid.uuid4()
+    return [
+        Note(
+            id=uuid.uuid4(),
+            title=f"Snippet {i}",
+            code_snippet=f"def handler_{i}(request):\n    return {{'ok': {i}}}\n" * 4,
+            language="python",
+            tags="FastAPI, Async, SQL",
+            created_at=datetime.utcnow(),
+            owner_id=owner_id,
+        )
+        for i in range(count)
+    ]
+
+
+async def fastapi_body(notes) -> bytes:
+    # What a response_model endpoint returning ORM rows does
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=notes)
+    return JSONResponse(content).body
+
+
+def measure(fn, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        with Timer(samples):
+            fn()
+    return summarize(samples)
+
+
+def measure_db(count: int, iterations: int) -> dict:
+    from app.database import engine
+    from benchmarks.seed import cleanup, copy_notes, create_users
+
+    with Session(engine) as session:
+        (user_id,) = create_users(session, 1, "serialization")
+    copy_notes(engine, [user_id], count)
+    statement = select(Note).where(Note.owner_id == user_id)
+
+    def load(stmt):
+        with Session(engine) as session:
+            session.exec(stmt).all()
+
+    try:
+        return {
+            "load_with_embedding": measure(lambda: load(statement), iterations),
+            "load_deferred_embedding": measure(lambda: load(statement.options(defer(Note.embedding))), iterations),
+        }
+    finally:
+        cleanup(engine, "serialization")
+
+
+def main():
+    import asyncio
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--db", action="store_true", help="also time row loading against DATABASE_URL")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    notes = make_notes(args.notes)
+    cached = encode_rows(notes, NoteRead).decode()
+    assert json.loads(cached) == json.loads(asyncio.run(fastapi_body(notes)))
+
+    def cache_hit_before():
+        # get_cache() json.loads, then response_model validation and encoding
+        rows = [NoteRead.model_validate(item) for item in json.loads(cached)]
+        asyncio.run(fastapi_body(rows))
+
+    results = {
+        "response_model": measure(lambda: asyncio.run(fastapi_body(notes)), args.iterations),
+        "encode_rows": measure(lambda: RawJSONResponse(encode_rows(notes, NoteRead)), args.iterations),
+        "cache_hit_revalidated": measure(cache_hit_before, args.iterations),
+        "cache_hit_raw": measure(lambda: RawJSONResponse(cached), args.iterations),
+        "payload_bytes": len(cached),
+    }
+    if args.db:
+        results.update(measure_db(args.notes, args.iterations))
+
+    write_report("serialization", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Shared helpers for the benchmark scripts: latency summaries and JSON reports
+that can be diffed between commits.
+"""
+import json
+import math
+import platform
+import socket
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import uvicorn
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def summarize(samples_ms: list[float], elapsed_s: float | None = None) -> dict:
+    """p50/p95/p99 (ms) plus throughput when the wall-clock time is known."""
+    summary = {
+        "count": len(samples_ms),
+        "mean_ms": round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else 0.0,
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+    }
+    if elapsed_s:
+        summary["throughput_rps"] = round(len(samples_ms) / elapsed_s, 2)
+    return summary
+
+
+class Timer:
+    """Context manager that appends the elapsed milliseconds to a list."""
+
+    def __init__(self, samples: list[float]):
+        self.samples = samples
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.append((time.perf_counter() - self.start) * 1000)
+        return False
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def write_report(name: str, results: dict, output: str | None = None) -> dict:
+    report = {
+        "benchmark": name,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "results": results,
+    }
+    payload = json.dumps(report, indent=2)
+    print(payload)
+    if output:
+        with open(output, "w") as f:
+            f.write(payload)
+    return report
+
+
+def use_stub_llm(latency_ms: int, tokens_per_second: float, error_rate: float = 0.0,
+                 keep_token_budget: bool = False):
+    """
+    Routes every LLM call to the offline stub. The Groq tokens-per-minute
+    budgets are lifted unless asked otherwise, since the stub has no quota.
+    """
+    from app.config import settings
+    from app.services import ai_service
+    from app.services.llm_provider import StubProvider
+
+    ai_service.provider = StubProvider(
+        latency_ms=latency_ms, tokens_per_second=tokens_per_second, error_rate=error_rate
+    )
+    # Injected stub failures trip the LLM circuit breaker like Groq outages would
+    ai_service.llm_breaker.failure_types = StubProvider.transient_errors
+    if not keep_token_budget:
+        # The governors read these on first use, so this must happen before any request
+        settings.LLM_TOKENS_PER_MINUTE = {model: 10**9 for model in settings.LLM_TOKENS_PER_MINUTE}
+        settings.LLM_DEFAULT_TOKENS_PER_MINUTE = 10**9
+
+
+@contextmanager
+def serve_in_thread(app):
+    """
+    Runs the ASGI app with uvicorn on a free local port and yields its base URL.
+    A real server is needed to observe streaming (time to first byte).
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
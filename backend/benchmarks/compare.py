@@ -0,0 +1,65 @@
+"""
+Compares two benchmark reports written with --output (any benchmark).
+
+    python -m benchmarks.compare base.json head.json [--fail-above 10]
+
+Prints p50/p95/p99 and throughput for every latency summary found in both
+reports. With --fail-above, exits non-zero when any p95 got slower by more
+than that percentage.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps"]
+
+
+def summaries(node, path=""):
+    """Yields (path, summary) for every nested dict produced by common.summarize()."""
+    if isinstance(node, dict):
+        if "p50_ms" in node:
+            yield path, node
+        for key, value in node.items():
+            yield from summaries(value, f"{path}.{key}" if path else key)
+
+
+def change(base: float, head: float) -> float:
+    return (head - base) / base * 100 if base else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--fail-above", type=float, help="max allowed p95 regression, in percent")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    print(f"{base['benchmark']}: {base['revision']} -> {head['revision']}")
+    base_summaries = dict(summaries(base["results"]))
+    regressions = []
+
+    for path, head_summary in summaries(head["results"]):
+        base_summary = base_summaries.get(path)
+        if not base_summary:
+            continue
+        print(f"\n{path}")
+        for metric in METRICS:
+            if metric not in head_summary or metric not in base_summary:
+                continue
+            delta = change(base_summary[metric], head_summary[metric])
+            print(f"  {metric:<15} {base_summary[metric]:>12.3f} {head_summary[metric]:>12.3f} {delta:>+8.1f}%")
+            if metric == "p95_ms" and args.fail_above is not None and delta > args.fail_above:
+                regressions.append(f"{path} p95 {delta:+.1f}%")
+
+    if regressions:
+        print("\nRegressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Synthetic data for the benchmarks. Everything created here belongs to users
+with a `bench_` email prefix so it can be removed with `cleanup()`. Large
+datasets get a label (`bench_<label>_...`) so they can be kept between runs.
+"""
+import csv
+import io
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlmodel import Session, delete, select
+
+from app.models import ChatMessage, ChatSession, Note, User
+from app.services.tag_service import parse_tags
+
+LANGUAGES = ["python", "typescript", "javascript", "go", "rust", "sql"]
+TAGS = ["FastAPI", "React", "SQL", "Async", "Testing", "Docker", "Redis", "Auth", "CLI", "Regex"]
+
+
+def random_embedding(rng: np.random.Generator) -> list[float]:
+    vector = rng.standard_normal(384).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def create_user(session: Session) -> User:
+    user = User(email=f"bench_{uuid.uuid4().hex[:12]}@kodasync.dev", full_name="Benchmark User")
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    return user
+
+
+def create_users(session: Session, count: int, label: str) -> list[uuid.UUID]:
+    users = [
+        User(email=f"bench_{label}_{uuid.uuid4().hex[:12]}@kodasync.dev", full_name="Benchmark User")
+        for _ in range(count)
+    ]
+    session.add_all(users)
+    session.commit()
+    return [user.id for user in users]
+
+
+def find_users(session: Session, label: str) -> list[uuid.UUID]:
+    return list(session.exec(select(User.id).where(User.email.like(f"bench_{label}_%"))).all())
+
+
+def seed_notes(engine, user_id: uuid.UUID, count: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+    with Session(engine) as session:
+        for i in range(count):
+            session.add(Note(
+                title=f"Snippet {i}",
+                code_snippet=f"def handler_{i}(request):\n    return {{'ok': {i}}}\n",
+                language=picker.choice(LANGUAGES),
+                tags=", ".join(picker.sample(TAGS, 3)),
+                owner_id=user_id,
+                embedding=random_embedding(rng),
+            ))
+            if i % 1000 == 999:
+                session.commit()
+        session.commit()
+
+
+def copy_notes(engine, user_ids: list[uuid.UUID], count: int, seed: int = 1, chunk_size: int = 20_000):
+    """
+    Bulk-loads `count` notes spread round-robin over user_ids, plus their
+    note_tags rows, with COPY. Fast enough for the 1M-note scale.
+    """
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+    started = time.monotonic()
+    base_time = datetime.utcnow()
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        for offset in range(0, count, chunk_size):
+            size = min(chunk_size, count - offset)
+            vectors = rng.standard_normal((size, 384)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+            notes, tags = io.StringIO(), io.StringIO()
+            note_writer, tag_writer = csv.writer(notes), csv.writer(tags)
+            for row, vector in enumerate(vectors):
+                i = offset + row
+                note_id, owner_id = uuid.uuid4(), user_ids[i % len(user_ids)]
+                tag_str = ", ".join(picker.sample(TAGS, 3))
+                note_writer.writerow([
+                    note_id,
+                    f"Snippet {i}",
+                    f"def handler_{i}(request):\n    return {{'ok': {i}}}\n",
+                    picker.choice(LANGUAGES),
+                    tag_str,
+                    i % 50 == 0,
+                    base_time - timedelta(seconds=i),
+                    base_time - timedelta(seconds=i),
+                    owner_id,
+                    "[" + ",".join(f"{x:.6f}" for x in vector) + "]",
+                ])
+                for tag in parse_tags(tag_str):
+                    tag_writer.writerow([note_id, tag, owner_id])
+
+            notes.seek(0)
+            tags.seek(0)
+            cursor.copy_expert(
+                "COPY note (id, title, code_snippet, language, tags, is_pinned, created_at, updated_at, owner_id, embedding) "
+                "FROM STDIN WITH (FORMAT csv)",
+                notes,
+            )
+            cursor.copy_expert("COPY note_tags (note_id, tag, owner_id) FROM STDIN WITH (FORMAT csv)", tags)
+            raw.commit()
+            print(f"  seeded {offset + size}/{count} notes ({time.monotonic() - started:.0f}s)")
+
+        cursor.execute("ANALYZE note")
+        cursor.execute("ANALYZE note_tags")
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def cleanup(engine, label: str | None = None):
+    pattern = f"bench_{label}_%" if label else "bench_%"
+    with Session(engine) as session:
+        user_ids = session.exec(select(User.id).where(User.email.like(pattern))).all()
+        if user_ids:
+            chat_ids = select(ChatSession.id).where(ChatSession.user_id.in_(user_ids))
+            session.exec(delete(ChatMessage).where(ChatMessage.session_id.in_(chat_ids)))
+            session.exec(delete(ChatSession).where(ChatSession.user_id.in_(user_ids)))
+            session.exec(delete(Note).where(Note.owner_id.in_(user_ids)))
+            session.exec(delete(User).where(User.id.in_(user_ids)))
+            session.commit()
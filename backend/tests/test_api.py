@@ -2,11 +2,14 @@ from fastapi.testclient import TestClient
 from sqlmodel import Session, create_engine, select, SQLModel, text
 from app.main import app
 from app.models import User, Note, ChatMessage, ChatSession, Project
-from app.services.auth_service import get_password_hash
+from app.services.auth_service import get_password_hash, create_access_token, create_refresh_token
 from app.config import settings
+from app.services.cache_service import l1_drop, WORKER_ID, encode_frame, decode_frame
 import uuid
+import time
+import hashlib
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 client = TestClient(app)
 
@@ -48,8 +51,23 @@ def mock_redis():
         mock.get.return_value = None
         mock.set.return_value = True
         mock.setex.return_value = True
+        mock.mget.side_effect = lambda keys: [None] * len(keys)
+        # The in-process L1 tier would otherwise carry entries across tests
+        l1_drop()
         yield mock
 
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    # Limits are shared through Redis now, so clear them between tests. Without a
+    # reachable Redis the limiter counts in its in-memory fallback instead.
+    from app.limiter import limiter
+    try:
+        limiter.reset()
+    except Exception:
+        pass
+    limiter._fallback_storage.reset()
+    yield
+
 @pytest.fixture(name="auth_headers")
 def auth_headers_fixture():
     engine = get_test_engine()
@@ -106,6 +124,108 @@ def test_search_note(auth_headers):
     response = client.get("/notes/search/?q=Search")
     assert response.status_code == 200
 
+def test_vector_search_finds_owner_notes_on_shared_table():
+    # Other users' notes crowd the HNSW candidates; the filtered query must still fill its LIMIT
+    from app.database import engine, supports_iterative_scan
+    from app.services.vector_service import nearest_notes, tune_vector_search
+    import random
+    rng = random.Random(7)
+    query = [rng.gauss(0, 1) for _ in range(384)]
+    near = lambda spread: [x + rng.gauss(0, spread) for x in query]
+
+    with Session(engine) as session:
+        me, other = create_test_user(session), create_test_user(session)
+        session.add_all([Note(title="theirs", code_snippet="", language="py", owner_id=other.id, embedding=near(0.3)) for _ in range(500)])
+        session.add_all([Note(title="mine", code_snippet="", language="py", owner_id=me.id, embedding=near(1.5)) for _ in range(5)])
+        session.commit()
+        statement = nearest_notes(select(Note).where(Note.owner_id == me.id), query, limit=3)
+        try:
+            # Make the planner take the ANN index, as it does for users with many notes
+            session.exec(text("DROP INDEX ix_note_owner_updated"))
+            session.exec(text("CREATE INDEX ix_test_note_embedding ON note USING hnsw (embedding vector_cosine_ops)"))
+            session.exec(text("SET LOCAL enable_seqscan = off"))
+            assert session.exec(statement).all() == []  # default ef_search: only others' notes
+
+            ef_search = settings.EMBEDDING_EF_SEARCH if supports_iterative_scan(session.connection()) else 1000
+            with patch.object(settings, "EMBEDDING_EF_SEARCH", ef_search):
+                tune_vector_search(session, limit=3)
+            assert [n.title for n in session.exec(statement).all()] == ["mine"] * 3
+        finally:
+            session.rollback()
+            for user in (me, other):
+                session.exec(text("DELETE FROM note WHERE owner_id = :id").bindparams(id=user.id))
+                session.delete(session.get(User, user.id))
+            session.commit()
+
+def test_search_cache_hit_hydrated_from_note_cache(auth_headers, mock_redis):
+    # Search entries hold packed note ids; bodies are spliced in from note:{id} untouched
+    note_id = uuid.UUID(int=1)
+    body = b'{"id":"00000000-0000-0000-0000-000000000001","title":"Cached"}'
+    mock_redis.get.return_value = encode_frame(note_id.bytes)
+    mock_redis.mget.side_effect = lambda keys: [encode_frame(body) if k == f"note:{note_id}" else None for k in keys]
+    response = client.get("/notes/search/?q=anything")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == b"[" + body + b"]"
+
+def test_cache_frames_compress_large_values():
+    small, large = b'{"a":1}', b'{"code":"' + b"x = 1\n" * 1000 + b'"}'
+    assert decode_frame(encode_frame(small))[0] == small
+    framed = encode_frame(large, soft_expiry=123.0, compute_seconds=0.5)
+    assert len(framed) < len(large) / 10
+    assert decode_frame(framed) == (large, 123.0, 0.5)
+    # Anything written before the frame format is treated as a miss
+    assert decode_frame(b'[{"id":"legacy"}]') is None
+
+@patch("app.routers.notes.generate_tags", new_callable=AsyncMock)
+def test_search_serves_stale_and_refreshes_once(mock_tags, auth_headers, mock_redis):
+    mock_tags.return_value = "swr"
+    key = f"search:{auth_headers.id}:stale query"
+    stale = b'{"id":"00000000-0000-0000-0000-000000000001","title":"Stale"}'
+    store = {key: encode_frame(uuid.UUID(int=1).bytes, soft_expiry=time.time() - 1, compute_seconds=0.01)}
+    mock_redis.get.side_effect = store.get
+    mock_redis.mget.side_effect = lambda keys: [encode_frame(stale) for _ in keys]
+    fresh_id = client.post("/notes/", json={"title": "Fresh", "code_snippet": "x", "language": "py"}).json()["id"]
+
+    # Past the soft expiry: the stale value is served, one refresh runs afterwards
+    response = client.get("/notes/search/", params={"q": "Stale query"})
+    assert response.content == b"[" + stale + b"]"
+    lock_key = f"swr:lock:{key}"
+    assert mock_redis.set.call_args_list[-1].args[0] == lock_key
+    refreshed = [c.args for c in mock_redis.setex.call_args_list if c.args[0] == key]
+    assert len(refreshed) == 1
+    assert decode_frame(refreshed[0][2])[0] == uuid.UUID(fresh_id).bytes
+    assert mock_redis.eval.call_args.args[2] == lock_key
+
+    # Another request already holds the refresh lock: serve stale, no second refresh
+    mock_redis.set.return_value = False
+    client.get("/notes/search/", params={"q": "Stale query"})
+    assert len([c for c in mock_redis.setex.call_args_list if c.args[0] == key]) == 1
+
+def test_conditional_get_notes(auth_headers, mock_redis):
+    versions = {}
+    mock_redis.get.side_effect = lambda key: versions.setdefault(key, "v1") if key.startswith("ver:") else None
+
+    first = client.get("/notes/")
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "private, no-cache"
+
+    again = client.get("/notes/", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+
+    # A committed write replaces the user's notes version
+    with patch("app.routers.notes.generate_tags", new_callable=AsyncMock) as mock_tags:
+        mock_tags.return_value = "Python"
+        client.post("/notes/", json={"title": "T", "code_snippet": "x = 1", "language": "python"})
+    bumped = [c.args[0] for c in mock_redis.pipeline.return_value.set.call_args_list]
+    assert f"ver:{auth_headers.id}:notes" in bumped
+
+    versions[f"ver:{auth_headers.id}:notes"] = "v2"
+    changed = client.get("/notes/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
 def test_delete_lifecycle(auth_headers):
     with patch("app.routers.notes.generate_tags") as mock_tags:
         mock_tags.return_value = "tag"
@@ -115,6 +235,137 @@ def test_delete_lifecycle(auth_headers):
     del_res = client.delete(f"/notes/{note_id}")
     assert del_res.status_code == 200
 
+@patch("app.routers.notes.generate_tags", new_callable=AsyncMock)
+def test_note_delta_sync(mock_tags, auth_headers):
+    mock_tags.return_value = "sync"
+    kept = client.post("/notes/", json={"title": "Kept", "code_snippet": "x", "language": "py"}).json()["id"]
+    gone = client.post("/notes/", json={"title": "Gone", "code_snippet": "y", "language": "py"}).json()["id"]
+
+    full = client.get("/notes/changes").json()
+    assert full["reset"] is True
+    assert {n["id"] for n in full["upserted"]} == {kept, gone}
+
+    client.put(f"/notes/{kept}", json={"title": "Kept v2"})
+    client.delete(f"/notes/{gone}")
+    delta = client.get("/notes/changes", params={"since": full["cursor"]}).json()
+    assert delta["reset"] is False
+    assert [n["title"] for n in delta["upserted"] if n["id"] == kept] == ["Kept v2"]
+    assert gone in delta["deleted"]
+
+    assert client.get("/notes/changes", params={"since": "yesterday"}).status_code == 400
+
+@patch("app.routers.notes.generate_tags", new_callable=AsyncMock)
+def test_note_events_published(mock_tags, auth_headers, mock_redis):
+    mock_tags.return_value = "events"
+    note_id = client.post("/notes/", json={"title": "Ev", "code_snippet": "x", "language": "py"}).json()["id"]
+    client.put(f"/notes/{note_id}", json={"title": "Ev v2"})
+    client.delete(f"/notes/{note_id}")
+
+    frames = [c.args for c in mock_redis.publish.call_args_list if c.args[0].startswith("events:")]
+    assert {channel for channel, _ in frames} == {f"events:{auth_headers.id}"}
+    events = [frame.split("\n")[0] for _, frame in frames]
+    assert events == ["event: note.processed", "event: note.updated", "event: note.deleted"]
+    assert '"title":"Ev v2"' in frames[1][1]
+
+    # Access tokens are not accepted in the URL (they would land in access logs)
+    token = create_access_token(data={"sub": str(auth_headers.id)})
+    assert client.get("/events/stream", params={"token": token}).status_code == 401
+
+@patch("app.routers.notes.generate_tags", new_callable=AsyncMock)
+def test_project_delete_releases_its_notes(mock_tags, auth_headers, mock_redis):
+    mock_tags.return_value = "moved"
+    project_id = client.post("/projects/", json={"name": "Doomed"}).json()["id"]
+    note_id = client.post("/notes/", json={"title": "Kept", "code_snippet": "x", "language": "py",
+                                           "project_id": project_id}).json()["id"]
+    mock_redis.publish.reset_mock()
+
+    assert client.delete(f"/projects/{project_id}").status_code == 200
+    pipe = mock_redis.pipeline.return_value
+    pipe.delete.assert_called_with(f"note:{note_id}")
+    frames = [c.args[1] for c in mock_redis.publish.call_args_list if c.args[0].startswith("events:")]
+    assert frames[0].startswith("event: note.updated") and '"project_id":null' in frames[0]
+    with Session(get_test_engine()) as session:
+        assert session.get(Note, uuid.UUID(note_id)).project_id is None
+
+def test_event_stream_tickets(auth_headers, mock_redis):
+    from fastapi import HTTPException
+    from starlette.requests import Request
+    from app.dependencies import get_stream_user
+    token = create_access_token(data={"sub": str(auth_headers.id)})
+    response = client.post("/events/ticket", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    ticket = response.json()["ticket"]
+    key, value = mock_redis.set.call_args.args
+    # Only a hash of the ticket is stored, with the token's expiry
+    assert ticket not in key and value.startswith(f"{auth_headers.id}:")
+
+    request = Request({"type": "http", "headers": []})
+    mock_redis.getdel.return_value = value.encode()
+    user, expires_at = get_stream_user(request, ticket)
+    assert user.id == auth_headers.id and expires_at > time.time()
+    mock_redis.getdel.assert_called_with(key)
+
+    # Single use: GETDEL finds nothing the second time
+    mock_redis.getdel.return_value = None
+    with pytest.raises(HTTPException) as refused:
+        get_stream_user(request, ticket)
+    assert refused.value.status_code == 401
+
+def test_event_streams_share_one_subscription():
+    import asyncio
+    from app.services import event_service
+
+    class FakePubSub:
+        def __init__(self):
+            self.subscribed, self.inbox = [], asyncio.Queue()
+        async def subscribe(self, channel):
+            self.subscribed.append(channel)
+        async def unsubscribe(self, channel):
+            self.subscribed.remove(channel)
+        async def get_message(self, ignore_subscribe_messages, timeout):
+            try:
+                return await asyncio.wait_for(self.inbox.get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    async def scenario():
+        pubsub = FakePubSub()
+        hub = event_service._get_hub()
+        hub.pubsub = pubsub
+        tabs = [await event_service.open_user_events("u1") for _ in range(2)]
+        assert pubsub.subscribed == ["events:u1"]
+
+        streams = [event_service.stream_user_events(tab, time.time() + 0.5) for tab in tabs]
+        assert [await s.__anext__() for s in streams] == [f"retry: {settings.EVENTS_RETRY_MS}\n\n"] * 2
+        pubsub.inbox.put_nowait({"channel": "events:u1", "data": "event: note.updated\n\n"})
+        assert [await s.__anext__() for s in streams] == ["event: note.updated\n\n"] * 2
+
+        # The stream ends when the access behind it expires
+        frames = [frame async for frame in streams[0]]
+        assert frames[-1].startswith("event: expired")
+        await streams[1].aclose()
+        await asyncio.sleep(0)
+        assert pubsub.subscribed == []
+
+    asyncio.run(scenario())
+
+@patch("app.routers.notes.generate_tags", new_callable=AsyncMock)
+def test_tag_index(mock_tags, auth_headers):
+    mock_tags.return_value = "fastapi, Async, fastapi"
+    note_id = client.post("/notes/", json={"title": "Tagged", "code_snippet": "x", "language": "python"}).json()["id"]
+
+    assert client.get("/notes/tags/").json() == ["Async", "Fastapi"]
+    filtered = client.get("/notes/?tag=fastapi").json()
+    assert [n["id"] for n in filtered] == [note_id]
+
+    # Re-tagging inside a PUT blocks the response, so it runs at interactive priority
+    from app.services.llm_governor import INTERACTIVE
+    client.put(f"/notes/{note_id}", json={"code_snippet": "y"})
+    assert mock_tags.call_args.args == ("y", "python", INTERACTIVE)
+
+    client.delete(f"/notes/{note_id}")
+    assert client.get("/notes/tags/").json() == []
+
 @patch("app.routers.notes.perform_ai_action")
 def test_auto_fix_endpoint(mock_ai, auth_headers):
     # If perform_ai_action is async, we mock the return value directly 
@@ -124,6 +375,174 @@ def test_auto_fix_endpoint(mock_ai, auth_headers):
     assert response.status_code == 200
     assert response.json()["fixed_code"] == "fixed"
 
+@patch("app.routers.notes.stream_ai_action")
+def test_fix_stream_endpoint(mock_stream, auth_headers, mock_redis):
+    mock_stream.return_value = AsyncIterator(["```py\n", "fixed\n", "```"])
+    response = client.post("/notes/fix/stream/", json={"code_snippet": "bug", "language": "python"})
+    assert response.status_code == 200
+    assert response.text == "```py\nfixed\n```"
+    # The full text lands in the same cache entry as /notes/fix/
+    cache_key, _, payload = mock_redis.setex.call_args.args
+    assert cache_key.startswith("fix:")
+    assert b"fixed" in decode_frame(payload)[0]
+
+@patch("app.services.ai_service.routed_complete", new_callable=AsyncMock)
+def test_ai_failures_are_not_cached(mock_complete, auth_headers, mock_redis):
+    # Breaker open / provider down: the fallback text is returned but never cached
+    mock_complete.side_effect = RuntimeError("breaker open")
+    explain = client.post("/notes/explain/", json={"code_snippet": "x = 1", "language": "python"})
+    fix = client.post("/notes/fix/", json={"code_snippet": "x = ", "language": "python"})
+    assert explain.json()["explanation"].startswith("AI could not")
+    assert fix.json()["fixed_code"].startswith("// Error")
+    assert mock_redis.setex.call_count == 0
+
+@patch("app.routers.notes.perform_ai_action")
+def test_fix_cache_is_keyed_by_model_preference(mock_ai, auth_headers, mock_redis):
+    mock_ai.return_value = "fixed"
+    project_id = client.post("/projects/", json={"name": "Pinned", "ai_model_preference": "smart"}).json()["id"]
+    body = {"code_snippet": "pref bug", "language": "python"}
+
+    client.post("/notes/fix/", json=body)
+    client.post("/notes/fix/", json={**body, "project_id": project_id})
+    keys = [c.args[0] for c in mock_redis.setex.call_args_list if c.args[0].startswith("fix:")]
+    assert [k.split(":")[1] for k in keys] == ["auto", "smart"]
+    # The auto answer was not served to the project pinned to the smart model
+    assert mock_ai.call_count == 2
+    assert mock_ai.call_args.args[-1] == "smart"
+
+@patch("app.routers.notes.perform_ai_action")
+def test_l1_cache_in_front_of_redis(mock_ai, auth_headers, mock_redis):
+    mock_ai.return_value = "fixed"
+    body = {"code_snippet": "l1 bug", "language": "python"}
+    client.post("/notes/fix/", json=body)
+    key = mock_redis.setex.call_args.args[0]
+    # The write is broadcast so other workers drop their copy
+    mock_redis.publish.assert_called_with("l1:invalidate", f"{WORKER_ID} key {key}")
+
+    # Served from this worker's memory: no Redis round trip, no second LLM call
+    mock_redis.get.reset_mock()
+    assert client.post("/notes/fix/", json=body).json()["fixed_code"] == "fixed"
+    assert mock_redis.get.call_count == 0
+    assert mock_ai.call_count == 1
+
+    # Another worker's invalidation drops it again
+    l1_drop(key=key)
+    client.post("/notes/fix/", json=body)
+    assert mock_redis.get.call_args.args[0] == key
+
+def test_batched_note_writes_broadcast_l1_invalidations(mock_redis):
+    from app.services.cache_service import set_many, l1_get
+    set_many({"note:batched": b'{"id":"batched"}', "chat:batched": b"{}"}, 60)
+    pipe = mock_redis.pipeline.return_value
+    # Only L1-cached prefixes are announced, in the same round trip as the writes
+    pipe.publish.assert_called_once_with("l1:invalidate", f"{WORKER_ID} key note:batched")
+    pipe.execute.assert_called_once()
+    assert l1_get("note:batched") is not None
+
+def test_batched_note_lookups_record_tier_metrics(mock_redis):
+    from prometheus_client import REGISTRY
+    from app.services.cache_service import get_many_raw, l1_put
+
+    def count(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    tiers = [("l1", "hit"), ("l1", "miss"), ("redis", "hit"), ("redis", "miss")]
+    before = {t: count("kodasync_cache_tier_requests_total", cache="note", tier=t[0], result=t[1]) for t in tiers}
+    hits = count("kodasync_cache_requests_total", cache="note", result="hit")
+
+    l1_put("note:a", (b"A", float("inf"), 0.0), 60)
+    mock_redis.mget.side_effect = lambda keys: [encode_frame(b"B"), None]
+    assert get_many_raw(["note:a", "note:b", "note:c"]) == [b"A", b"B", None]
+
+    after = {t: count("kodasync_cache_tier_requests_total", cache="note", tier=t[0], result=t[1]) for t in tiers}
+    assert {t: after[t] - before[t] for t in tiers} == {
+        ("l1", "hit"): 1, ("l1", "miss"): 2, ("redis", "hit"): 1, ("redis", "miss"): 1,
+    }
+    assert count("kodasync_cache_requests_total", cache="note", result="hit") - hits == 2
+
+def test_login_rehashes_on_cost_change(auth_headers):
+    # The fixture user's hash was made with the default cost (12)
+    with patch.object(settings, "BCRYPT_ROUNDS", 4):
+        response = client.post("/auth/login", data={"username": auth_headers.email, "password": "secret123"})
+        assert response.status_code == 200
+        bad = client.post("/auth/login", data={"username": auth_headers.email, "password": "wrong-pass"})
+        assert bad.status_code == 400
+
+    with Session(get_test_engine()) as session:
+        assert session.get(User, auth_headers.id).password_hash.startswith("$2b$04$")
+
+def test_refresh_tokens_rotate_in_redis(auth_headers, mock_redis):
+    import hashlib
+    import redis
+    from app.services.auth_service import decode_token
+
+    login = client.post("/auth/login", data={"username": auth_headers.email, "password": "secret123"})
+    assert login.status_code == 200
+    refresh = login.json()["refresh_token"]
+    claims = decode_token(refresh)
+    # Only the hash of the token id reaches Redis
+    key = f"rt:{hashlib.sha256(claims['jti'].encode()).hexdigest()}"
+    stored = mock_redis.pipeline.return_value.set.call_args
+    assert stored.args[0] == key and claims["jti"] not in str(stored)
+
+    mock_redis.eval.side_effect = lambda script, numkeys, *args: [1, args[7]]
+    rotated = client.post("/auth/refresh", json={"refresh_token": refresh})
+    assert rotated.status_code == 200
+    assert mock_redis.eval.call_args.args[2] == key
+    new_claims = decode_token(rotated.json()["refresh_token"])
+    assert new_claims["fam"] == claims["fam"] and new_claims["jti"] != claims["jti"]
+
+    # Same token again within the grace period: the token it was rotated to
+    mock_redis.eval.side_effect = None
+    mock_redis.eval.return_value = [2, new_claims["jti"].encode()]
+    again = client.post("/auth/refresh", json={"refresh_token": refresh})
+    assert decode_token(again.json()["refresh_token"])["jti"] == new_claims["jti"]
+
+    # Replay after that: the script revokes the family and reports it dead
+    mock_redis.eval.return_value = [0]
+    assert client.post("/auth/refresh", json={"refresh_token": refresh}).status_code == 401
+
+    # No refresh for an account that no longer exists
+    ghost = create_refresh_token(data={"sub": str(uuid.uuid4()), "fam": "f", "jti": "j"})
+    mock_redis.eval.return_value = [1, "k"]
+    assert client.post("/auth/refresh", json={"refresh_token": ghost}).status_code == 401
+
+    mock_redis.eval.side_effect = redis.exceptions.ConnectionError("down")
+    assert client.post("/auth/refresh", json={"refresh_token": refresh}).status_code == 503
+
+    # Tokens from before the store are honoured once, then moved to Redis
+    legacy = create_refresh_token(data={"sub": str(auth_headers.id)})
+    with Session(get_test_engine()) as session:
+        user = session.get(User, auth_headers.id)
+        user.refresh_token = legacy
+        session.add(user)
+        session.commit()
+    assert "jti" in decode_token(client.post("/auth/refresh", json={"refresh_token": legacy}).json()["refresh_token"])
+    assert client.post("/auth/refresh", json={"refresh_token": legacy}).status_code == 401
+
+def test_redis_circuit_breaker_fails_fast_and_recovers(mock_redis):
+    import redis
+    from app.circuit_breaker import CircuitBreaker
+    from app.services import cache_service
+    breaker = CircuitBreaker("redis", failure_threshold=2, reset_seconds=60,
+                             failure_types=(redis.exceptions.ConnectionError,))
+    mock_redis.get.side_effect = redis.exceptions.ConnectionError("down")
+    with patch.object(cache_service, "redis_breaker", breaker):
+        assert cache_service.get_cache("explain:cb") is None
+        assert cache_service.get_cache("explain:cb") is None
+        assert breaker.state == "open"
+        # Open: misses without touching Redis
+        assert cache_service.get_cache("explain:cb") is None
+        assert mock_redis.get.call_count == 2
+        assert 'kodasync_circuit_state{dependency="redis"} 2.0' in client.get("/metrics").text
+
+        # After the reset window one probe goes through; its success closes the circuit
+        breaker.opened_at -= 60
+        mock_redis.get.side_effect = None
+        mock_redis.get.return_value = encode_frame(b'{"explanation":"ok"}')
+        assert cache_service.get_cache("explain:cb") == {"explanation": "ok"}
+        assert breaker.state == "closed"
+
 @patch("app.routers.chat.stream_chat_with_notes")
 def test_chat_rag(mock_stream, auth_headers):
     # 🚀 FIX: Use AsyncIterator so 'async for' works in the router
@@ -152,4 +571,274 @@ def test_chat_memory(mock_stream, auth_headers):
     messages = hist_res.json()
     
     assert len(messages) >= 2 
-    assert messages[-1]["content"] == "Memory Answer"
\ No newline at end of file
+    assert messages[-1]["content"] == "Memory Answer"
+
+@patch("app.routers.chat.stream_chat_with_notes")
+def test_identical_chat_messages_share_one_answer(mock_stream, auth_headers, mock_redis):
+    session_id = client.post("/chat/sessions").json()["id"]
+    key = f"chat:{auth_headers.id}:global:{hashlib.md5(b'same question').hexdigest()}"
+    answers = iter([None, None, encode_frame(b'{"response":"Shared answer"}')])
+    mock_redis.get.side_effect = lambda k: next(answers) if k == key else None
+    # Another request holds the fill lock and is asking the LLM
+    mock_redis.set.return_value = False
+    mock_redis.exists.return_value = 1
+
+    response = client.post(f"/chat/{session_id}", json={"message": "Same question"})
+    assert response.text == "Shared answer"
+    assert mock_redis.set.call_args.args[0] == f"swr:lock:{key}"
+    mock_stream.assert_not_called()
+
+@patch("app.routers.chat.stream_chat_with_notes")
+def test_failed_chat_answer_is_not_saved_or_cached(mock_stream, auth_headers, mock_redis):
+    from app.services.ai_service import STREAM_ERROR_PREFIX
+    mock_stream.return_value = AsyncIterator(["Partial", f"{STREAM_ERROR_PREFIX}provider down]"])
+    session_id = client.post("/chat/sessions").json()["id"]
+
+    response = client.post(f"/chat/{session_id}", json={"message": "Fails"})
+    assert response.status_code == 200
+    assert "[System Error" in response.text
+
+    messages = client.get(f"/chat/sessions/{session_id}/messages").json()
+    assert [m["role"] for m in messages] == ["user"]
+    assert not [c for c in mock_redis.setex.call_args_list if c.args[0].startswith("chat:")]
+
+def test_reads_follow_recent_writes_to_the_primary(mock_redis):
+    from app import database
+    replica = create_engine(settings.DATABASE_URL)
+    user_id = uuid.uuid4()
+
+    def read_target():
+        sessions = database.get_read_session_for(user_id)
+        bind = next(sessions).get_bind()
+        sessions.close()
+        return bind
+
+    mock_redis.exists.return_value = 0
+    with patch.object(database, "read_engine", replica):
+        assert read_target() is replica
+
+        database.mark_user_write(user_id)
+        mock_redis.setex.assert_called_with(f"rw:{user_id}", settings.READ_YOUR_WRITES_SECONDS, 1)
+        assert read_target() is database.engine
+
+        # Past the local window, the Redis flag (set by any worker) still counts
+        database._recent_writes[str(user_id)] = time.monotonic() - 1
+        mock_redis.exists.return_value = 1
+        assert read_target() is database.engine
+
+        # Window over everywhere: back to the replica
+        mock_redis.exists.return_value = 0
+        assert read_target() is replica
+    replica.dispose()
+
+def test_session_list_uses_one_connection(auth_headers, mock_redis):
+    from sqlalchemy import event
+    from app.database import engine
+    mock_redis.get.side_effect = lambda key: "v1" if key.startswith("ver:") else None
+    empty_id = client.post("/chat/sessions").json()["id"]
+
+    pipe = mock_redis.pipeline.return_value
+    pipe.set.reset_mock()
+    checkouts = []
+    record = lambda *args: checkouts.append(1)
+    event.listen(engine, "checkout", record)
+    try:
+        # The cleanup and the list share the primary connection, so the session the
+        # cleanup just deleted is not listed (a lagging replica could still have it)
+        response = client.get("/chat/sessions")
+        assert response.status_code == 200
+        assert empty_id not in [s["id"] for s in response.json()]
+        assert len(checkouts) == 1
+        # Its ETag would name the version the cleanup's commit replaced
+        assert "etag" not in response.headers
+        assert pipe.set.call_args.args[0] == f"ver:{auth_headers.id}:sessions"
+
+        etag = client.get("/chat/sessions").headers["etag"]
+        assert len(checkouts) == 2
+        # A matching ETag answers without touching the database
+        again = client.get("/chat/sessions", headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert len(checkouts) == 2
+    finally:
+        event.remove(engine, "checkout", record)
+
+def test_metrics_endpoint(auth_headers):
+    client.get("/notes/search/?q=metrics")
+    body = client.get("/metrics").text
+    # Labelled by route template, with the search cache miss and the stages it ran through
+    assert 'kodasync_http_request_seconds_count{method="GET",route="/notes/search/",status="200"}' in body
+    assert 'kodasync_cache_requests_total{cache="search",result="miss"}' in body
+    assert 'kodasync_stage_seconds_count{stage="embedding"}' in body
+    assert 'kodasync_stage_seconds_count{stage="vector_query"}' in body
+
+def test_profiling_on_admin_request(auth_headers, tmp_path):
+    from app.profiling import ProfilingMiddleware
+
+    token = create_access_token(data={"sub": str(auth_headers.id)})
+    headers = {"Authorization": f"Bearer {token}"}
+    profiled = TestClient(ProfilingMiddleware(app))
+
+    with patch.object(settings, "PROFILING_DIR", str(tmp_path)), \
+         patch.object(settings, "PROFILING_ADMIN_EMAILS", [auth_headers.email]):
+        # No header: not profiled, and no principal lookup
+        with patch("app.profiling.load_principal") as lookup:
+            assert "x-profile-id" not in profiled.get("/notes/tags/", headers=headers).headers
+        lookup.assert_not_called()
+
+        response = profiled.get("/notes/tags/", headers={**headers, "X-Profile": "1"})
+        profile_id = response.headers["x-profile-id"]
+        assert [p["id"] for p in client.get("/admin/profiles/").json()] == [profile_id]
+        download = client.get(f"/admin/profiles/{profile_id}")
+        assert download.status_code == 200
+        assert "speedscope" in download.json()["$schema"]
+
+    # Not an admin any more
+    assert client.get("/admin/profiles/").status_code == 403
+
+def test_token_auth_dependency():
+    engine = get_test_engine()
+    with Session(engine) as session:
+        user = create_test_user(session)
+        try:
+            access = create_access_token(data={"sub": str(user.id)})
+            refresh = create_refresh_token(data={"sub": str(user.id)})
+
+            me = client.get("/auth/me", headers={"Authorization": f"Bearer {access}"})
+            assert me.status_code == 200
+            assert me.json()["email"] == user.email
+
+            # Refresh tokens must not be accepted as access tokens
+            assert client.get("/auth/me", headers={"Authorization": f"Bearer {refresh}"}).status_code == 401
+        finally:
+            session.delete(user)
+            session.commit()
+
+def test_llm_requests_are_coalesced():
+    import asyncio
+    from app.services import ai_service
+    from app.services.llm_provider import StubProvider
+
+    stub = StubProvider(latency_ms=50, tokens_per_second=0, error_rate=0)
+
+    async def burst():
+        return await asyncio.gather(*(ai_service.explain_code_snippet("x = 1", "python") for _ in range(5)))
+
+    with patch.object(ai_service, "provider", stub):
+        results = asyncio.run(burst())
+
+    assert len(set(results)) == 1
+    assert stub.calls == 1
+
+    # A background call never becomes the leader an interactive one waits on
+    from app.services.llm_governor import BACKGROUND
+    params = {"model": ai_service.MODEL_FAST, "messages": [{"role": "user", "content": "prio"}]}
+
+    async def mixed():
+        await asyncio.gather(ai_service.complete_text(priority=BACKGROUND, **params),
+                             ai_service.complete_text(**params), ai_service.complete_text(**params))
+
+    with patch.object(ai_service, "provider", stub):
+        asyncio.run(mixed())
+    assert stub.calls == 3
+
+def test_llm_cost_is_capped_at_the_route_limit():
+    from starlette.requests import Request
+    from app.limiter import llm_cost
+
+    def request(**headers):
+        return Request({"type": "http", "headers": [(k.encode(), v.encode()) for k, v in headers.items()]})
+
+    cost = llm_cost(5)
+    assert cost(request(**{"content-length": "100"})) == 1
+    assert cost(request(**{"content-length": "12000"})) == 3
+    # Larger than the whole window: spends it rather than never fitting
+    assert cost(request(**{"content-length": "500000"})) == 5
+    # Unknown size is charged the cap instead of erroring or costing 1
+    assert cost(request(**{"content-length": "abc"})) == 5
+    assert cost(request(**{"transfer-encoding": "chunked"})) == 5
+
+def test_cancelled_coalescing_leader_does_not_strand_followers():
+    import asyncio
+    from app.services import ai_service
+    from app.services.llm_provider import StubProvider
+
+    stub = StubProvider(latency_ms=100, tokens_per_second=0, error_rate=0)
+    params = {"model": ai_service.MODEL_FAST, "messages": [{"role": "user", "content": "x"}]}
+
+    async def scenario():
+        leader = asyncio.create_task(ai_service.complete_text(**params))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(ai_service.complete_text(**params))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.wait_for(follower, timeout=3)
+
+    with patch.object(ai_service, "provider", stub):
+        assert asyncio.run(scenario())
+    assert ai_service._inflight == {}
+
+def test_model_routing_falls_back_to_smart():
+    import asyncio
+    from app.services import ai_service
+    from app.services.llm_provider import StubProvider
+
+    short = ai_service.get_action_messages("x = 1", "python", "document")
+    assert ai_service.choose_model("document", short) == ai_service.MODEL_FAST
+    assert ai_service.choose_model("fix", short) == ai_service.MODEL_SMART
+    assert ai_service.choose_model("fix", short, "fast") == ai_service.MODEL_FAST
+    assert ai_service.choose_model("document", short, "smart") == ai_service.MODEL_SMART
+
+    # The stub never answers with a Markdown code block, so the fast answer fails validation
+    stub = StubProvider(latency_ms=0, tokens_per_second=0, error_rate=0)
+    models = []
+    complete = stub.complete
+
+    async def recording_complete(**params):
+        models.append(params["model"])
+        return await complete(**params)
+
+    with patch.object(ai_service, "provider", stub), patch.object(stub, "complete", recording_complete):
+        asyncio.run(ai_service.perform_ai_action("x = 1", "python", "document"))
+
+    assert models == [ai_service.MODEL_FAST, ai_service.MODEL_SMART]
+
+def test_tag_batch_falls_back_per_item():
+    import asyncio
+    from app.services import ai_service
+
+    reply = 'Sure!\n```json\n{"1": "FastAPI, Async", "2": ["SQL", "Postgres"], "3": ""}\n```'
+    items = [("@app.get('/')", "python"), ("SELECT 1", "sql"), ("fn main() {}", "rust")]
+
+    with patch.object(ai_service, "routed_complete", AsyncMock(return_value=reply)) as batch_call, \
+         patch.object(ai_service, "generate_tags", AsyncMock(return_value="Rust, CLI")) as single_call:
+        tags = asyncio.run(ai_service.generate_tags_batch(items))
+
+    assert tags == ["FastAPI, Async", "SQL, Postgres", "Rust, CLI"]
+    assert batch_call.await_count == 1
+    single_call.assert_awaited_once_with("fn main() {}", "rust")
+
+def test_llm_governor_prefers_interactive():
+    import asyncio
+    from app.services.llm_governor import ModelGovernor, INTERACTIVE, BACKGROUND
+
+    async def scenario():
+        governor = ModelGovernor("test-model")
+        governor.max_concurrency = 2  # one slot is reserved for interactive work
+        order = []
+
+        async def request(name, priority):
+            await governor.acquire(priority, 10)
+            order.append(name)
+            await asyncio.sleep(0.01)
+            governor.release()
+
+        await governor.acquire(BACKGROUND, 10)  # fills the only background slot
+        tasks = [asyncio.create_task(request("tags", BACKGROUND)),
+                 asyncio.create_task(request("chat", INTERACTIVE))]
+        await asyncio.sleep(0)
+        assert order == ["chat"]
+        governor.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["chat", "tags"]